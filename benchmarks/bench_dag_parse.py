@@ -0,0 +1,150 @@
+"""
+Бенчмарк разбора файла DAG, как его выполняет планировщик Airflow.
+
+Файл dags/mobile_apps_retention_dag.py загружается в новом процессе
+(--runs раз): airflow импортируется заранее, как в процессе разбора
+DAG-файлов планировщика, а замеряется только выполнение самого файла.
+Для каждого прогона записываются время разбора, количество DAG и задач
+(как в airflow dags report) и тяжелые модули (pandas, pyarrow, ...),
+оказавшиеся загруженными: они должны импортироваться внутри функций
+задач, а не при разборе.
+
+Результаты дописываются в JSON Lines с хэшем коммита; при указании
+--baseline медианное время больше базового более чем на --tolerance
+или загрузка тяжелого модуля считаются регрессией, и бенчмарк
+завершается с кодом 1.
+
+Модуль DAG импортирует airflow, поэтому пакет apache-airflow должен быть
+установлен (scheduler и база метаданных не нужны).
+
+Использование:
+    python benchmarks/bench_dag_parse.py
+    python benchmarks/bench_dag_parse.py --runs 10 --baseline benchmarks/.data/dag_parse_main.jsonl
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from bench_dag_pipeline import current_commit
+from common import DAGS_DIR, DATA_DIR, measure
+
+DAG_FILE = os.path.join(DAGS_DIR, 'mobile_apps_retention_dag.py')
+
+# Модули, уже загруженные в процессе разбора DAG-файлов планировщика
+PRELOADED_MODULES = [
+    'airflow',
+    'airflow.operators.python_operator',
+    'airflow.utils.dates',
+]
+
+# Модули, которые не должны загружаться при разборе файла DAG
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'openpyxl', 'duckdb', 'sqlite3', 'psycopg2']
+
+
+def parse_dag_file(path):
+    """
+    Выполнение файла DAG в текущем процессе (вызывается через measure)
+    """
+    for name in PRELOADED_MODULES:
+        importlib.import_module(name)
+    before = set(sys.modules)
+
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location('bench_parsed_dag', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    elapsed = time.perf_counter() - started
+
+    dags = [value for value in vars(module).values() if type(value).__name__ == 'DAG']
+    loaded = set(sys.modules) - before
+    return {
+        'seconds': elapsed,
+        'dags': len(dags),
+        'tasks': sum(len(getattr(dag, 'tasks', None) or []) for dag in dags),
+        'modules': len(loaded),
+        'heavy_modules': [name for name in HEAVY_MODULES if name in loaded],
+    }
+
+
+def find_regressions(record, baseline_path, tolerance):
+    """
+    Причины регрессии относительно последней записи базового файла
+    """
+    baseline = None
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                baseline = json.loads(line)
+
+    regressions = []
+    if record['heavy_modules']:
+        regressions.append(f"при разборе загружены модули: {', '.join(record['heavy_modules'])}")
+    if baseline and record['median_seconds'] > baseline['median_seconds'] * (1 + tolerance):
+        regressions.append(
+            f"медиана разбора {baseline['median_seconds']:.4f} с -> {record['median_seconds']:.4f} с"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dag-file', default=DAG_FILE)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', default=os.path.join(DATA_DIR, 'dag_parse.jsonl'))
+    parser.add_argument('--baseline', help="JSON Lines с результатами прошлого коммита")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"{'прогон':>6} {'время, с':>10} {'пик RSS, МБ':>12} {'DAG':>5} {'задач':>6} {'модулей':>8}")
+    runs = []
+    for number in range(1, args.runs + 1):
+        stats, _, peak_mb = measure(parse_dag_file, os.path.abspath(args.dag_file))
+        stats['peak_rss_mb'] = round(peak_mb, 1)
+        runs.append(stats)
+        print(f"{number:>6} {stats['seconds']:>10.4f} {stats['peak_rss_mb']:>12.1f} {stats['dags']:>5} "
+              f"{stats['tasks']:>6} {stats['modules']:>8}")
+
+    seconds = [run['seconds'] for run in runs]
+    record = {
+        'commit': current_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'dag_file': os.path.basename(args.dag_file),
+        'runs': args.runs,
+        'min_seconds': round(min(seconds), 4),
+        'median_seconds': round(statistics.median(seconds), 4),
+        'max_seconds': round(max(seconds), 4),
+        'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+        'dags': runs[-1]['dags'],
+        'tasks': runs[-1]['tasks'],
+        'heavy_modules': sorted({name for run in runs for name in run['heavy_modules']}),
+    }
+    print(f"\nМедиана разбора: {record['median_seconds']:.4f} с "
+          f"(мин. {record['min_seconds']:.4f}, макс. {record['max_seconds']:.4f})")
+    if record['heavy_modules']:
+        print(f"При разборе загружены тяжелые модули: {', '.join(record['heavy_modules'])}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f"Результаты дописаны в {args.output}")
+
+    if args.baseline:
+        regressions = find_regressions(record, args.baseline, args.tolerance)
+        for reason in regressions:
+            print(f"Регрессия: {reason}")
+        if regressions:
+            sys.exit(1)
+        print(f"Регрессий относительно {args.baseline} нет (допуск {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
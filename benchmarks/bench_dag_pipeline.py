@@ -0,0 +1,345 @@
+"""
+Сквозной бенчмарк задач DAG mobile_apps_retention_analysis без развертывания Airflow.
+
+Функции extract_*, transform_data, load_to_database и generate_report
+вызываются напрямую с поддельным контекстом (task_instance с XCom в памяти).
+Входные данные создаются генератором dags/generate_data.py для каждого
+масштаба, пути DAG (данные, staging, хранилище, отчет) перенаправляются
+в рабочий каталог бенчмарка.
+
+Каждая задача выполняется в отдельном процессе (XCom между процессами
+передается через JSON-файл), для нее записываются время, пиковый RSS,
+строк обучения в секунду и размер XCom в байтах (в сериализации JSON,
+как в XCom Airflow по умолчанию); вывод задач сохраняется в logs/ рабочего
+каталога. Проход 1 - холодный запуск, следующие
+проходы используют снимки и кэш этапов. С --execution-mode fused все
+этапы выполняются одной задачей run_fused в одном процессе.
+
+Результаты дописываются в JSON Lines с хэшем коммита; при указании
+--baseline задачи, ставшие медленнее более чем на --tolerance, считаются
+регрессией, и бенчмарк завершается с кодом 1.
+
+Модуль DAG импортирует airflow, поэтому пакет apache-airflow должен быть
+установлен (scheduler и база метаданных не нужны).
+
+Использование:
+    python benchmarks/bench_dag_pipeline.py
+    python benchmarks/bench_dag_pipeline.py --scales 1000 100000 --passes 2 --transform-mode pushdown
+    python benchmarks/bench_dag_pipeline.py --scales 1000 10000 --execution-mode fused
+    python benchmarks/bench_dag_pipeline.py --baseline benchmarks/.data/dag_pipeline_main.jsonl
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from common import DAGS_DIR, DATA_DIR, measure
+
+STAGES = [
+    ('extract_apps', 'extract_apps_data'),
+    ('extract_installs', 'extract_installs_data'),
+    ('extract_uninstalls', 'extract_uninstalls_data'),
+    ('validate_data', 'validate_data'),
+    ('plan_transform_partitions', 'plan_transform_partitions'),
+    ('transform_partition', 'transform_partition'),
+    ('transform_data', 'transform_data'),
+    ('load_to_database', 'load_to_database'),
+    ('generate_report', 'generate_report'),
+]
+
+# Режим fused: все этапы в одной задаче run_fused (одном процессе)
+FUSED_STAGES = [
+    ('run_fused', 'run_fused'),
+]
+
+ANALYSIS_DATE = '2024-01-01'
+
+
+class FakeTaskInstance:
+    """
+    Замена TaskInstance: XCom в словаре {task_id: {key: value}} с учетом размера.
+    Экземпляры размноженной задачи хранятся как task_id[map_index], а xcom_pull
+    по ее task_id возвращает список значений всех экземпляров, как в Airflow.
+    """
+
+    def __init__(self, task_id, xcom, map_index=-1):
+        self.task_id = task_id
+        self.map_index = map_index
+        self.xcom = xcom
+        self.pushed_bytes = 0
+
+    def xcom_push(self, key, value):
+        # Значение проходит через JSON, как при сериализации XCom по умолчанию
+        payload = json.dumps(value, default=str)
+        self.pushed_bytes += len(payload.encode('utf-8'))
+        slot = self.task_id if self.map_index < 0 else f"{self.task_id}[{self.map_index}]"
+        self.xcom.setdefault(slot, {})[key] = json.loads(payload)
+
+    def xcom_pull(self, key='return_value', task_ids=None):
+        if task_ids in self.xcom:
+            return self.xcom[task_ids].get(key)
+        prefix = f"{task_ids}["
+        mapped = sorted(
+            (int(slot[len(prefix):-1]), values) for slot, values in self.xcom.items() if slot.startswith(prefix)
+        )
+        return [values.get(key) for _, values in mapped] or None
+
+
+class FakeDagRun:
+    def __init__(self, conf):
+        self.conf = conf
+
+
+def make_context(task_instance, run_id, params):
+    return {
+        'task_instance': task_instance,
+        'ti': task_instance,
+        'run_id': run_id,
+        'ds': ANALYSIS_DATE,
+        'params': dict(params),
+        'dag_run': FakeDagRun(dict(params)),
+    }
+
+
+def configure_dag_module(workdir, warehouse):
+    """
+    Импорт модуля DAG и перенаправление его путей в рабочий каталог
+    """
+    import mobile_apps_retention_dag as dag_module
+
+    dag_module.DATA_DIR = os.path.join(workdir, 'data')
+    dag_module.STAGING_DIR = os.path.join(workdir, 'staging')
+    dag_module.CACHE_DIR = os.path.join(dag_module.STAGING_DIR, 'cache')
+    dag_module.AGG_STATE_DIR = os.path.join(dag_module.STAGING_DIR, 'dept_state')
+    dag_module.REPORT_DIR = os.path.join(workdir, 'report')
+    dag_module.configure_metrics(f"sqlite:///{os.path.join(workdir, 'metrics.db')}")
+    os.makedirs(dag_module.REPORT_DIR, exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'logs'), exist_ok=True)
+    if warehouse == 'duckdb':
+        dag_module.WAREHOUSE_URL = f"duckdb:///{os.path.join(workdir, 'warehouse.duckdb')}"
+    else:
+        dag_module.WAREHOUSE_URL = f"sqlite:///{os.path.join(workdir, 'warehouse.db')}"
+    return dag_module
+
+
+def run_stage(workdir, task_id, function_name, run_id, params, warehouse, map_index=-1, op_kwargs=None):
+    """
+    Выполнение одной задачи DAG в текущем процессе (вызывается через measure)
+    """
+    xcom_path = os.path.join(workdir, 'xcom.json')
+    xcom = {}
+    if os.path.exists(xcom_path):
+        with open(xcom_path, 'r', encoding='utf-8') as f:
+            xcom = json.load(f)
+
+    dag_module = configure_dag_module(workdir, warehouse)
+    baseline_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    task_instance = FakeTaskInstance(task_id, xcom, map_index)
+    context = make_context(task_instance, run_id, params)
+    context.update(op_kwargs or {})
+    # Вывод задачи пишется в лог рядом с данными, а не в таблицу результатов
+    log_name = f"{run_id}.{task_id}.log" if map_index < 0 else f"{run_id}.{task_id}.{map_index}.log"
+    with open(os.path.join(workdir, 'logs', log_name), 'w', encoding='utf-8') as log:
+        with redirect_stdout(log):
+            started = time.perf_counter()
+            result = getattr(dag_module, function_name)(**context)
+            elapsed = time.perf_counter() - started
+    if result is not None:
+        task_instance.xcom_push('return_value', result)
+
+    with open(xcom_path, 'w', encoding='utf-8') as f:
+        json.dump(xcom, f, default=str)
+
+    return {'seconds': elapsed, 'baseline_rss_mb': baseline_mb, 'xcom_bytes': task_instance.pushed_bytes}
+
+
+def run_mapped_stage(workdir, task_id, function_name, run_id, params, warehouse):
+    """
+    Все экземпляры размноженной задачи по списку op_kwargs из plan_transform_partitions;
+    возвращает суммарные показатели или (None, 0, 0), если экземпляров нет
+    """
+    with open(os.path.join(workdir, 'xcom.json'), 'r', encoding='utf-8') as f:
+        expand_kwargs = json.load(f).get('plan_transform_partitions', {}).get('return_value') or []
+    if not expand_kwargs:
+        return None, 0, 0
+
+    total = {'seconds': 0.0, 'baseline_rss_mb': 0.0, 'xcom_bytes': 0}
+    total_process_seconds = 0.0
+    peak_mb = 0.0
+    for map_index, op_kwargs in enumerate(expand_kwargs):
+        stats, process_seconds, instance_peak_mb = measure(
+            run_stage, workdir, task_id, function_name, run_id, params, warehouse, map_index, op_kwargs
+        )
+        total['seconds'] += stats['seconds']
+        total['xcom_bytes'] += stats['xcom_bytes']
+        total['baseline_rss_mb'] = max(total['baseline_rss_mb'], stats['baseline_rss_mb'])
+        total_process_seconds += process_seconds
+        peak_mb = max(peak_mb, instance_peak_mb)
+    return total, total_process_seconds, peak_mb
+
+
+def generate_inputs(data_dir, employees, seed):
+    """
+    Входные файлы DAG (employees.csv, training.xlsx, courses.json) заданного масштаба
+    """
+    import generate_data
+
+    generate_data.main([
+        '--employees', str(employees), '--seed', str(seed), '--output-dir', data_dir,
+    ])
+
+
+def count_training_rows(data_dir):
+    from retention.excel_stream import iter_excel_batches
+
+    return sum(batch.num_rows for batch in iter_excel_batches(os.path.join(data_dir, 'training.xlsx'), all_sheets=True))
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=DAGS_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_scale(args, employees):
+    """
+    Прогон всех задач DAG на одном масштабе; возвращает записи результатов
+    """
+    workdir = os.path.abspath(os.path.join(args.workdir, f"dag_pipeline_{employees}"))
+    data_dir = os.path.join(workdir, 'data')
+    if not os.path.exists(os.path.join(data_dir, 'training.xlsx')):
+        with redirect_stdout(sys.stderr):
+            generate_inputs(data_dir, employees, args.seed)
+    # Состояние прошлых запусков (staging, кэш, хранилище) удаляется: первый проход холодный
+    for name in os.listdir(workdir):
+        if name != 'data':
+            path = os.path.join(workdir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    training_rows = count_training_rows(data_dir)
+    params = {'transform_mode': args.transform_mode, 'execution_mode': args.execution_mode}
+    stages = FUSED_STAGES if args.execution_mode == 'fused' else STAGES
+    records = []
+    for pass_number in range(1, args.passes + 1):
+        run_id = f"bench__{pass_number}"
+        # XCom у каждого запуска DAG свой
+        xcom_path = os.path.join(workdir, 'xcom.json')
+        if os.path.exists(xcom_path):
+            os.remove(xcom_path)
+        for task_id, function_name in stages:
+            if task_id == 'transform_partition':
+                # Экземпляры размноженной задачи выполняются последовательно, время суммируется
+                stats, process_seconds, peak_mb = run_mapped_stage(
+                    workdir, task_id, function_name, run_id, params, args.warehouse
+                )
+                if stats is None:
+                    continue
+            else:
+                stats, process_seconds, peak_mb = measure(
+                    run_stage, workdir, task_id, function_name, run_id, params, args.warehouse
+                )
+            records.append({
+                'scale': employees,
+                'training_rows': training_rows,
+                'transform_mode': args.transform_mode,
+                'execution_mode': args.execution_mode,
+                'warehouse': args.warehouse,
+                'pass': pass_number,
+                'stage': task_id,
+                'seconds': round(stats['seconds'], 4),
+                'process_seconds': round(process_seconds, 4),
+                'peak_rss_mb': round(peak_mb, 1),
+                'baseline_rss_mb': round(stats['baseline_rss_mb'], 1),
+                'rows_per_second': round(training_rows / stats['seconds']) if stats['seconds'] > 0 else None,
+                'xcom_bytes': stats['xcom_bytes'],
+            })
+            record = records[-1]
+            print(f"{employees:>10} {pass_number:>6} {task_id:>20} {record['seconds']:>10.3f} "
+                  f"{record['peak_rss_mb']:>12.1f} {record['rows_per_second'] or 0:>14,} {record['xcom_bytes']:>12,}")
+    return records
+
+
+def find_regressions(records, baseline_path, tolerance):
+    """
+    Задачи, время которых выросло относительно базового файла более чем на tolerance
+    """
+    baseline = {}
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                key = (record['scale'], record['transform_mode'], record['warehouse'], record['pass'], record['stage'])
+                # Для повторяющихся записей берется последняя
+                baseline[key] = record
+
+    regressions = []
+    for record in records:
+        key = (record['scale'], record['transform_mode'], record['warehouse'], record['pass'], record['stage'])
+        previous = baseline.get(key)
+        if previous and record['seconds'] > previous['seconds'] * (1 + tolerance):
+            regressions.append((record, previous))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="количество сотрудников (около 2.5 строк обучения на сотрудника)")
+    parser.add_argument('--passes', type=int, default=2)
+    parser.add_argument('--transform-mode', choices=['pandas', 'pushdown', 'mapped', 'out_of_core'], default='pandas')
+    parser.add_argument('--execution-mode', choices=['split', 'fused'], default='split')
+    parser.add_argument('--warehouse', choices=['sqlite', 'duckdb'], default='sqlite')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', default=DATA_DIR)
+    parser.add_argument('--output', default=os.path.join(DATA_DIR, 'dag_pipeline.jsonl'))
+    parser.add_argument('--baseline', help="JSON Lines с результатами прошлого коммита")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    run_info = {
+        'commit': current_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+    }
+
+    print(f"{'масштаб':>10} {'проход':>6} {'задача':>20} {'время, с':>10} "
+          f"{'пик RSS, МБ':>12} {'строк/с':>14} {'XCom, байт':>12}")
+    records = []
+    for employees in args.scales:
+        records.extend(bench_scale(args, employees))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps({**run_info, **record}, ensure_ascii=False) + '\n')
+    print(f"\nРезультаты дописаны в {args.output}")
+
+    if args.baseline:
+        regressions = find_regressions(records, args.baseline, args.tolerance)
+        for record, previous in regressions:
+            print(f"Регрессия: {record['stage']} (масштаб {record['scale']}, проход {record['pass']}): "
+                  f"{previous['seconds']:.3f} с -> {record['seconds']:.3f} с")
+        if regressions:
+            sys.exit(1)
+        print(f"Регрессий относительно {args.baseline} нет (допуск {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Бенчмарк чтения training.xlsx: pd.read_excel против потокового
+чтения openpyxl read_only пакетами (retention.excel_stream).
+
+Каждое измерение выполняется в отдельном процессе (benchmarks/common.py),
+чтобы пиковый RSS не накапливался между прогонами.
+
+Использование:
+    python benchmarks/bench_excel_reader.py
+    python benchmarks/bench_excel_reader.py --sizes 10000 1000000 5000000
+"""
+
+import argparse
+import os
+import random
+
+from common import DATA_DIR, measure
+
+# Лимит строк одного листа Excel без учета заголовка
+MAX_SHEET_ROWS = 1048575
+
+
+def generate_workbook(path, rows, seed=42):
+    """
+    Генерация training.xlsx заданного размера в режиме write_only.
+    Если строк больше, чем помещается на лист, они распределяются по листам.
+    """
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    written = 0
+    sheet_index = 0
+    while written < rows:
+        sheet = workbook.create_sheet(f"Sheet{sheet_index + 1}")
+        sheet.append(['employee_id', 'course_id', 'score'])
+        sheet_rows = min(MAX_SHEET_ROWS, rows - written)
+        for _ in range(sheet_rows):
+            sheet.append([rng.randint(1, 100000), rng.randint(1, 10), rng.randint(60, 100)])
+        written += sheet_rows
+        sheet_index += 1
+    workbook.save(path)
+
+
+def _read_pandas(path):
+    import pandas as pd
+
+    sheets = pd.read_excel(path, sheet_name=None)
+    return sum(len(df) for df in sheets.values())
+
+
+def _read_streaming(path):
+    from retention.excel_stream import iter_excel_batches
+
+    return sum(batch.num_rows for batch in iter_excel_batches(path, all_sheets=True))
+
+
+READERS = {
+    'pd.read_excel': _read_pandas,
+    'streaming': _read_streaming,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 1000000, 5000000])
+    parser.add_argument('--workdir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+
+    print(f"{'строк':>10} {'способ':>15} {'время, с':>10} {'строк/с':>12} {'пик RSS, МБ':>12}")
+    for size in args.sizes:
+        path = os.path.join(args.workdir, f"training_{size}.xlsx")
+        if not os.path.exists(path):
+            print(f"Генерация {path}...")
+            generate_workbook(path, size)
+
+        for reader_name in READERS:
+            rows, elapsed, peak_mb = measure(READERS[reader_name], path)
+            if rows != size:
+                raise RuntimeError(f"{reader_name}: прочитано {rows} строк вместо {size}")
+            print(f"{size:>10} {reader_name:>15} {elapsed:>10.2f} {rows / elapsed:>12,.0f} {peak_mb:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Бенчмарк расчета статистики по отделам: два pd.merge + groupby против
+словарно-кодированного объединения (retention.join_engine).
+
+Входные данные генерируются один раз и сохраняются в Arrow, каждый способ
+запускается в отдельном процессе; результаты обоих способов сравниваются.
+
+Использование:
+    python benchmarks/bench_join_engine.py
+    python benchmarks/bench_join_engine.py --rows 10000000 --employees 200000
+"""
+
+import argparse
+import os
+
+from common import DATA_DIR, measure
+
+
+def generate_inputs(workdir, rows, employees, courses, seed=42):
+    """
+    Генерация сотрудников, обучения и курсов в Arrow-файлы
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    departments = np.array(['IT', 'HR', 'Finance', 'Marketing', 'Sales', 'Operations', 'R&D'])
+
+    employees_df = pd.DataFrame({
+        'employee_id': np.arange(1, employees + 1),
+        'department': departments[rng.integers(0, len(departments), employees)],
+    })
+    courses_df = pd.DataFrame({
+        'course_id': np.arange(1, courses + 1),
+        'course_name': [f"Course {i}" for i in range(1, courses + 1)],
+    })
+    # Небольшая доля строк ссылается на несуществующих сотрудников и курсы
+    training_df = pd.DataFrame({
+        'employee_id': rng.integers(1, int(employees * 1.01) + 1, rows),
+        'course_id': rng.integers(1, courses + 2, rows),
+        'score': rng.integers(60, 101, rows),
+    })
+
+    paths = {}
+    for name, df in [('employees', employees_df), ('training', training_df), ('courses', courses_df)]:
+        paths[name] = os.path.join(workdir, f"join_{name}_{rows}.arrow")
+        df.to_feather(paths[name])
+    return paths
+
+
+def _run(method, paths):
+    import pandas as pd
+
+    from retention.join_engine import department_stats, merge_department_stats
+
+    employees_df = pd.read_feather(paths['employees'])
+    training_df = pd.read_feather(paths['training'])
+    courses_df = pd.read_feather(paths['courses'])
+
+    func = department_stats if method == 'encoded' else merge_department_stats
+    return func(employees_df, training_df, courses_df)
+
+
+def _run_merge(paths):
+    return _run('merge', paths)
+
+
+def _run_encoded(paths):
+    return _run('encoded', paths)
+
+
+def _load_only(paths):
+    import pandas as pd
+
+    return sum(len(pd.read_feather(path)) for path in paths.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--employees', type=int, default=100000)
+    parser.add_argument('--courses', type=int, default=10)
+    parser.add_argument('--workdir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    paths = generate_inputs(args.workdir, args.rows, args.employees, args.courses)
+
+    _, load_elapsed, load_peak = measure(_load_only, paths)
+    print(f"Только чтение входов: {load_elapsed:.2f} с, пик RSS {load_peak:.1f} МБ")
+
+    results = {}
+    print(f"{'способ':>10} {'время, с':>10} {'строк/с':>14} {'пик RSS, МБ':>12} {'сверх входов, МБ':>17}")
+    for method, target in [('merge', _run_merge), ('encoded', _run_encoded)]:
+        stats, elapsed, peak_mb = measure(target, paths)
+        results[method] = (stats, elapsed, peak_mb)
+        print(f"{method:>10} {elapsed:>10.2f} {args.rows / elapsed:>14,.0f} {peak_mb:>12.1f} {peak_mb - load_peak:>17.1f}")
+
+    merge_stats, merge_elapsed, merge_peak = results['merge']
+    encoded_stats, encoded_elapsed, encoded_peak = results['encoded']
+    if not merge_stats.equals(encoded_stats):
+        raise RuntimeError("Результаты способов не совпадают")
+
+    print(f"\nРезультаты совпадают. Ускорение: {merge_elapsed / encoded_elapsed:.1f}x, "
+          f"экономия памяти: {merge_peak - encoded_peak:.1f} МБ")
+
+
+if __name__ == '__main__':
+    main()
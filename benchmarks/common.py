@@ -0,0 +1,62 @@
+"""
+Общие функции бенчмарков: замер времени и пикового RSS в отдельном процессе.
+"""
+
+import multiprocessing
+import os
+import queue as queue_module
+import resource
+import sys
+import time
+import traceback
+
+DAGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dags')
+
+# Рабочий каталог бенчмарков по умолчанию (в .gitignore) - рядом с этим файлом,
+# а не относительно текущего каталога
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.data')
+if DAGS_DIR not in sys.path:
+    sys.path.insert(0, DAGS_DIR)
+
+
+def _run(target, args, queue):
+    started = time.perf_counter()
+    try:
+        result = target(*args)
+    except BaseException:
+        # Без ответа в очереди родитель ждал бы его вечно; трассировку
+        # печатает родитель, здесь достаточно кода выхода
+        queue.put(('error', traceback.format_exc()))
+        sys.exit(1)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss в Linux измеряется в килобайтах
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put(('ok', (result, elapsed, peak_mb)))
+
+
+def measure(target, *args):
+    """
+    Запуск target(*args) в отдельном процессе: (результат, секунды, пиковый RSS в МБ).
+    target должен быть функцией уровня модуля, чтобы его можно было передать в spawn.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run, args=(target, args, queue))
+    process.start()
+    # Процесс может погибнуть, не успев ничего положить в очередь (сигнал, OOM):
+    # ответ ждем, пока он жив, и еще раз после его завершения
+    while True:
+        alive = process.is_alive()
+        try:
+            status, payload = queue.get(timeout=1)
+            break
+        except queue_module.Empty:
+            if not alive:
+                process.join()
+                raise RuntimeError(f"Процесс бенчмарка завершился с кодом {process.exitcode} без результата")
+    process.join()
+    if status == 'error':
+        raise RuntimeError(f"Ошибка в процессе бенчмарка:\n{payload}")
+    if process.exitcode != 0:
+        raise RuntimeError(f"Процесс бенчмарка завершился с кодом {process.exitcode}")
+    return payload
@@ -1,169 +1,319 @@
-import pandas as pd
+"""
+Генерация тестовых данных: сотрудники (CSV), обучение (Excel), курсы (JSON).
+
+Данные генерируются векторно (NumPy) и воспроизводимо по --seed.
+Для нагрузочного тестирования сотрудники и обучение делятся на шарды,
+которые генерируются и записываются параллельно в отдельных процессах;
+результат не зависит от числа процессов.
+
+Использование:
+    python dags/generate_data.py
+    python dags/generate_data.py --employees 4000000 --courses-per-employee 1 4 \\
+        --training-format parquet --shards 16 --seed 7
+"""
+
+import argparse
 import json
-import random
-from datetime import datetime
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_DEPARTMENTS = ['IT', 'HR', 'Finance', 'Marketing', 'Sales', 'Operations', 'R&D']
+
+DEFAULT_COURSES = [
+    "Python Programming",
+    "Data Analysis",
+    "Machine Learning",
+    "Web Development",
+    "Database Management",
+    "Project Management",
+    "Business Analytics",
+    "Cloud Computing",
+    "Cybersecurity",
+    "DevOps Fundamentals"
+]
 
-def ensure_data_directory():
+FORMATS = ('csv', 'xlsx', 'json', 'parquet')
+
+# Оценка от 60 до 100 включительно
+SCORE_RANGE = (60, 100)
+
+# Лимит строк одного листа Excel без учета заголовка
+MAX_SHEET_ROWS = 1048575
+
+
+def ensure_data_directory(data_dir='dags/data'):
     """Создает папку data, если она не существует"""
-    data_dir = 'dags/data'
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
         print(f" Создана папка {data_dir}")
     return data_dir
 
-def generate_employees_data(data_dir):
-    """Генерация данных о сотрудниках (CSV)"""
-    print("Генерация данных о сотрудниках...")
-    
-    departments = ['IT', 'HR', 'Finance', 'Marketing', 'Sales', 'Operations', 'R&D']
-    
-    employees_data = {
-        'employee_id': list(range(1, 101)),  # 100 сотрудников
-        'department': [random.choice(departments) for _ in range(100)]
+
+def department_names(count):
+    """Названия отделов: стандартные, при нехватке - пронумерованные"""
+    names = DEFAULT_DEPARTMENTS[:count]
+    names += [f"Department {i}" for i in range(len(names) + 1, count + 1)]
+    return names
+
+
+def course_names(count):
+    """Названия курсов: стандартные, при нехватке - пронумерованные"""
+    names = DEFAULT_COURSES[:count]
+    names += [f"Course {i}" for i in range(len(names) + 1, count + 1)]
+    return names
+
+
+def sample_courses(rng, counts, n_courses):
+    """
+    Выбор counts[i] различных курсов для каждого сотрудника без цикла по сотрудникам.
+
+    Алгоритм Флойда, выполняемый одновременно для всех строк: на шаге s
+    сотрудник с k курсами берет случайное t из [0, n - k + s]; если t уже
+    выбрано, берется n - k + s. Возвращает матрицу индексов курсов
+    (сотрудник x max(counts)) и маску заполненных ячеек.
+    """
+    max_count = int(counts.max()) if len(counts) else 0
+    chosen = np.full((len(counts), max_count), -1, dtype=np.int32)
+    for step in range(max_count):
+        active = step < counts
+        upper = n_courses - counts + step
+        candidate = (rng.random(len(counts)) * (upper + 1)).astype(np.int32)
+        taken = (chosen[:, :step] == candidate[:, None]).any(axis=1)
+        candidate = np.where(taken, upper, candidate)
+        chosen[:, step] = np.where(active, candidate, -1)
+    return chosen, chosen >= 0
+
+
+def generate_shard(spec):
+    """Генерация и запись одного шарда сотрудников и обучения"""
+    rng = np.random.default_rng(spec['seed'])
+    first_id, last_id = spec['employee_range']
+    employee_ids = np.arange(first_id, last_id, dtype=np.int64)
+
+    department_codes = rng.integers(0, len(spec['departments']), len(employee_ids))
+    employees_df = pd.DataFrame({
+        'employee_id': employee_ids,
+        'department': np.array(spec['departments'], dtype=object)[department_codes],
+    })
+
+    low, high = spec['courses_per_employee']
+    counts = rng.integers(low, high + 1, len(employee_ids))
+    chosen, filled = sample_courses(rng, counts, spec['courses'])
+    training_df = pd.DataFrame({
+        'employee_id': np.repeat(employee_ids, counts),
+        'course_id': chosen[filled].astype(np.int64) + 1,
+        'score': rng.integers(SCORE_RANGE[0], SCORE_RANGE[1] + 1, int(counts.sum())),
+    })
+
+    write_frame(employees_df, spec['employees_path'], spec['employees_format'])
+    write_frame(training_df, spec['training_path'], spec['training_format'])
+
+    return {
+        'employees': len(employees_df),
+        'training': len(training_df),
+        'department_counts': np.bincount(department_codes, minlength=len(spec['departments'])),
+        'course_counts': np.bincount(training_df['course_id'], minlength=spec['courses'] + 1)[1:],
+        'score_sum': int(training_df['score'].sum()),
+        'score_min': int(training_df['score'].min()) if len(training_df) else None,
+        'score_max': int(training_df['score'].max()) if len(training_df) else None,
     }
-    
-    df = pd.DataFrame(employees_data)
-    file_path = os.path.join(data_dir, 'employees.csv')
-    df.to_csv(file_path, index=False, encoding='utf-8')
-    print(f" Создан файл {file_path} с {len(df)} записями")
-    
-    return df
-
-def generate_courses_data(data_dir):
+
+
+def write_frame(df, path, fmt):
+    """Запись DataFrame в файл заданного формата"""
+    if fmt == 'csv':
+        df.to_csv(path, index=False, encoding='utf-8')
+    elif fmt == 'parquet':
+        df.to_parquet(path, index=False)
+    elif fmt == 'json':
+        df.to_json(path, orient='records', force_ascii=False)
+    elif fmt == 'xlsx':
+        write_excel(df, path)
+    else:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+
+
+def write_excel(df, path):
+    """Потоковая запись в Excel (write_only); строки сверх лимита листа переносятся на новые листы"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    rows = zip(*(df[column].tolist() for column in df.columns))
+    written = 0
+    sheet_index = 0
+    while True:
+        sheet = workbook.create_sheet(f"Sheet{sheet_index + 1}")
+        sheet.append(list(df.columns))
+        sheet_rows = min(MAX_SHEET_ROWS, len(df) - written)
+        for row in islice(rows, sheet_rows):
+            sheet.append(row)
+        written += sheet_rows
+        sheet_index += 1
+        if written >= len(df):
+            break
+    workbook.save(path)
+
+
+def output_path(data_dir, name, fmt, shard, shards):
+    """employees.csv для одного шарда, employees/part-00000.csv для нескольких"""
+    if shards == 1:
+        return os.path.join(data_dir, f"{name}.{fmt}")
+    shard_dir = os.path.join(data_dir, name)
+    os.makedirs(shard_dir, exist_ok=True)
+    return os.path.join(shard_dir, f"part-{shard:05d}.{fmt}")
+
+
+def generate_courses_data(data_dir, count, fmt='json'):
     """Генерация данных о курсах (JSON)"""
     print("Генерация данных о курсах...")
-    
-    courses = [
-        "Python Programming",
-        "Data Analysis", 
-        "Machine Learning",
-        "Web Development",
-        "Database Management",
-        "Project Management",
-        "Business Analytics",
-        "Cloud Computing",
-        "Cybersecurity",
-        "DevOps Fundamentals"
-    ]
-    
+
     courses_data = [
         {'course_id': i + 1, 'course_name': course}
-        for i, course in enumerate(courses)
+        for i, course in enumerate(course_names(count))
     ]
-    
-    file_path = os.path.join(data_dir, 'courses.json')
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(courses_data, f, indent=2, ensure_ascii=False)
-    
+
+    file_path = os.path.join(data_dir, f"courses.{fmt}")
+    if fmt == 'json':
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(courses_data, f, indent=2, ensure_ascii=False)
+    else:
+        write_frame(pd.DataFrame(courses_data), file_path, fmt)
+
     print(f" Создан файл {file_path} с {len(courses_data)} курсами")
     return courses_data
 
-def generate_training_data(employees_df, courses_data, data_dir):
-    """Генерация данных об обучении (Excel)"""
-    print("Генерация данных об обучении...")
-    
-    training_records = []
-    
-    for employee_id in employees_df['employee_id']:
-        # Каждый сотрудник проходит от 1 до 4 курсов
-        num_courses = random.randint(1, 4)
-        taken_courses = random.sample(courses_data, num_courses)
-        
-        for course in taken_courses:
-            score = random.randint(60, 100)  # Оценка от 60 до 100
-            training_records.append({
-                'employee_id': employee_id,
-                'course_id': course['course_id'],
-                'score': score
-            })
-    
-    training_df = pd.DataFrame(training_records)
-    file_path = os.path.join(data_dir, 'training.xlsx')
-    training_df.to_excel(file_path, index=False, engine='openpyxl')
-    print(f" Создан файл {file_path} с {len(training_df)} записями об обучении")
-    
-    return training_df
-
-def generate_statistics(employees_df, courses_data, training_df, data_dir):
-    """Генерация статистики по данным"""
+
+def generate_sharded_data(data_dir, args):
+    """Параллельная генерация сотрудников и обучения по шардам"""
+    print(f"Генерация сотрудников и обучения: {args.shards} шард(ов), {args.workers} процесс(ов)...")
+
+    departments = department_names(args.departments)
+    bounds = np.linspace(1, args.employees + 1, args.shards + 1).astype(np.int64)
+    # Независимые потоки случайных чисел на шард: результат не зависит от числа процессов
+    seeds = np.random.SeedSequence(args.seed).spawn(args.shards)
+
+    specs = [
+        {
+            'seed': seeds[shard],
+            'employee_range': (int(bounds[shard]), int(bounds[shard + 1])),
+            'departments': departments,
+            'courses': args.courses,
+            'courses_per_employee': tuple(args.courses_per_employee),
+            'employees_path': output_path(data_dir, 'employees', args.employees_format, shard, args.shards),
+            'employees_format': args.employees_format,
+            'training_path': output_path(data_dir, 'training', args.training_format, shard, args.shards),
+            'training_format': args.training_format,
+        }
+        for shard in range(args.shards)
+    ]
+
+    if args.workers > 1 and args.shards > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            summaries = list(executor.map(generate_shard, specs))
+    else:
+        summaries = [generate_shard(spec) for spec in specs]
+
+    summary = {
+        'employees': sum(s['employees'] for s in summaries),
+        'training': sum(s['training'] for s in summaries),
+        'department_counts': dict(zip(departments, sum(s['department_counts'] for s in summaries).tolist())),
+        'course_counts': sum(s['course_counts'] for s in summaries).tolist(),
+        'score_sum': sum(s['score_sum'] for s in summaries),
+        'score_min': min((s['score_min'] for s in summaries if s['score_min'] is not None), default=None),
+        'score_max': max((s['score_max'] for s in summaries if s['score_max'] is not None), default=None),
+    }
+    print(f" Создано {summary['employees']} сотрудников и {summary['training']} записей об обучении")
+    return summary
+
+
+def generate_statistics(summary, courses_data):
+    """Вывод статистики по сгенерированным данным"""
     print("\n📊 СТАТИСТИКА СГЕНЕРИРОВАННЫХ ДАННЫХ:")
     print("=" * 50)
-    
+
     # Статистика по сотрудникам
-    dept_stats = employees_df['department'].value_counts()
-    print(f" Всего сотрудников: {len(employees_df)}")
+    print(f" Всего сотрудников: {summary['employees']}")
     print("Распределение по отделам:")
-    for dept, count in dept_stats.items():
+    for dept, count in sorted(summary['department_counts'].items(), key=lambda item: -item[1]):
         print(f"  - {dept}: {count} сотрудников")
-    
+
     # Статистика по курсам
     print(f"\n Всего курсов: {len(courses_data)}")
-    print("Список курсов:")
-    for course in courses_data:
-        print(f"  - {course['course_id']}: {course['course_name']}")
-    
+
     # Статистика по обучению
-    print(f"\n Всего записей об обучении: {len(training_df)}")
-    print(f"Среднее количество курсов на сотрудника: {len(training_df) / len(employees_df):.1f}")
-    
+    print(f"\n Всего записей об обучении: {summary['training']}")
+    if summary['employees']:
+        print(f"Среднее количество курсов на сотрудника: {summary['training'] / summary['employees']:.1f}")
+
     # Статистика по оценкам
-    avg_score = training_df['score'].mean()
-    max_score = training_df['score'].max()
-    min_score = training_df['score'].min()
-    print(f" Статистика оценок:")
-    print(f"  - Средняя оценка: {avg_score:.1f}")
-    print(f"  - Максимальная оценка: {max_score}")
-    print(f"  - Минимальная оценка: {min_score}")
-    
+    if summary['training']:
+        print(f" Статистика оценок:")
+        print(f"  - Средняя оценка: {summary['score_sum'] / summary['training']:.1f}")
+        print(f"  - Максимальная оценка: {summary['score_max']}")
+        print(f"  - Минимальная оценка: {summary['score_min']}")
+
     # Популярность курсов
-    course_popularity = training_df['course_id'].value_counts().sort_index()
     print(f"\n Популярность курсов:")
-    for course_id, count in course_popularity.items():
-        course_name = next(c['course_name'] for c in courses_data if c['course_id'] == course_id)
-        print(f"  - {course_name}: {count} сотрудников")
-    
-    # Сохраняем статистику в файл
-    stats_data = {
-        'total_employees': len(employees_df),
-        'total_courses': len(courses_data),
-        'total_training_records': len(training_df),
-        'average_courses_per_employee': len(training_df) / len(employees_df),
-        'average_score': avg_score,
-        'max_score': max_score,
-        'min_score': min_score,
-        'department_distribution': dept_stats.to_dict(),
-        'course_popularity': course_popularity.to_dict()
-    }
+    for course, count in zip(courses_data, summary['course_counts']):
+        print(f"  - {course['course_name']}: {count} сотрудников")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--employees', type=int, default=100, help="количество сотрудников")
+    parser.add_argument('--courses', type=int, default=len(DEFAULT_COURSES), help="количество курсов")
+    parser.add_argument('--departments', type=int, default=len(DEFAULT_DEPARTMENTS), help="количество отделов")
+    parser.add_argument('--courses-per-employee', type=int, nargs=2, default=[1, 4], metavar=('MIN', 'MAX'),
+                        help="диапазон числа курсов на сотрудника")
+    parser.add_argument('--seed', type=int, default=None, help="зерно генератора для воспроизводимости")
+    parser.add_argument('--output-dir', default='dags/data')
+    parser.add_argument('--employees-format', choices=FORMATS, default='csv')
+    parser.add_argument('--training-format', choices=FORMATS, default='xlsx')
+    parser.add_argument('--courses-format', choices=FORMATS, default='json')
+    parser.add_argument('--shards', type=int, default=1, help="число шардов сотрудников и обучения")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="число процессов записи")
+    args = parser.parse_args(argv)
 
+    low, high = args.courses_per_employee
+    if not 0 <= low <= high <= args.courses:
+        parser.error("--courses-per-employee: нужно 0 <= MIN <= MAX <= --courses")
+    if args.departments < 1 or args.shards < 1 or args.workers < 1:
+        parser.error("--departments, --shards и --workers должны быть положительными")
+    return args
 
-def main():
+
+def main(argv=None):
     """Основная функция генерации всех данных"""
+    args = parse_args(argv)
     print(" ЗАПУСК ГЕНЕРАЦИИ ТЕСТОВЫХ ДАННЫХ")
     print("=" * 60)
-    
+
     try:
         # Создаем папку для данных
-        data_dir = ensure_data_directory()
-        
+        data_dir = ensure_data_directory(args.output_dir)
+
         # Генерация всех данных
-        employees_df = generate_employees_data(data_dir)
-        courses_data = generate_courses_data(data_dir)
-        training_df = generate_training_data(employees_df, courses_data, data_dir)
-        
+        courses_data = generate_courses_data(data_dir, args.courses, args.courses_format)
+        summary = generate_sharded_data(data_dir, args)
+
         # Показать статистику
-        generate_statistics(employees_df, courses_data, training_df, data_dir)
-        
+        generate_statistics(summary, courses_data)
+
         print("\n ВСЕ ДАННЫЕ УСПЕШНО СГЕНЕРИРОВАНЫ!")
         print(f"\n Созданные файлы в папке {data_dir}:")
-        print("  - employees.csv (данные о сотрудниках)")
-        print("  - courses.json (данные о курсах)") 
-        print("  - training.xlsx (данные об обучении)")
-  
-        
+        for name, fmt in [('employees', args.employees_format), ('courses', args.courses_format),
+                          ('training', args.training_format)]:
+            suffix = f"/part-*.{fmt}" if args.shards > 1 and name != 'courses' else f".{fmt}"
+            print(f"  - {name}{suffix}")
+
     except Exception as e:
         print(f" Ошибка при генерации данных: {str(e)}")
         raise
 
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -7,15 +7,18 @@ DAG для анализа коэффициента удержания мобил
 """
 
 from datetime import datetime, timedelta
-import pandas as pd
-import json
-import sqlite3
+import importlib.util
 import os
 from airflow import DAG
-from airflow.operators.python_operator import PythonOperator
-from airflow.operators.email_operator import EmailOperator
+from airflow.operators.python_operator import BranchPythonOperator, PythonOperator
 from airflow.utils.dates import days_ago
 
+# Планировщик постоянно заново разбирает этот файл, поэтому на уровне модуля
+# импортируются только легкие модули; pandas, pyarrow, openpyxl и модули
+# retention, которые их используют, импортируются внутри функций задач
+from retention.fused import FusedRun, choose_mode, shared_frames, source_bytes
+from retention.metrics import configure as configure_metrics, instrument_task, span
+
 # Конфигурация по умолчанию для DAG
 default_args = {
     'owner': 'student',
@@ -35,135 +38,674 @@ dag = DAG(
     description='Анализ коэффициента удержания мобильных приложений',
     schedule_interval=timedelta(days=1),
     catchup=False,
-    tags=['etl', 'mobile_apps', 'retention', 'variant_30']
+    tags=['etl', 'mobile_apps', 'retention', 'variant_30'],
+    # Способ трансформации, переопределяется в conf запуска: {"transform_mode": "pushdown"};
+    # partition_by (employee/department) - разбиение для режима mapped;
+    # report_granularities - дополнительные отчеты (course, employee) к отчету по отделам;
+    # execution_mode - auto (по размеру источников), fused (одна задача) или split (граф задач);
+    # memory_budget_mb - бюджет памяти режима out_of_core;
+    # sketches - скетчи по отделам (HyperLogLog, гистограмма оценок) в таблице department_sketches;
+    # cube - куб агрегатов (отдел, курс, отдел × курс) в таблице retention_cube, cube_period -
+    # период его ячеек (day, week, month, quarter, year) для свертки на конец периода
+    params={
+        'transform_mode': 'pandas', 'partition_by': 'employee', 'report_granularities': [],
+        'execution_mode': 'auto', 'sketches': False, 'cube': False, 'cube_period': 'day',
+    },
 )
 
 # Пути к файлам данных
 DATA_DIR = '/opt/airflow/dags/data'
 DB_PATH = '/opt/airflow/mobile_apps_retention.db'
 
+# Хранилище результатов: sqlite:///..., duckdb:///... или postgresql://...
+WAREHOUSE_URL = os.environ.get('RETENTION_WAREHOUSE_URL', f'sqlite:///{DB_PATH}')
+
+# Колонки таблицы результатов в порядке загрузки; каждый запуск DAG - раздел
+# по analysis_date (дата запуска), естественный ключ - (analysis_date, department)
+RETENTION_ANALYSIS_COLUMNS = [
+    ('analysis_date', 'TEXT'),
+    ('department', 'TEXT'),
+    ('total_employees', 'INTEGER'),
+    ('total_courses', 'INTEGER'),
+    ('avg_score', 'REAL'),
+]
+
+# Каталог промежуточных артефактов (Arrow/Parquet) между задачами
+STAGING_DIR = '/opt/airflow/staging'
+ARTIFACT_FORMAT = 'arrow'
+
+# Размер пакета строк при потоковом чтении Excel
+EXCEL_BATCH_SIZE = 65536
+
+# Источники относительно DATA_DIR: файл, каталог шардов или glob-шаблон
+# (например 'training/2024-*/*.xlsx'); вместо отсутствующего employees.csv
+# используется каталог employees/
+EMPLOYEES_SOURCE = 'employees.csv'
+TRAINING_SOURCE = 'training.xlsx'
+COURSES_SOURCE = 'courses.json'
+
+# Шарды источника разбираются в пуле из EXTRACT_WORKERS процессов;
+# упорядоченное слияние дает воспроизводимую контрольную сумму артефакта
+EXTRACT_WORKERS = min(4, os.cpu_count() or 1)
+ORDERED_MERGE = True
+
+# Строки, не подходящие под схему источника (retention.schemas):
+# quarantine - отложить в артефакт <источник>_rejected, fail - прервать извлечение
+REJECTED_ROWS = 'quarantine'
+
+# Кэш отпечатков исходных файлов и ключей этапов
+CACHE_DIR = os.path.join(STAGING_DIR, 'cache')
+
+# Каталоги запусков в STAGING_DIR удаляются задачей cleanup_staging, если не изменялись
+# дольше STAGING_RETENTION_DAYS и на их файлы не ссылаются кэш и неотправленные письма
+# (ссылки на архивы отчета в старых письмах после этого недействительны)
+STAGING_RETENTION_DAYS = 7
+
+# Сохраняемое состояние агрегатов по отделам для инкрементального пересчета
+AGG_STATE_DIR = os.path.join(STAGING_DIR, 'dept_state')
+
+# Метрики этапов задач: sqlite:///..., prometheus:///<каталог> или statsd://host:port
+# (несколько через запятую); переменная RETENTION_METRICS_URL имеет приоритет
+METRICS_URL = f"sqlite:///{os.path.join(STAGING_DIR, 'metrics.db')}"
+configure_metrics(METRICS_URL)
+
+# Каталог файлов отчета, прикладываемых к письму: смонтирован на хосте как results/,
+# check_results.py --files читает его без docker cp
+REPORT_DIR = '/opt/airflow/results'
+
+# Сжатие файлов отчета для письма: zip - архив на отчет, gzip - каждый файл, none - без сжатия;
+# архивы пишутся в каталог запуска хранилища артефактов
+ATTACHMENT_COMPRESSION = 'zip'
+
+# Наибольший суммарный размер вложений в письме, байт (с учетом base64 и заголовков MIME);
+# архивы сверх лимита заменяются ссылкой RETENTION_REPORT_LINK_BASE + путь в STAGING_DIR
+# или, если она не задана, путем к файлу
+ATTACHMENT_MAX_BYTES = 5 * 1024 * 1024
+REPORT_LINK_BASE = os.environ.get('RETENTION_REPORT_LINK_BASE')
+
+# Строк отчета по отделам в тексте письма
+EMAIL_TOP_ROWS = 20
+
+# Получатели письма с результатами
+NOTIFICATION_RECIPIENTS = ['test@example.com']
+
+# Доставка писем (retention.notifications): outbox - задача send_email_notification
+# только записывает письмо в таблицу notification_outbox и не ждет SMTP, а отправляет
+# накопившиеся письма следующая задача deliver_notifications (отложенные временной
+# ошибкой - при следующем запуске DAG); direct - задача отправляет письмо сама
+NOTIFICATION_DELIVERY = 'outbox'
+NOTIFICATION_OUTBOX_URL = f"sqlite:///{os.path.join(STAGING_DIR, 'outbox.db')}"
+
+# pandas - инкрементальный пересчет в процессе задачи,
+# pushdown - объединение и агрегация в DuckDB с записью сразу в retention_analysis,
+# mapped - частичные агрегаты по разделам в параллельных задачах (expand) и их свертка,
+# out_of_core - обучение читается частями в пределах бюджета памяти
+TRANSFORM_MODES = ('pandas', 'pushdown', 'mapped', 'out_of_core')
+
+# Бюджет памяти режима out_of_core (МБ), переопределяется в conf запуска: {"memory_budget_mb": 128};
+# пары (отдел, сотрудник) сверх бюджета сбрасываются на диск в SPILL_DIR
+OUT_OF_CORE_MEMORY_MB = 256
+SPILL_DIR = os.path.join(STAGING_DIR, 'spill')
+
+# Режим auto: при суммарном размере исходных файлов не больше FUSED_MAX_SOURCE_BYTES
+# все этапы выполняются одной задачей run_fused, иначе - графом отдельных задач
+FUSED_MAX_SOURCE_BYTES = 32 * 1024 * 1024
+
+# Разделов в режиме mapped не больше TRANSFORM_PARTITIONS (по числу ядер для
+# LocalExecutor) и не меньше MIN_PARTITION_ROWS строк обучения на раздел
+TRANSFORM_PARTITIONS = os.cpu_count() or 1
+MIN_PARTITION_ROWS = 500000
+
+def snapshot_key(source_schema):
+    """
+    Ключ правил разбора источника: схема из реестра и политика отклонения строк
+    """
+    from retention.fingerprint import inputs_key
+    from retention.schemas import get_schema
+    
+    return inputs_key(get_schema(source_schema).describe(), REJECTED_ROWS)
+
+def reuse_snapshot(context, name, source_paths, xcom_key, source_schema):
+    """
+    Передача в XCom манифеста сохраненного снимка, если файлы источника
+    и правила их разбора не изменились
+    """
+    from retention.fingerprint import SourceCache
+    
+    manifest = SourceCache(CACHE_DIR).lookup_source(name, source_paths, snapshot_key(source_schema))
+    if manifest is None:
+        return None
+    context['task_instance'].xcom_push(key=xcom_key, value=manifest)
+    print(f"Файлы источника ({len(source_paths)}) не изменились, используется снимок {manifest['path']}")
+    return manifest
+
+
+def extract_shards(context, name, kind, source_paths, xcom_key, source_schema, options=None):
+    """
+    Разбор файлов источника (параллельно, если шардов несколько) по схеме
+    из реестра в один артефакт staging; манифест передается в XCom
+    и запоминается в кэше
+    """
+    from retention.artifacts import get_artifact_store
+    from retention.fingerprint import SourceCache
+    from retention.schemas import get_schema
+    from retention.shards import extract_source
+    
+    store = get_artifact_store(STAGING_DIR, ARTIFACT_FORMAT)
+    total_bytes = sum(os.path.getsize(path) for path in source_paths)
+    with span('parse', bytes=total_bytes) as parse_span:
+        manifest = extract_source(
+            store, name, context['run_id'], kind, source_paths, get_schema(source_schema), options,
+            max_workers=EXTRACT_WORKERS, ordered=ORDERED_MERGE, on_reject=REJECTED_ROWS,
+        )
+        parse_span.rows = manifest['rows']
+    print(f"Разобрано файлов: {len(source_paths)}, записей: {manifest['rows']}")
+    if 'rejected' in manifest:
+        rejected = manifest['rejected']
+        print(f"Отклонено схемой {source_schema}: {rejected['rows']} строк {rejected['reasons']}, "
+              f"сохранены в {rejected['manifest']['path']}")
+    print("Первые 5 записей:")
+    print(store.read_table(manifest, verify=False).slice(0, 5).to_pandas())
+    
+    context['task_instance'].xcom_push(key=xcom_key, value=manifest)
+    SourceCache(CACHE_DIR).save_source(name, source_paths, manifest, snapshot_key(source_schema))
+    print(f"Данные сохранены в {manifest['path']} ({manifest['bytes']} байт)")
+    return manifest
+
+@instrument_task
 def extract_apps_data(**context):
     """
     Extract: Чтение данных о приложениях из CSV файла
     """
-    print("Начинаем извлечение данных о приложениях из CSV...")
+    from retention.shards import resolve_source
     
-    csv_path = os.path.join(DATA_DIR, 'employees.csv')
+    print("Начинаем извлечение данных о приложениях из CSV...")
     
     try:
-        # Чтение CSV файла
-        employees_df = pd.read_csv(csv_path)
-        print(f"Загружено {len(employees_df)} записей о приложениях")
-        print("Первые 5 записей:")
-        print(employees_df.head())
+        csv_paths = resolve_source(DATA_DIR, EMPLOYEES_SOURCE, '.csv')
         
-        # Сохранение данных для следующих задач
-        employees_data = employees_df.to_dict('records')
-        context['task_instance'].xcom_push(key='employees_data', value=employees_data)
+        # Файлы не изменились с прошлого запуска - повторно используем снимок
+        manifest = reuse_snapshot(context, 'employees', csv_paths, 'employees_manifest', 'employees')
+        if manifest is not None:
+            return f"Использован снимок из {manifest['rows']} записей о приложениях"
         
-        print("Данные о приложениях успешно извлечены и сохранены в XCom")
-        return f"Извлечено {len(employees_df)} записей о приложениях"
+        # Чтение CSV файлов в staging, манифест в XCom
+        manifest = extract_shards(context, 'employees', 'csv', csv_paths, 'employees_manifest', 'employees')
+        return f"Извлечено {manifest['rows']} записей о приложениях"
         
     except Exception as e:
         print(f"Ошибка при извлечении данных о приложениях: {str(e)}")
         raise
 
+@instrument_task
 def extract_installs_data(**context):
     """
     Extract: Чтение данных об установках из Excel файла
     """
-    print("Начинаем извлечение данных об установках из Excel...")
+    from retention.shards import resolve_source
     
-    excel_path = os.path.join(DATA_DIR, 'training.xlsx')
+    print("Начинаем извлечение данных об установках из Excel...")
     
     try:
-        # Чтение Excel файла
-        training_df = pd.read_excel(excel_path)
-        print(f"Загружено {len(training_df)} записей об установках")
-        print("Первые 5 записей:")
-        print(training_df.head())
+        excel_paths = resolve_source(DATA_DIR, TRAINING_SOURCE, '.xlsx')
         
-        # Сохранение данных для следующих задач
-        installs_data = training_df.to_dict('records')
-        context['task_instance'].xcom_push(key='installs_data', value=installs_data)
+        # Файлы не изменились с прошлого запуска - повторно используем снимок
+        manifest = reuse_snapshot(context, 'installs', excel_paths, 'installs_manifest', 'training')
+        if manifest is not None:
+            return f"Использован снимок из {manifest['rows']} записей об установках"
         
-        print("Данные об установках успешно извлечены и сохранены в XCom")
-        return f"Извлечено {len(training_df)} записей об установках"
+        # Потоковое чтение Excel пакетами фиксированного размера прямо в staging;
+        # несколько файлов разбираются параллельно в пуле процессов
+        manifest = extract_shards(
+            context, 'installs', 'xlsx', excel_paths, 'installs_manifest', 'training',
+            options={'batch_size': EXCEL_BATCH_SIZE},
+        )
+        return f"Извлечено {manifest['rows']} записей об установках"
         
     except Exception as e:
         print(f"Ошибка при извлечении данных об установках: {str(e)}")
         raise
 
+@instrument_task
 def extract_uninstalls_data(**context):
     """
     Extract: Чтение данных об удалениях из JSON файла
     """
+    from retention.shards import resolve_source
+    
     print("Начинаем извлечение данных об удалениях из JSON...")
     
-    json_path = os.path.join(DATA_DIR, 'courses.json')
+    try:
+        json_paths = resolve_source(DATA_DIR, COURSES_SOURCE, '.json')
+        
+        # Файлы не изменились с прошлого запуска - повторно используем снимок
+        manifest = reuse_snapshot(context, 'courses', json_paths, 'courses_manifest', 'courses')
+        if manifest is not None:
+            return f"Использован снимок из {manifest['rows']} записей об удалениях"
+        
+        # Чтение JSON файлов в staging, манифест в XCom
+        manifest = extract_shards(context, 'courses', 'json', json_paths, 'courses_manifest', 'courses')
+        return f"Извлечено {manifest['rows']} записей об удалениях"
+        
+    except Exception as e:
+        print(f"Ошибка при извлечении данных об удалениях: {str(e)}")
+        raise
+
+def pull_extract_manifests(context):
+    """
+    Манифесты staging-артефактов из задач извлечения
+    """
+    task_instance = context['task_instance']
+    return {
+        'employees': task_instance.xcom_pull(key='employees_manifest', task_ids='extract_apps'),
+        'training': task_instance.xcom_pull(key='installs_manifest', task_ids='extract_installs'),
+        'courses': task_instance.xcom_pull(key='courses_manifest', task_ids='extract_uninstalls'),
+    }
+
+def push_source_manifests(context, manifests):
+    """
+    Передача в XCom манифестов проверенных артефактов
+    """
+    task_instance = context['task_instance']
+    task_instance.xcom_push(key='employees_manifest', value=manifests['employees'])
+    task_instance.xcom_push(key='installs_manifest', value=manifests['training'])
+    task_instance.xcom_push(key='courses_manifest', value=manifests['courses'])
+
+def pull_source_manifests(context):
+    """
+    Манифесты проверенных staging-артефактов из задачи validate_data
+    """
+    task_instance = context['task_instance']
+    return {
+        'employees': task_instance.xcom_pull(key='employees_manifest', task_ids='validate_data'),
+        'training': task_instance.xcom_pull(key='installs_manifest', task_ids='validate_data'),
+        'courses': task_instance.xcom_pull(key='courses_manifest', task_ids='validate_data'),
+    }
+
+def transform_inputs_key(manifests):
+    """
+    Ключ входов трансформации по контрольным суммам артефактов
+    """
+    from retention.fingerprint import inputs_key
+    
+    return inputs_key(
+        manifests['employees']['checksum'],
+        manifests['training']['checksum'],
+        manifests['courses']['checksum'],
+    )
+
+def get_transform_mode(context):
+    transform_mode = context['params'].get('transform_mode', 'pandas')
+    if transform_mode not in TRANSFORM_MODES:
+        raise ValueError(f"Неизвестный режим трансформации: {transform_mode}. Доступны: {', '.join(TRANSFORM_MODES)}")
+    # Без пакета duckdb режим pushdown упал бы только внутри трансформации
+    if transform_mode == 'pushdown' and importlib.util.find_spec('duckdb') is None:
+        raise ValueError(
+            "Режим трансформации pushdown требует пакет duckdb (requirements.txt), "
+            "он не установлен; выберите другой transform_mode"
+        )
+    return transform_mode
+
+def read_source_artifacts(manifests):
+    """
+    Чтение артефактов сотрудников, обучения и курсов через memory map
+    в DataFrame с компактными типами из реестра схем
+    """
+    from retention.artifacts import store_for_manifest
+    from retention.schemas import get_schema
+    
+    names = ['employees', 'training', 'courses']
+    parts = [manifests[name] for name in names]
+    
+    def read():
+        with span('read', rows=sum(m['rows'] for m in parts), bytes=sum(m['bytes'] for m in parts)):
+            return tuple(
+                get_schema(name).to_pandas(store_for_manifest(manifest, STAGING_DIR).read_table(manifest))
+                for name, manifest in zip(names, parts)
+            )
+    
+    # В режиме fused этапы получают уже прочитанные DataFrame без повторного чтения
+    return shared_frames(tuple(m['checksum'] for m in parts), read)
+
+@instrument_task
+def validate_data(**context):
+    """
+    Validate: Проверка извлеченных данных и карантин отклоненных строк
+    """
+    from retention.artifacts import get_artifact_store, store_for_manifest
+    from retention.fingerprint import SourceCache, inputs_key
+    from retention.schemas import get_schema
+    from retention.validation import (
+        QUARANTINE_COLUMNS, QUARANTINE_DDL, QUARANTINE_KEY, VALIDATION_COUNT_COLUMNS,
+        VALIDATION_COUNT_KEY, count_rows, quarantine_frame, quarantine_rows, rule_set, validate_sources,
+    )
+    from retention.warehouse import get_backend
+    
+    print("Начинаем проверку данных...")
     
     try:
-        # Чтение JSON файла
-        with open(json_path, 'r', encoding='utf-8') as f:
-            courses_data = json.load(f)
+        manifests = pull_extract_manifests(context)
+        analysis_date = context['ds']
+        
+        # Те же входы уже проверены тем же набором правил для этой даты -
+        # передаем сохраненные манифесты
+        validate_key = inputs_key(transform_inputs_key(manifests), rule_set(), analysis_date)
+        cache = SourceCache(CACHE_DIR)
+        validated = cache.stage_result('validate', validate_key)
+        if validated is not None and all(os.path.exists(m['path']) for m in validated.values()):
+            push_source_manifests(context, validated)
+            print("Входные данные не изменились, используется результат прошлой проверки")
+            return "Проверка пропущена: входные данные не изменились"
         
-        courses_df = pd.DataFrame(courses_data)
-        print(f"Загружено {len(courses_df)} записей об удалениях")
-        print("Первые 5 записей:")
-        print(courses_df.head())
+        employees_df, training_df, courses_df = read_source_artifacts(manifests)
+        frames = {'employees': employees_df, 'training': training_df, 'courses': courses_df}
+        with span('validate', rows=sum(len(df) for df in frames.values())):
+            results = validate_sources(employees_df, training_df, courses_df)
+        
+        store = get_artifact_store(STAGING_DIR, ARTIFACT_FORMAT)
+        validated, quarantine, counts = {}, [], {}
+        for name, manifest in manifests.items():
+            result = results[name]
+            counts[name] = dict(result.counts)
+            
+            # Строки, отклоненные схемой источника еще при извлечении
+            if 'rejected' in manifest:
+                rejected_manifest = manifest['rejected']['manifest']
+                rejected_df = store_for_manifest(rejected_manifest, STAGING_DIR).read(rejected_manifest)
+                quarantine.append(quarantine_frame(name, rejected_df, rejected_df['reason']))
+                for reason, rows in manifest['rejected']['reasons'].items():
+                    counts[name][reason] = counts[name].get(reason, 0) + rows
+            
+            if result.rejected_rows == 0:
+                validated[name] = manifest
+                continue
+            
+            # Годные строки записываются в новый артефакт, отклоненные - в карантин
+            df = frames[name]
+            quarantine.append(quarantine_frame(name, df[~result.keep], result.reasons))
+            with span('write', rows=int(result.keep.sum())) as write_span:
+                table = get_schema(name).from_pandas(df[result.keep])
+                validated[name] = store.write_batches(
+                    table.schema, table.to_batches(), f"{manifest['name']}_valid", context['run_id']
+                )
+                write_span.bytes = validated[name]['bytes']
+            print(f"{name}: отклонено {result.rejected_rows} из {len(df)} строк")
         
-        # Сохранение данных для следующих задач
-        context['task_instance'].xcom_push(key='courses_data', value=courses_data)
+        # Отклоненные строки и счетчики правил - в раздел даты запуска хранилища
+        backend = get_backend(WAREHOUSE_URL)
+        backend.ensure_schema(QUARANTINE_DDL)
+        partition = {'analysis_date': analysis_date}
+        with span('quarantine') as quarantine_span:
+            checksum = backend.upsert_partition(
+                'quarantine', QUARANTINE_COLUMNS, QUARANTINE_KEY,
+                quarantine_rows(analysis_date, quarantine), partition=partition
+            )
+            backend.upsert_partition(
+                'validation_counts', VALIDATION_COUNT_COLUMNS, VALIDATION_COUNT_KEY,
+                count_rows(analysis_date, counts), partition=partition
+            )
+            quarantine_span.rows = checksum['rows']
         
-        print("Данные об удалениях успешно извлечены и сохранены в XCom")
-        return f"Извлечено {len(courses_df)} записей об удалениях"
+        print("Нарушения по правилам:")
+        for name, rules in counts.items():
+            print(f"  {name}: {rules or 'нет'}")
+        
+        push_source_manifests(context, validated)
+        cache.save_stage('validate', validate_key, validated)
+        return f"Проверка завершена, в карантине {checksum['rows']} строк"
         
     except Exception as e:
-        print(f"Ошибка при извлечении данных об удалениях: {str(e)}")
+        print(f"Ошибка при проверке данных: {str(e)}")
         raise
 
-def transform_data(**context):
+@instrument_task
+def plan_transform_partitions(**context):
     """
-    Transform: Консолидация данных и расчет коэффициента удержания
+    Transform (план): список разделов для динамического маппинга transform_partition
     """
-    print("Начинаем трансформацию данных...")
+    from retention.fingerprint import SourceCache
+    from retention.partitions import partition_count
+    
+    transform_mode = get_transform_mode(context)
+    if transform_mode != 'mapped':
+        print(f"Режим трансформации {transform_mode}: разбиение на разделы не требуется")
+        return []
+    
+    manifests = pull_source_manifests(context)
+    if SourceCache(CACHE_DIR).stage_result('transform', transform_inputs_key(manifests)) is not None:
+        print("Входные данные не изменились, разделы не нужны")
+        return []
+    
+    partition_by = context['params'].get('partition_by', 'employee')
+    partitions = partition_count(manifests['training']['rows'], TRANSFORM_PARTITIONS, MIN_PARTITION_ROWS)
+    print(f"Разделов трансформации: {partitions} (разбиение по {partition_by})")
+    return [
+        {'partition': partition, 'partitions': partitions, 'partition_by': partition_by}
+        for partition in range(partitions)
+    ]
+
+@instrument_task
+def transform_partition(partition, partitions, partition_by, **context):
+    """
+    Transform (map): частичные агрегаты по отделам для одного раздела
+    """
+    from retention.join_engine import department_partials
+    from retention.partitions import select_partition
+    from retention.sketches import department_sketches, sketch_records
+    
+    print(f"Трансформация раздела {partition + 1} из {partitions} (разбиение по {partition_by})...")
+    
+    try:
+        employees_df, training_df, courses_df = read_source_artifacts(pull_source_manifests(context))
+        
+        with span('merge') as merge_span:
+            employees_part, training_part = select_partition(
+                employees_df, training_df, partition, partitions, partition_by
+            )
+            partial = department_partials(employees_part, training_part, courses_df)
+            merge_span.rows = len(training_part)
+        
+        if context['params'].get('sketches'):
+            # Скетчи раздела сливаются с остальными в transform_data
+            with span('sketch', rows=merge_span.rows):
+                sketches = department_sketches(employees_part, training_part, courses_df)
+            context['task_instance'].xcom_push(key='dept_sketches', value=sketch_records(sketches))
+        
+        print(f"Частичные агрегаты раздела ({merge_span.rows} строк обучения):")
+        print(partial)
+        return partial.to_dict('records')
+        
+    except Exception as e:
+        print(f"Ошибка при трансформации раздела {partition}: {str(e)}")
+        raise
+
+def incremental_dept_stats(manifests):
+    """
+    Статистика по отделам через сохраняемое состояние агрегатов (режим pandas)
+    """
+    from retention.aggregates import DepartmentAggregateState, training_delta
+    from retention.artifacts import store_for_manifest
+    from retention.fingerprint import inputs_key
+    
+    employees_df, training_df, courses_df = read_source_artifacts(manifests)
     
+    print("Данные успешно получены из staging-артефактов")
+    print(f"Сотрудники: {len(employees_df)} записей")
+    print(f"Обучение: {len(training_df)} записей")
+    print(f"Курсы: {len(courses_df)} записей")
+    
+    # Инкрементальный пересчет: если справочники не менялись, в состояние
+    # по отделам вносится только разница с прошлым снимком обучения
+    state = DepartmentAggregateState(AGG_STATE_DIR)
+    previous = state.load()
+    dims_key = inputs_key(manifests['employees']['checksum'], manifests['courses']['checksum'])
+    
+    if (previous is not None and previous['dims_key'] == dims_key
+            and os.path.exists(previous['training_manifest']['path'])):
+        previous_manifest = previous['training_manifest']
+        with span('delta', rows=len(training_df)) as delta_span:
+            previous_training_df = store_for_manifest(previous_manifest, STAGING_DIR).read(previous_manifest)
+            delta_df = training_delta(previous_training_df, training_df)
+            delta_span.bytes = previous_manifest['bytes']
+        print(f"Изменившихся строк обучения: {len(delta_df)}")
+        with span('merge', rows=len(delta_df)):
+            state.apply_delta(employees_df, courses_df, delta_df)
+    else:
+        print("Состояние агрегатов отсутствует или справочники изменились, полный пересчет")
+        with span('merge', rows=len(training_df)):
+            state.rebuild(employees_df, courses_df, training_df)
+    
+    with span('write'):
+        state.save(dims_key, manifests['training'])
+    with span('groupby') as groupby_span:
+        dept_stats = state.dept_stats()
+        groupby_span.rows = len(dept_stats)
+    return dept_stats
 
+def collect_department_sketches(context, manifests, transform_key):
+    """
+    Скетчи по отделам (params sketches): слияние скетчей задач transform_partition
+    в режиме mapped, иначе расчет по staging-артефактам; результат - в кэше этапов
+    """
+    from retention.fingerprint import SourceCache
+    from retention.sketches import department_sketches, merge_sketch_records, sketch_records
+    
+    cache = SourceCache(CACHE_DIR)
+    records = cache.stage_result('sketches', transform_key)
+    if records is None:
+        partials = context['task_instance'].xcom_pull(key='dept_sketches', task_ids='transform_partition')
+        with span('sketch') as sketch_span:
+            if get_transform_mode(context) == 'mapped' and partials:
+                sketches = merge_sketch_records(*partials)
+            else:
+                sketches = department_sketches(*read_source_artifacts(manifests))
+            records = sketch_records(sketches)
+            sketch_span.rows = sum(record['records'] for record in records)
+        cache.save_stage('sketches', transform_key, records)
+    
+    context['task_instance'].xcom_push(key='dept_sketches', value=records)
+    print(f"Скетчи по отделам: {len(records)}")
+    return records
 
+def collect_rollup_cube(context, manifests, transform_key):
+    """
+    Куб агрегатов (params cube) за один проход по объединению в staging-артефакт;
+    манифест передается задаче загрузки через XCom и сохраняется в кэше этапов
+    """
+    from retention.artifacts import get_artifact_store
+    from retention.cube import rollup_cube
+    from retention.fingerprint import SourceCache
+    
+    cache = SourceCache(CACHE_DIR)
+    manifest = cache.stage_result('cube', transform_key)
+    if manifest is None or not os.path.exists(manifest['path']):
+        employees_df, training_df, courses_df = read_source_artifacts(manifests)
+        with span('cube', rows=len(training_df)):
+            cube = rollup_cube(employees_df, training_df, courses_df)
+        with span('write', rows=len(cube)) as write_span:
+            manifest = get_artifact_store(STAGING_DIR, ARTIFACT_FORMAT).write(cube, 'retention_cube', context['run_id'])
+            write_span.bytes = manifest['bytes']
+        cache.save_stage('cube', transform_key, manifest)
+    
+    context['task_instance'].xcom_push(key='cube_manifest', value=manifest)
+    print(f"Ячеек куба агрегатов: {manifest['rows']}")
+    return manifest
+
+def out_of_core_dept_stats(context, manifests):
+    """
+    Статистика по отделам по частям обучения в пределах бюджета памяти (режим out_of_core)
+    """
+    from retention.artifacts import store_for_manifest
+    from retention.out_of_core import chunked_department_stats, plan_budget
+    from retention.schemas import get_schema
+    
+    memory_bytes = int(context['params'].get('memory_budget_mb') or OUT_OF_CORE_MEMORY_MB) * 1024 * 1024
+    chunk_rows, _ = plan_budget(memory_bytes)
+    
+    # Справочники небольшие и читаются целиком, обучение - частями по chunk_rows строк
+    employees_df, courses_df = (
+        get_schema(name).to_pandas(store_for_manifest(manifests[name], STAGING_DIR).read_table(manifests[name]))
+        for name in ('employees', 'courses')
+    )
+    training = manifests['training']
+    schema = get_schema('training')
+    chunks = (
+        schema.to_pandas(table)
+        for table in store_for_manifest(training, STAGING_DIR).iter_tables(training, chunk_rows)
+    )
+    
+    print(f"Бюджет памяти {memory_bytes // (1024 * 1024)} МБ: части по {chunk_rows} строк обучения")
+    with span('merge', rows=training['rows'], bytes=training['bytes']):
+        dept_stats, info = chunked_department_stats(employees_df, courses_df, chunks, memory_bytes, SPILL_DIR)
+    print(f"Обработано частей: {info['chunks']} ({info['rows']} строк), "
+          f"сбросов уникальных пар на диск: {info['spills']}")
+    return dept_stats
 
+@instrument_task
+def transform_data(**context):
+    """
+    Transform: Консолидация данных и расчет коэффициента удержания
+    """
+    from retention.fingerprint import SourceCache, inputs_key
+    from retention.join_engine import combine_partials
+    from retention.pushdown import load_department_stats
+    from retention.warehouse import get_backend
+    
+    print("Начинаем трансформацию данных...")
+    
     try:
-        # Получение данных из предыдущих задач - ИСПРАВЛЕННЫЕ ИМЕНА
-        employees_data = context['task_instance'].xcom_pull(key='employees_data', task_ids='extract_apps')
-        training_data = context['task_instance'].xcom_pull(key='installs_data', task_ids='extract_installs')
-        courses_data = context['task_instance'].xcom_pull(key='courses_data', task_ids='extract_uninstalls')
-        
-        # Преобразование в DataFrame
-        employees_df = pd.DataFrame(employees_data)
-        training_df = pd.DataFrame(training_data)
-        courses_df = pd.DataFrame(courses_data)
-        
-        print("Данные успешно получены из XCom")
-        print(f"Сотрудники: {len(employees_df)} записей")
-        print(f"Обучение: {len(training_df)} записей")
-        print(f"Курсы: {len(courses_df)} записей")
-        
-        # Объединение данных
-        # Сначала объединяем сотрудников с обучением
-        merged_df = pd.merge(employees_df, training_df, on='employee_id', how='inner')
-        print(f"После объединения с обучением: {len(merged_df)} записей")
-        
-        # Затем объединяем с курсами
-        final_df = pd.merge(merged_df, courses_df, on='course_id', how='inner')
-        print(f"После объединения с курсами: {len(final_df)} записей")
-
-        # Расчет средней оценки по отделам
-        dept_stats = final_df.groupby('department').agg(
-            total_employees=('employee_id', 'nunique'),
-            total_courses=('course_id', 'count'),
-            avg_score=('score', 'mean')
-        ).reset_index()
-
-        dept_stats['avg_score'] = dept_stats['avg_score'].round(2)
+        # Получение манифестов артефактов из предыдущих задач
+        manifests = pull_source_manifests(context)
+        
+        # Если ни один из входов не изменился, повторно используем прошлый результат
+        cache = SourceCache(CACHE_DIR)
+        transform_key = transform_inputs_key(manifests)
+        context['task_instance'].xcom_push(key='transform_key', value=transform_key)
+        if context['params'].get('sketches'):
+            collect_department_sketches(context, manifests, transform_key)
+        if context['params'].get('cube'):
+            collect_rollup_cube(context, manifests, transform_key)
+        cached_stats = cache.stage_result('transform', transform_key)
+        if cached_stats is not None:
+            context['task_instance'].xcom_push(key='dept_stats', value=cached_stats)
+            print("Входные данные не изменились, используется сохраненный результат трансформации")
+            return f"Проанализировано {len(cached_stats)} отделов (без изменений)"
+        
+        transform_mode = get_transform_mode(context)
+        print(f"Режим трансформации: {transform_mode}")
+        
+        if transform_mode == 'pushdown':
+            # Расчет в DuckDB по staging-артефактам и загрузка раздела за дату запуска;
+            # задача load_to_database найдет сохраненный этап и пропустит загрузку
+            analysis_date = context['ds']
+            backend = get_backend(WAREHOUSE_URL)
+            backend.ensure_schema()
+            with span('pushdown', rows=manifests['training']['rows']):
+                dept_stats, checksum = load_department_stats(
+                    backend, manifests, STAGING_DIR, 'retention_analysis', RETENTION_ANALYSIS_COLUMNS,
+                    ['analysis_date', 'department'], partition={'analysis_date': analysis_date},
+                )
+            print(dept_stats)
+            print(f"Загружено {checksum['rows']} записей в раздел {analysis_date}")
+            
+            result_data = dept_stats.to_dict('records')
+            context['task_instance'].xcom_push(key='dept_stats', value=result_data)
+            cache.save_stage('transform', transform_key, result_data)
+            cache.save_stage('load', inputs_key(transform_key, analysis_date), {'rows': checksum['rows']})
+            return f"Проанализировано {len(dept_stats)} отделов (pushdown)"
+        
+        if transform_mode == 'mapped':
+            # Свертка частичных агрегатов, посчитанных задачами transform_partition
+            partials = list(context['task_instance'].xcom_pull(task_ids='transform_partition') or [])
+            if not partials:
+                raise ValueError("Нет частичных агрегатов от задач transform_partition")
+            with span('reduce', rows=len(partials)):
+                dept_stats = combine_partials(partials)
+            print(f"Свернуто разделов: {len(partials)}")
+        elif transform_mode == 'out_of_core':
+            dept_stats = out_of_core_dept_stats(context, manifests)
+        else:
+            dept_stats = incremental_dept_stats(manifests)
 
         print("Результаты по отделам:")
         print(dept_stats)
@@ -171,6 +713,7 @@ def transform_data(**context):
         # Сохранение результатов для загрузки в БД
         result_data = dept_stats.to_dict('records')
         context['task_instance'].xcom_push(key='dept_stats', value=result_data)
+        cache.save_stage('transform', transform_key, result_data)
         
         print("Трансформация данных завершена успешно")
         return f"Проанализировано {len(dept_stats)} отделов"
@@ -184,10 +727,17 @@ def transform_data(**context):
 
 
 
+@instrument_task
 def load_to_database(**context):
     """
-    Load: Загрузка результатов анализа в SQLite базу данных
+    Load: Загрузка результатов анализа в хранилище (по умолчанию SQLite)
     """
+    from retention.artifacts import store_for_manifest
+    from retention.cube import CUBE_COLUMNS, CUBE_DDL, CUBE_KEY, cube_rows, period_label
+    from retention.fingerprint import SourceCache, inputs_key
+    from retention.sketches import SKETCH_COLUMNS, SKETCH_DDL, SKETCH_KEY, sketch_rows
+    from retention.warehouse import get_backend
+    
     print("Начинаем загрузку данных в базу данных...")
     
     try:
@@ -200,48 +750,66 @@ def load_to_database(**context):
         if not dept_stats:
             raise ValueError("Нет данных для загрузки в базу данных")
         
-        # Создание DataFrame из результатов
-        dept_stats_df = pd.DataFrame(dept_stats)
-        
-        # Подключение к SQLite базе данных
-        conn = sqlite3.connect(DB_PATH)
-        
-        try:
-            # Создание таблицы если она не существует
-            create_table_query = """
-            CREATE TABLE IF NOT EXISTS retention_analysis (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                department TEXT NOT NULL,
-                total_employees INTEGER NOT NULL,
-                total_courses INTEGER NOT NULL,
-                avg_score REAL NOT NULL,
-                analysis_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        analysis_date = context['ds']
+        
+        # Скетчи по отделам (params sketches) - в раздел даты таблицы department_sketches
+        sketches = context['task_instance'].xcom_pull(key='dept_sketches', task_ids='transform_data')
+        if sketches:
+            backend = get_backend(WAREHOUSE_URL)
+            backend.ensure_schema(SKETCH_DDL)
+            with span('sketches', rows=len(sketches)):
+                backend.upsert_partition(
+                    'department_sketches', SKETCH_COLUMNS, SKETCH_KEY,
+                    sketch_rows(analysis_date, sketches), partition={'analysis_date': analysis_date}
+                )
+            print(f"Скетчи {len(sketches)} отделов загружены в раздел {analysis_date}")
+        
+        # Ячейки куба агрегатов (params cube) - в раздел даты таблицы retention_cube
+        cube_manifest = context['task_instance'].xcom_pull(key='cube_manifest', task_ids='transform_data')
+        if cube_manifest:
+            cube = store_for_manifest(cube_manifest, STAGING_DIR).read(cube_manifest)
+            period = period_label(analysis_date, context['params'].get('cube_period') or 'day')
+            backend = get_backend(WAREHOUSE_URL)
+            backend.ensure_schema(CUBE_DDL)
+            with span('cube', rows=len(cube)):
+                backend.upsert_partition(
+                    'retention_cube', CUBE_COLUMNS, CUBE_KEY,
+                    cube_rows(analysis_date, period, cube), partition={'analysis_date': analysis_date}
+                )
+            print(f"Куб агрегатов ({len(cube)} ячеек, период {period}) загружен в раздел {analysis_date}")
+        
+        # Те же результаты уже загружены в раздел этой даты - повторная загрузка не нужна
+        transform_key = context['task_instance'].xcom_pull(key='transform_key', task_ids='transform_data')
+        load_key = inputs_key(transform_key, analysis_date)
+        cache = SourceCache(CACHE_DIR)
+        if (cache.stage_result('load', load_key) is not None
+                and 'retention_analysis' in get_backend(WAREHOUSE_URL).list_tables()):
+            print("Результаты трансформации не изменились, загрузка пропущена")
+            return f"Загрузка пропущена: {len(dept_stats)} записей уже в базе данных"
+        
+        # Хранилище результатов (SQLite/DuckDB/Postgres) с пулом соединений
+        backend = get_backend(WAREHOUSE_URL)
+        backend.ensure_schema()
+        
+        # Upsert раздела за дату запуска пакетной загрузкой бэкенда в одной транзакции,
+        # с проверкой раздела по количеству строк и контрольным суммам
+        names = [name for name, _ in RETENTION_ANALYSIS_COLUMNS]
+        rows = (
+            tuple(analysis_date if name == 'analysis_date' else record[name] for name in names)
+            for record in dept_stats
+        )
+        with span('write', rows=len(dept_stats)):
+            checksum = backend.upsert_partition(
+                'retention_analysis', RETENTION_ANALYSIS_COLUMNS,
+                ['analysis_date', 'department'], rows, partition={'analysis_date': analysis_date}
             )
-            """
-            conn.execute(create_table_query)
-            
-            # Очистка таблицы перед загрузкой новых данных
-            conn.execute("DELETE FROM retention_analysis")
-            
-            # Загрузка данных в таблицу
-            dept_stats_df.to_sql('retention_analysis', conn, if_exists='append', index=False)
-            
-            # Подтверждение транзакции
-            conn.commit()
-            
-            print(f"Успешно загружено {len(dept_stats_df)} записей в базу данных")
-            
-            # Проверка загруженных данных
-            verification_query = "SELECT * FROM retention_analysis ORDER BY avg_score DESC"
-            result = pd.read_sql_query(verification_query, conn)
-            print("Проверка загруженных данных:")
-            print(result)
-            
-        finally:
-            conn.close()
         
+        print(f"Успешно загружено {checksum['rows']} записей в раздел {analysis_date}")
+        print(f"Контрольные суммы загрузки: {checksum}")
+        
+        cache.save_stage('load', load_key, {'rows': checksum['rows']})
         print("Загрузка в базу данных завершена успешно")
-        return f"Загружено {len(dept_stats_df)} записей в SQLite базу данных"
+        return f"Загружено {checksum['rows']} записей в хранилище {get_backend(WAREHOUSE_URL).dialect}"
         
     except Exception as e:
         print(f"Ошибка при загрузке в базу данных: {str(e)}")
@@ -256,101 +824,216 @@ def load_to_database(**context):
 
 
 
+def report_rows(context, spec):
+    """
+    Строки отчета гранулярности spec и их число: отчет по отделам и, если
+    построен куб агрегатов, по курсам и отделам × курсам читается из хранилища
+    пакетами, остальные - считаются по артефактам staging
+    """
+    from retention.cube import GROUPING_SETS, cube_cells, cube_query, rollup_cube
+    from retention.join_engine import course_stats, employee_stats
+    from retention.warehouse import get_backend
+    
+    if spec.name == 'department':
+        backend = get_backend(WAREHOUSE_URL)
+        # Чтение только раздела текущего запуска через индекс (analysis_date, department)
+        row_count = backend.query_df(
+            "SELECT COUNT(*) AS row_count FROM retention_analysis WHERE analysis_date = ?", (context['ds'],)
+        )['row_count'].iloc[0]
+        query = """
+        SELECT 
+            department,
+            total_employees,
+            total_courses,
+            avg_score
+        FROM retention_analysis 
+        WHERE analysis_date = ?
+        ORDER BY avg_score DESC
+        """
+        return spec.rows_from_tuples(backend.iter_rows(query, (context['ds'],))), int(row_count)
+    
+    if spec.name in GROUPING_SETS and context['params'].get('cube'):
+        # Готовые ячейки куба за дату запуска по индексу (analysis_date, grouping_set, ...)
+        backend = get_backend(WAREHOUSE_URL)
+        row_count = backend.query_df(
+            "SELECT COUNT(*) AS row_count FROM retention_cube WHERE analysis_date = ? AND grouping_set = ?",
+            (context['ds'], spec.name)
+        )['row_count'].iloc[0]
+        query, params = cube_query(spec.columns, spec.name, context['ds'], context['ds'])
+        return spec.rows_from_tuples(backend.iter_rows(query, tuple(params))), int(row_count)
+    
+    employees_df, training_df, courses_df = read_source_artifacts(pull_source_manifests(context))
+    if spec.name == 'department_course':
+        stats_df = cube_cells(rollup_cube(employees_df, training_df, courses_df), spec.name)
+    else:
+        stats = {'course': course_stats, 'employee': employee_stats}[spec.name]
+        stats_df = stats(employees_df, training_df, courses_df)
+    return spec.rows_from_frame(stats_df), len(stats_df)
+
+@instrument_task
 def generate_report(**context):
     """
     Генерация отчета с результатами анализа и сохранение в файл
     """
+    from retention.artifacts import get_artifact_store
+    from retention.attachments import pack_files
+    from retention.reports import DEPARTMENT_REPORT, get_report, render_files
+    
     print("Генерируем отчет с результатами анализа...")
     
     try:
-        # Получение данных из базы данных
-        conn = sqlite3.connect(DB_PATH)
-        
-        try:
-            query = """
-            SELECT 
-                department,
-                total_employees,
-                total_courses,
-                avg_score
-            FROM retention_analysis 
-            ORDER BY avg_score DESC
-            """
+        # Отчет по отделам строится всегда (по нему формируется письмо), остальные - по params
+        extra = context['params'].get('report_granularities') or []
+        specs = [DEPARTMENT_REPORT] + [get_report(name) for name in extra if name != 'department']
+        generated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        report_paths = {}
+        report_archives = []
+        archive_dir = get_artifact_store(STAGING_DIR, ARTIFACT_FORMAT).run_dir(context['run_id'])
+        for spec in specs:
+            with span('query') as query_span:
+                rows, row_count = report_rows(context, spec)
+                query_span.rows = row_count
             
-            result_df = pd.read_sql_query(query, conn)
+            # Строки потоком пишутся сразу в текстовый, HTML и CSV файлы
+            paths = spec.paths(REPORT_DIR)
+            with span('render', rows=row_count) as render_span:
+                summary = render_files(
+                    spec, rows, paths, keep=EMAIL_TOP_ROWS if spec is DEPARTMENT_REPORT else 0,
+                    generated_at=generated_at, row_count=row_count,
+                )
+                render_span.bytes = sum(os.path.getsize(path) for path in paths.values())
+            report_paths[spec.name] = paths
+            print(f"Отчет {spec.name} ({summary.rows} строк) сохранен в файлы: {', '.join(paths.values())}")
             
-            # Формирование отчета
-            report = f"""ОТЧЕТ ПО АНАЛИЗУ КОЭФФИЦИЕНТА УДЕРЖАНИЯ МОБИЛЬНЫХ ПРИЛОЖЕНИЙ
-================================================================
-
-Дата анализа: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-Общее количество категорий: {len(result_df)}
-
-РЕЗУЛЬТАТЫ ПО КАТЕГОРИЯМ:
-"""
+            # Сжатие файлов отчета для письма; архив отчета по отделам идет первым
+            with span('compress') as compress_span:
+                archives = pack_files(paths.values(), archive_dir, ATTACHMENT_COMPRESSION, spec.file_stem)
+                compress_span.bytes = sum(archive['bytes'] for archive in archives)
+            report_archives.extend(archives)
             
-            for _, row in result_df.iterrows():
-                report += f"""
-department: {row['department']}
+            if spec is DEPARTMENT_REPORT:
+                # В письмо попадают только первые EMAIL_TOP_ROWS строк
+                result_data = [row._asdict() for row in summary.kept]
+                result_rows = summary.rows
+        
+        # Сохранение данных для email
+        context['task_instance'].xcom_push(key='report_file_path', value=report_paths['department']['text'])
+        context['task_instance'].xcom_push(key='csv_file_path', value=report_paths['department']['csv'])
+        context['task_instance'].xcom_push(key='report_paths', value=report_paths)
+        context['task_instance'].xcom_push(key='result_data', value=result_data)
+        context['task_instance'].xcom_push(key='result_rows', value=result_rows)
+        context['task_instance'].xcom_push(key='report_archives', value=report_archives)
+        
+        return "Отчет успешно сгенерирован и сохранен в файлы"
+        
+    except Exception as e:
+        print(f"Ошибка при генерации отчета: {str(e)}")
+        raise
 
-- общее количество сотрудников : {row['total_employees']:,}
-- Общее количество курсов: {row['total_courses']:,}
-- средний бал: {row['avg_score']:.2f}
-"""
-            
-            # Добавление общей статистики
-            total_installs = result_df['total_employees'].sum()
-            total_uninstalls = result_df['total_courses'].sum()
+def source_paths():
+    """
+    Исходные файлы сотрудников, обучения и курсов
+    """
+    from retention.shards import resolve_source
     
-            report += f"""
-ОБЩАЯ СТАТИСТИКА:
-- Общее количество установок: {total_installs:,}
-- Общее количество удалений: {total_uninstalls:,}
+    return {
+        'employees': resolve_source(DATA_DIR, EMPLOYEES_SOURCE, '.csv'),
+        'training': resolve_source(DATA_DIR, TRAINING_SOURCE, '.xlsx'),
+        'courses': resolve_source(DATA_DIR, COURSES_SOURCE, '.json'),
+    }
 
+def choose_execution_mode(**context):
+    """
+    Выбор ветки: run_fused для небольших источников, иначе задачи извлечения
+    """
+    requested = context['params'].get('execution_mode', 'auto')
+    total_bytes = source_bytes([path for paths in source_paths().values() for path in paths])
+    mode = choose_mode(requested, total_bytes, FUSED_MAX_SOURCE_BYTES)
+    print(f"Исходные файлы: {total_bytes} байт (порог {FUSED_MAX_SOURCE_BYTES}), режим {requested}: {mode}")
+    if mode == 'fused':
+        return 'run_fused'
+    return ['extract_apps', 'extract_installs', 'extract_uninstalls']
 
-РЕКОМЕНДАЦИИ:
-"""
-            
-            # Добавление рекомендаций на основе анализа
-            best_department = result_df.iloc[0]
-            worst_department = result_df.iloc[-1]
-            
-            report += f"""- Лучший показатель удержания у категории "{best_department['department']}" ({best_department['avg_score']:.2f})
-- Требует внимания категория "{worst_department['department']}" ({worst_department['avg_score']:.2f})
-- Рекомендуется изучить успешные практики категории "{best_department['department']}"
-"""
-            
-            print("Отчет сгенерирован:")
-            print(report)
-            
-            # Сохранение отчета в файл
-            report_file_path = '/opt/airflow/retention_analysis_report.txt'
-            with open(report_file_path, 'w', encoding='utf-8') as f:
-                f.write(report)
-            print(f"Отчет сохранен в файл: {report_file_path}")
-            
-            # Сохранение CSV файла с данными
-            csv_file_path = '/opt/airflow/retention_analysis_data.csv'
-            result_df.to_csv(csv_file_path, index=False, encoding='utf-8')
-            print(f"Данные сохранены в CSV: {csv_file_path}")
-            
-            # Сохранение данных для email
-            context['task_instance'].xcom_push(key='report', value=report)
-            context['task_instance'].xcom_push(key='report_file_path', value=report_file_path)
-            context['task_instance'].xcom_push(key='csv_file_path', value=csv_file_path)
-            context['task_instance'].xcom_push(key='result_data', value=result_df.to_dict('records'))
-            
-        finally:
-            conn.close()
+@instrument_task
+def run_fused(**context):
+    """
+    Fused: извлечение, проверка, трансформация, загрузка и отчет в одной задаче
+    """
+    print("Выполняем все этапы в одной задаче (режим fused)...")
+    
+    try:
+        with FusedRun(context) as run:
+            for task_id, stage in FUSED_STAGES:
+                with span(task_id):
+                    result = run.run(task_id, stage)
+                print(f"{task_id}: {result}")
+                
+                if task_id == 'plan_transform_partitions':
+                    # Разделы режима mapped считаются подряд в этом же процессе
+                    for map_index, op_kwargs in enumerate(result or []):
+                        with span('transform_partition'):
+                            run.run('transform_partition', transform_partition, map_index, **op_kwargs)
             
-        return "Отчет успешно сгенерирован и сохранен в файлы"
+            # Пути файлов и данные отчета - в XCom этой задачи для письма
+            for key, value in run.values('generate_report').items():
+                if key != 'return_value':
+                    context['task_instance'].xcom_push(key=key, value=value)
+        
+        return "Все этапы выполнены в одной задаче"
         
     except Exception as e:
-        print(f"Ошибка при генерации отчета: {str(e)}")
+        print(f"Ошибка при выполнении этапов в режиме fused: {str(e)}")
         raise
 
+def pull_report_value(context, key):
+    """
+    Значение XCom отчета: из generate_report или, в режиме fused, из run_fused
+    """
+    task_instance = context['task_instance']
+    value = task_instance.xcom_pull(key=key, task_ids='generate_report')
+    if value is None:
+        value = task_instance.xcom_pull(key=key, task_ids='run_fused')
+    return value
+
+# Этапы режима fused в порядке графа задач
+FUSED_STAGES = [
+    ('extract_apps', extract_apps_data),
+    ('extract_installs', extract_installs_data),
+    ('extract_uninstalls', extract_uninstalls_data),
+    ('validate_data', validate_data),
+    ('plan_transform_partitions', plan_transform_partitions),
+    ('transform_data', transform_data),
+    ('load_to_database', load_to_database),
+    ('generate_report', generate_report),
+]
+
 # Определение задач DAG
 
+# Выбор режима выполнения по размеру исходных файлов
+choose_mode_task = BranchPythonOperator(
+    task_id='choose_execution_mode',
+    python_callable=choose_execution_mode,
+    dag=dag,
+    doc_md="""
+    ### Выбор режима выполнения
+    Небольшие запуски выполняются одной задачей run_fused, большие - графом задач.
+    """
+)
+
+# Все этапы в одной задаче (режим fused)
+fused_task = PythonOperator(
+    task_id='run_fused',
+    python_callable=run_fused,
+    dag=dag,
+    doc_md="""
+    ### Все этапы в одной задаче
+    Извлечение, проверка, трансформация, загрузка и отчет подряд в одном процессе
+    с передачей данных между этапами в памяти.
+    """
+)
+
 # Extract задачи
 extract_apps_task = PythonOperator(
     task_id='extract_apps',
@@ -382,10 +1065,51 @@ extract_uninstalls_task = PythonOperator(
     """
 )
 
-# Transform задача
+# Проверка данных между извлечением и трансформацией
+validate_task = PythonOperator(
+    task_id='validate_data',
+    python_callable=validate_data,
+    dag=dag,
+    doc_md="""
+    ### Проверка данных
+    Отклоняет строки с пропусками, оценкой вне диапазона, ссылками на отсутствующих
+    сотрудников и курсы и повторами ключей; отклоненные строки пишет в таблицу quarantine.
+    """
+)
+
+# Планирование разделов трансформации (пустой список вне режима mapped)
+plan_partitions_task = PythonOperator(
+    task_id='plan_transform_partitions',
+    python_callable=plan_transform_partitions,
+    dag=dag,
+    doc_md="""
+    ### Планирование разделов трансформации
+    В режиме mapped возвращает список разделов по хэшу employee_id или отдела.
+    """
+)
+
+# Частичные агрегаты по разделам: по экземпляру задачи на раздел (dynamic task mapping)
+partition_tasks = PythonOperator.partial(
+    task_id='transform_partition',
+    python_callable=transform_partition,
+    dag=dag,
+    doc_md="""
+    ### Трансформация раздела
+    Считает сумму и число оценок, число записей и уникальных сотрудников по отделам одного раздела.
+    """
+).expand(op_kwargs=plan_partitions_task.output)
+
+# Transform задача. Вне режима mapped и при попадании в кэш трансформации
+# plan_transform_partitions возвращает пустой список, и transform_partition
+# пропускается (пустой expand). Поэтому у задачи два прямых предшественника:
+# plan_transform_partitions (успешна в графе задач) и transform_partition;
+# при none_failed_min_one_success пропуск разделов не пропускает трансформацию,
+# а упавший раздел ее останавливает. В режиме fused пропущены оба
+# предшественника, и задача тоже пропускается.
 transform_task = PythonOperator(
     task_id='transform_data',
     python_callable=transform_data,
+    trigger_rule='none_failed_min_one_success',
     dag=dag,
     doc_md="""
     ### Трансформация данных
@@ -415,124 +1139,224 @@ report_task = PythonOperator(
     """
 )
 
+def smtp_settings():
+    """
+    Параметры SMTP из секции [smtp] конфигурации Airflow
+    """
+    from airflow.configuration import conf
+    
+    from retention.notifications import SmtpSettings
+    
+    return SmtpSettings(
+        host=conf.get('smtp', 'smtp_host'),
+        port=conf.getint('smtp', 'smtp_port'),
+        starttls=conf.getboolean('smtp', 'smtp_starttls'),
+        ssl=conf.getboolean('smtp', 'smtp_ssl'),
+        user=conf.get('smtp', 'smtp_user', fallback=None),
+        password=conf.get('smtp', 'smtp_password', fallback=None),
+        sender=conf.get('smtp', 'smtp_mail_from'),
+        timeout=conf.getint('smtp', 'smtp_timeout', fallback=30),
+    )
+
+def notify(context, kind, subject, html_content, files=()):
+    """
+    Письмо NOTIFICATION_RECIPIENTS: запись в outbox или отправка из задачи (NOTIFICATION_DELIVERY);
+    одно письмо вида kind на запуск DAG
+    """
+    from retention.notifications import OUTBOX_DDL, dispatch, enqueue
+    from retention.warehouse import get_backend
+    
+    message = {
+        'message_id': f"{context['dag'].dag_id}/{context['run_id']}/{kind}",
+        'recipients': NOTIFICATION_RECIPIENTS,
+        'subject': subject,
+        'html_content': html_content,
+        'files': list(files),
+    }
+    if NOTIFICATION_DELIVERY == 'outbox':
+        backend = get_backend(NOTIFICATION_OUTBOX_URL)
+        backend.ensure_schema(OUTBOX_DDL)
+        enqueue(backend, [message])
+        print(f"Письмо {message['message_id']} записано в outbox")
+        return
+    if NOTIFICATION_DELIVERY != 'direct':
+        raise ValueError(f"Неизвестный способ доставки писем: {NOTIFICATION_DELIVERY}. Доступны: outbox, direct")
+    result = dispatch([message], smtp_settings())[message['message_id']]
+    if result['status'] != 'sent':
+        raise RuntimeError(f"Письмо {message['message_id']} не отправлено: {result['error']}")
+
+@instrument_task
 def send_email_with_attachments(**context):
     """
     Отправка email с прикрепленными файлами результатов
     """
-    from airflow.utils.email import send_email
+    import io
     import os
     
+    from retention.attachments import plan_attachments
+    from retention.reports import DEPARTMENT_REPORT, EMAIL_LAYOUT, TemplateWriter, email_attachments, render_report
+    from retention.warehouse import get_backend
+    
     try:
         # Получение данных из предыдущих задач
-        report = context['task_instance'].xcom_pull(key='report', task_ids='generate_report')
-        result_data = context['task_instance'].xcom_pull(key='result_data', task_ids='generate_report')
-        
-        # Формирование HTML содержимого с результатами
-        html_content = f"""
-        <h2> analysis average grade point after training for each </h2>
-        
-        <h3>📊 Информация о выполнении:</h3>
-        <ul>
-            <li><strong>DAG:</strong> average grade point after training for each</li>
-            <li><strong>Дата выполнения:</strong> {context['ds']}</li>
-            <li><strong>Статус:</strong> ✅ Все задачи выполнены без ошибок</li>
-            <li><strong>Результаты:</strong> Сохранены в базе данных SQLite</li>
-        </ul>
-        
-        <h3>📈 Краткие результаты анализа:</h3>
-        <table border="1" style="border-collapse: collapse; width: 100%;">
-            <tr style="background-color: #f2f2f2;">
-                <th>department</th>
-                <th>total_employees</th>
-                <th>total_courses</th>
-                <th>avg score</th>
-            </tr>
-        """
+        result_data = pull_report_value(context, 'result_data') or []
+        result_rows = pull_report_value(context, 'result_rows')
+        archives = pull_report_value(context, 'report_archives') or []
         
-        if result_data:
-            for row in result_data:
-                html_content += f"""
-            <tr>
-                <td>{row['department']}</td>
-                <td>{row['total_employees']:,}</td>
-                <td>{row['total_courses']:,}</td>
-                <td>{row['avg_score']:.2f}%</td>
-            </tr>
-                """
-        
-        html_content += """
-        </table>
-        
-        <h3>📎 Прикрепленные файлы:</h3>
-        <ul>
-            <li><strong>retention_analysis_report.txt</strong> - Подробный текстовый отчет</li>
-            <li><strong>retention_analysis_data.csv</strong> - Данные в формате CSV</li>
-        </ul>
-        
-        <p><em>Детальный отчет также доступен в логах задачи generate_report в Airflow UI.</em></p>
-        
-        <hr>
-        <p style="color: #666; font-size: 12px;">
-            Это автоматическое уведомление от системы Apache Airflow<br>
-            Время отправки: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-        </p>
-        """
+        # Архивы прикладываются в пределах ATTACHMENT_MAX_BYTES, остальные заменяются ссылками
+        attached, linked, missing = plan_attachments(archives, ATTACHMENT_MAX_BYTES, REPORT_LINK_BASE, STAGING_DIR)
+        for archive in missing:
+            print(f"Файл вложения не найден: {archive['path']}")
+        files = [archive['path'] for archive in attached]
+        for archive in attached:
+            print(f"Добавлен файл для отправки: {archive['path']} ({archive['bytes']} байт)")
+        for archive in linked:
+            print(f"Файл {archive['path']} ({archive['bytes']} байт) превышает лимит вложений, в письме ссылка: {archive['link']}")
         
-        # Подготовка файлов для отправки
-        files = []
-        report_file = '/opt/airflow/retention_analysis_report.txt'
-        csv_file = '/opt/airflow/retention_analysis_data.csv'
-        
-        if os.path.exists(report_file):
-            files.append(report_file)
-            print(f"Добавлен файл для отправки: {report_file}")
-        
-        if os.path.exists(csv_file):
-            files.append(csv_file)
-            print(f"Добавлен файл для отправки: {csv_file}")
-        
-        # Отправка email
-        send_email(
-            to=['test@example.com'],
-            subject='📊 Анализ коэффициента удержания мобильных приложений - Результаты',
-            html_content=html_content,
-            files=files
-        )
+        # Формирование HTML содержимого с первыми строками результатов по шаблону письма
+        with span('build', rows=len(result_data)):
+            body = io.StringIO()
+            render_report(
+                DEPARTMENT_REPORT.rows_from_records(result_data),
+                [TemplateWriter(body, EMAIL_LAYOUT)],
+                ds=context['ds'], warehouse=get_backend(WAREHOUSE_URL).dialect,
+                sent_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                total_rows=len(result_data) if result_rows is None else result_rows,
+                attachments=email_attachments(attached, linked),
+            )
+            html_content = body.getvalue()
+        
+        # Отправка email: в режиме outbox письмо только записывается в таблицу исходящих
+        with span('send', bytes=sum(archive['bytes'] for archive in attached)):
+            notify(
+                context, 'results',
+                subject='📊 Анализ коэффициента удержания мобильных приложений - Результаты',
+                html_content=html_content,
+                files=files,
+            )
         
-        print("Email с результатами и прикрепленными файлами отправлен успешно!")
+        print("Email с результатами и прикрепленными файлами поставлен в очередь отправки!"
+              if NOTIFICATION_DELIVERY == 'outbox' else
+              "Email с результатами и прикрепленными файлами отправлен успешно!")
         return "Email отправлен с прикрепленными файлами"
         
     except Exception as e:
+        # Второе письмо не отправляется: об ошибке сообщает упавшая задача
         print(f"Ошибка при отправке email: {str(e)}")
-        # Отправляем базовое уведомление без файлов
-        send_email(
-            to=['test@example.com'],
-            subject='⚠️ Анализ коэффициента удержания - Завершен (без файлов)',
-            html_content=f"""
-            <h3>Анализ коэффициента удержания завершен успешно!</h3>
-            <p>DAG: average grade point after training for each</p>
-            <p>Дата выполнения: {context['ds']}</p>
-            <p>Все задачи выполнены без ошибок.</p>
-            <p><strong>Примечание:</strong> Файлы результатов не удалось прикрепить из-за ошибки: {str(e)}</p>
-            <p>Результаты доступны в логах задачи generate_report.</p>
-            """
-        )
         raise
 
 # Email уведомление с файлами
+# Выполняется после generate_report или run_fused - вторая ветка пропущена
 email_task = PythonOperator(
     task_id='send_email_notification',
     python_callable=send_email_with_attachments,
+    trigger_rule='none_failed_min_one_success',
     dag=dag,
     doc_md="""
     ### Отправка email-уведомления
-    Отправляет email с результатами анализа и прикрепленными файлами.
+    Отправляет email с результатами анализа и прикрепленными файлами
+    (в режиме outbox - записывает его в таблицу исходящих писем).
     """
 )
 
 # Определение зависимостей между задачами
-# Extract задачи выполняются параллельно
-[extract_apps_task, extract_installs_task, extract_uninstalls_task] >> transform_task
+# Режим выполнения: одна задача run_fused или граф задач, начиная с извлечения
+choose_mode_task >> [fused_task, extract_apps_task, extract_installs_task, extract_uninstalls_task]
+fused_task >> email_task
+
+# Extract задачи выполняются параллельно, затем проверка данных
+[extract_apps_task, extract_installs_task, extract_uninstalls_task] >> validate_task
+validate_task >> plan_partitions_task
+plan_partitions_task >> partition_tasks >> transform_task
+plan_partitions_task >> transform_task
 
 # Transform -> Load -> Report -> Email (последовательно)
 transform_task >> load_task >> report_task >> email_task
+
+# Отправка писем из таблицы notification_outbox (NOTIFICATION_DELIVERY = 'outbox')
+@instrument_task
+def deliver_notifications(**context):
+    """
+    Отправка накопившихся писем outbox пакетом через переиспользуемые SMTP-соединения
+    """
+    from retention.notifications import deliver_outbox
+    from retention.warehouse import get_backend
+    
+    try:
+        with span('send') as send_span:
+            summary = deliver_outbox(get_backend(NOTIFICATION_OUTBOX_URL), smtp_settings())
+            send_span.rows = sum(summary.values())
+        print(
+            f"Письма outbox: отправлено {summary['sent']}, отложено {summary['pending']}, "
+            f"с ошибкой {summary['failed']}"
+        )
+        return summary
+        
+    except Exception as e:
+        print(f"Ошибка при отправке писем outbox: {str(e)}")
+        raise
+
+# Задача есть только в режиме outbox; выполняется и после ошибки send_email_notification,
+# чтобы отправить письма, отложенные в предыдущих запусках
+if NOTIFICATION_DELIVERY == 'outbox':
+    deliver_task = PythonOperator(
+        task_id='deliver_notifications',
+        python_callable=deliver_notifications,
+        trigger_rule='all_done',
+        dag=dag,
+        doc_md="""
+        ### Отправка писем из outbox
+        Отправляет письма со статусом pending одним пакетом; письма с временной ошибкой
+        откладываются с экспоненциальной задержкой до следующего запуска DAG.
+        """
+    )
+    email_task >> deliver_task
+
+# Очистка каталогов старых запусков в STAGING_DIR
+@instrument_task
+def cleanup_staging(**context):
+    """
+    Удаление каталогов запусков старше STAGING_RETENTION_DAYS, на файлы которых
+    не ссылаются записи кэша и письма outbox, ожидающие отправки
+    """
+    from retention.artifacts import get_artifact_store
+    from retention.fingerprint import SourceCache
+    from retention.notifications import OUTBOX_DDL, pending_files
+    from retention.warehouse import get_backend
+    
+    try:
+        referenced = SourceCache(CACHE_DIR).referenced_paths()
+        if NOTIFICATION_DELIVERY == 'outbox':
+            backend = get_backend(NOTIFICATION_OUTBOX_URL)
+            backend.ensure_schema(OUTBOX_DDL)
+            referenced |= pending_files(backend)
+        
+        with span('cleanup') as cleanup_span:
+            removed = get_artifact_store(STAGING_DIR, ARTIFACT_FORMAT).prune_runs(
+                referenced, STAGING_RETENTION_DAYS * 24 * 3600, keep_run_ids=[context['run_id']],
+            )
+            cleanup_span.rows = len(removed)
+        for path in removed:
+            print(f"Удален каталог запуска: {path}")
+        return f"Удалено каталогов запусков: {len(removed)}"
+        
+    except Exception as e:
+        print(f"Ошибка при очистке staging: {str(e)}")
+        raise
+
+# Выполняется после отправки письма при любом ее исходе
+cleanup_task = PythonOperator(
+    task_id='cleanup_staging',
+    python_callable=cleanup_staging,
+    trigger_rule='all_done',
+    dag=dag,
+    doc_md="""
+    ### Очистка staging
+    Удаляет каталоги артефактов старых запусков, на которые не ссылаются
+    кэш отпечатков и неотправленные письма.
+    """
+)
+if NOTIFICATION_DELIVERY == 'outbox':
+    deliver_task >> cleanup_task
+else:
+    email_task >> cleanup_task
@@ -0,0 +1,6 @@
+"""
+Вспомогательные модули ETL-конвейера анализа среднего балла по отделам.
+
+Модули пакета не содержат определений DAG и исключены из разбора
+планировщиком через dags/.airflowignore.
+"""
@@ -0,0 +1,220 @@
+"""
+Инкрементальное состояние агрегатов по отделам.
+
+Для каждого отдела хранится сумма оценок, число оценок и число записей
+об обучении, а для точного подсчета уникальных сотрудников - количество
+записей на пару (отдел, сотрудник). Новые и удаленные строки обучения
+вносятся в состояние как дельты с весом +1/-1, поэтому объединение и
+группировка выполняются только над изменившимися строками.
+
+Обычно новый снимок обучения - прошлый с дописанными в конец строками:
+тогда дельта - строки после отметки (числа строк прошлого снимка), а
+совпадение начала снимка проверяется поколоночным сравнением без
+хэширования. Иначе снимки сравниваются как мультимножества по значениям
+строк, без хэша в роли идентификатора строки.
+
+Состояние на диске неизменяемо по файлам: каждое сохранение пишет файл
+отделов и файл дельты пар (отдел, сотрудник) нового поколения, а
+state.json перечисляет файлы текущего поколения. После EMPLOYEE_LOG_MAX
+дельт пары сжимаются в один файл, поэтому сохранение не переписывает
+все пары при каждом запуске.
+"""
+
+import json
+import os
+
+import pandas as pd
+
+from retention.join_engine import encode_join
+
+TRAINING_KEY_COLUMNS = ['employee_id', 'course_id', 'score']
+
+# Файлов дельт пар (отдел, сотрудник) до сжатия в один файл
+EMPLOYEE_LOG_MAX = 16
+
+DEPARTMENT_DTYPES = {'department': object, 'score_sum': 'float64', 'score_count': 'int64', 'record_count': 'int64'}
+EMPLOYEE_DTYPES = {'department': object, 'employee_id': 'int64', 'records': 'int64'}
+
+
+def _empty_frame(dtypes):
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()})
+
+
+def appended_rows(old_df, new_df):
+    """
+    Строки, дописанные в конец снимка обучения (после len(old_df)),
+    если начало new_df совпадает со старым снимком, иначе None
+    """
+    watermark = len(old_df)
+    if len(new_df) < watermark:
+        return None
+    old = old_df[TRAINING_KEY_COLUMNS].reset_index(drop=True)
+    prefix = new_df[TRAINING_KEY_COLUMNS].iloc[:watermark].reset_index(drop=True)
+    # Поколоночное сравнение массивов (пропуски равны друг другу), без хэшей и сортировки
+    if not old.equals(prefix):
+        return None
+    return new_df[TRAINING_KEY_COLUMNS].iloc[watermark:].reset_index(drop=True)
+
+
+def training_delta(old_df, new_df):
+    """
+    Разница двух снимков обучения как мультимножеств строк.
+
+    Возвращает строки с колонкой weight: положительный вес - строка
+    добавлена (столько раз), отрицательный - удалена.
+    """
+    appended = appended_rows(old_df, new_df)
+    if appended is not None:
+        return appended.assign(weight=1)
+
+    # Строки сравниваются по значениям (float64, чтобы int8 и float при пропусках совпадали)
+    both = pd.concat([
+        old_df[TRAINING_KEY_COLUMNS].astype('float64').assign(weight=-1),
+        new_df[TRAINING_KEY_COLUMNS].astype('float64').assign(weight=1),
+    ], ignore_index=True)
+    net = both.groupby(TRAINING_KEY_COLUMNS, dropna=False, sort=False)['weight'].sum()
+    return net[net != 0].reset_index()
+
+
+def _sum_employees(frames, keep_negative=False):
+    """
+    Сумма записей по парам (отдел, сотрудник) из нескольких файлов или дельт;
+    без keep_negative остаются только пары с положительным числом записей
+    """
+    if len(frames) == 1 and not keep_negative:
+        return frames[0]
+    employees = pd.concat(frames, ignore_index=True)
+    employees = employees.groupby(['department', 'employee_id'], as_index=False)['records'].sum()
+    keep = employees['records'] != 0 if keep_negative else employees['records'] > 0
+    return employees[keep].reset_index(drop=True)
+
+
+class DepartmentAggregateState:
+    """
+    Сохраняемое на диске состояние агрегатов по отделам
+    """
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.meta = None
+        self.departments = _empty_frame(DEPARTMENT_DTYPES)
+        self.employees = _empty_frame(EMPLOYEE_DTYPES)
+        # Дельты пар, еще не записанные на диск; после rebuild пары пишутся целиком
+        self._pending = []
+        self._rebuilt = False
+
+    def _path(self, name):
+        return os.path.join(self.state_dir, name)
+
+    def load(self):
+        """
+        Загрузка состояния с диска; возвращает метаданные или None
+        """
+        meta_path = self._path('state.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        # Состояние прежнего формата - по одному файлу отделов и пар без поколений
+        self.meta.setdefault('departments_file', 'departments.parquet')
+        self.meta.setdefault('employee_files', ['employees.parquet'])
+        self.departments = pd.read_parquet(self._path(self.meta['departments_file']))
+        self.employees = _sum_employees([pd.read_parquet(self._path(name)) for name in self.meta['employee_files']])
+        return self.meta
+
+    def save(self, dims_key, training_manifest):
+        """
+        Сохранение состояния вместе с ключом справочников и манифестом
+        снимка обучения, который в него уже внесен
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        previous = self.meta or {}
+        generation = previous.get('generation', 0) + 1
+        employee_files = [] if self._rebuilt else list(previous.get('employee_files', []))
+
+        departments_file = f"departments_{generation:06d}.parquet"
+        self.departments.to_parquet(self._path(departments_file), index=False)
+        if self._rebuilt or len(employee_files) >= EMPLOYEE_LOG_MAX:
+            # Сжатие: все пары одним файлом вместо базового файла и дельт
+            employee_files = [f"employees_{generation:06d}.parquet"]
+            self.employees.to_parquet(self._path(employee_files[0]), index=False)
+        elif self._pending:
+            delta = _sum_employees(self._pending, keep_negative=True)
+            if not delta.empty:
+                employee_files.append(f"employees_delta_{generation:06d}.parquet")
+                delta.to_parquet(self._path(employee_files[-1]), index=False)
+        self._pending, self._rebuilt = [], False
+
+        self.meta = {
+            'dims_key': dims_key,
+            'training_manifest': training_manifest,
+            'generation': generation,
+            'departments_file': departments_file,
+            'employee_files': employee_files,
+        }
+        tmp_path = self._path('state.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        # state.json пишется последним: без него состояние считается отсутствующим
+        os.replace(tmp_path, self._path('state.json'))
+
+        # Файлы прошлых поколений больше не нужны
+        current = {departments_file, *employee_files}
+        for name in os.listdir(self.state_dir):
+            if name.endswith('.parquet') and name not in current:
+                os.remove(self._path(name))
+
+    def rebuild(self, employees_df, courses_df, training_df):
+        """
+        Полный пересчет состояния по всей истории обучения
+        """
+        self.departments = _empty_frame(DEPARTMENT_DTYPES)
+        self.employees = _empty_frame(EMPLOYEE_DTYPES)
+        self.apply_delta(employees_df, courses_df, training_df.assign(weight=1))
+        self._pending, self._rebuilt = [], True
+
+    def apply_delta(self, employees_df, courses_df, delta_df):
+        """
+        Внесение дельты строк обучения (с колонкой weight) в состояние
+        """
+        if delta_df.empty:
+            return
+
+        # Объединение только по дельте: словарное кодирование и semi-join с курсами
+        joined = encode_join(employees_df, courses_df, delta_df, extra_columns=['weight'])
+
+        weight = joined['weight'].astype('int64') * joined['multiplicity']
+        score = joined['score']
+        parts = pd.DataFrame({
+            'department': joined['department'].astype(object),
+            'employee_id': joined['employee_id'],
+            'score_sum': score.fillna(0) * weight,
+            'score_count': score.notna().astype('int64') * weight,
+            'record_count': weight,
+            'records': weight,
+        })
+
+        dept_delta = parts.groupby('department', as_index=False)[['score_sum', 'score_count', 'record_count']].sum()
+        departments = pd.concat([self.departments, dept_delta], ignore_index=True)
+        departments = departments.groupby('department', as_index=False)[['score_sum', 'score_count', 'record_count']].sum()
+        self.departments = departments[departments['record_count'] > 0].reset_index(drop=True)
+
+        emp_delta = parts.groupby(['department', 'employee_id'], as_index=False)['records'].sum()
+        self._pending.append(emp_delta)
+        self.employees = _sum_employees([self.employees, emp_delta])
+
+    def dept_stats(self):
+        """
+        Итоговая статистика по отделам в формате transform_data
+        """
+        distinct = self.employees.groupby('department').size()
+        departments = self.departments.sort_values('department').reset_index(drop=True)
+
+        dept_stats = pd.DataFrame({
+            'department': departments['department'],
+            'total_employees': departments['department'].map(distinct).fillna(0).astype('int64'),
+            'total_courses': departments['record_count'].astype('int64'),
+            'avg_score': departments['score_sum'] / departments['score_count'].where(departments['score_count'] > 0),
+        })
+        dept_stats['avg_score'] = dept_stats['avg_score'].round(2)
+        return dept_stats
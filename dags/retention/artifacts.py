@@ -0,0 +1,302 @@
+"""
+Хранилище промежуточных артефактов между задачами DAG.
+
+Вместо передачи целых наборов данных через XCom (и метаданные Postgres)
+задачи извлечения записывают колоночные файлы Arrow/Parquet в локальный
+каталог, а через XCom передается только небольшой манифест:
+путь, количество строк, схема и контрольная сумма.
+
+Контрольная сумма SHA-256 считается один раз при записи. Перед чтением
+размер и время изменения файла сверяются с манифестом (один stat, без
+чтения файла), поэтому повторные чтения одного артефакта разными
+задачами остаются без копирования; полная проверка контрольной суммы -
+по запросу (verify=True).
+
+Каталоги запусков помечаются файлом RUN_MARKER; prune_runs удаляет
+старые каталоги, на файлы которых больше ничего не ссылается.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import time
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+# Размер блока при подсчете контрольной суммы файла
+CHECKSUM_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Метка каталога запуска: prune_runs не трогает другие каталоги base_dir (кэш, состояние)
+RUN_MARKER = '.run'
+
+
+def file_checksum(path):
+    """
+    Подсчет SHA-256 файла поблочно, без загрузки в память целиком
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_manifest(manifest, verify=False):
+    """
+    Сверка файла артефакта с манифестом: размер и время изменения (stat),
+    с verify=True - еще и контрольная сумма SHA-256 всего файла
+    """
+    path = manifest['path']
+    stat = os.stat(path)
+    # В манифестах, записанных до появления mtime_ns, сверяется только размер
+    if stat.st_size != manifest['bytes'] or stat.st_mtime_ns != manifest.get('mtime_ns', stat.st_mtime_ns):
+        raise ValueError(f"Артефакт изменен после записи: {path}")
+    if verify and file_checksum(path) != manifest['checksum']:
+        raise ValueError(f"Контрольная сумма артефакта не совпадает: {path}")
+
+
+def _safe_name(value):
+    """
+    Приведение run_id к виду, пригодному для имени каталога
+    """
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(value))
+
+
+class ArtifactStore:
+    """
+    Базовое хранилище артефактов: запись таблицы и чтение по манифесту
+    """
+
+    format = None
+    extension = None
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def run_dir(self, run_id):
+        """
+        Каталог артефактов запуска (создается при первом обращении)
+        """
+        path = os.path.join(self.base_dir, _safe_name(run_id))
+        marker = os.path.join(path, RUN_MARKER)
+        if not os.path.exists(marker):
+            os.makedirs(path, exist_ok=True)
+            open(marker, 'a').close()
+        return path
+
+    def prune_runs(self, referenced, max_age, keep_run_ids=()):
+        """
+        Удаление каталогов запусков, не изменявшихся дольше max_age секунд,
+        если на их файлы нет ссылок в referenced; возвращает удаленные пути
+        """
+        if not os.path.isdir(self.base_dir):
+            return []
+        base = os.path.abspath(self.base_dir)
+        in_use = {_safe_name(run_id) for run_id in keep_run_ids}
+        for path in referenced:
+            relative = os.path.relpath(os.path.abspath(path), base)
+            if not relative.startswith(os.pardir):
+                in_use.add(relative.split(os.sep, 1)[0])
+
+        cutoff = time.time() - max_age
+        removed = []
+        for name in sorted(os.listdir(base)):
+            path = os.path.join(base, name)
+            if name in in_use or not os.path.isfile(os.path.join(path, RUN_MARKER)):
+                continue
+            # Запись артефакта (временный файл и переименование) обновляет время каталога
+            if os.stat(path).st_mtime > cutoff:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+        return removed
+
+    def artifact_path(self, run_id, name):
+        return os.path.join(self.run_dir(run_id), f"{name}.{self.extension}")
+
+    def write(self, df, name, run_id):
+        """
+        Запись DataFrame в файл и возврат манифеста для XCom
+        """
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        return self.write_batches(table.schema, table.to_batches(), name, run_id)
+
+    def write_batches(self, schema, batches, name, run_id):
+        """
+        Потоковая запись последовательности RecordBatch без сборки
+        всей таблицы в памяти; возвращает манифест для XCom
+        """
+        path = self.artifact_path(run_id, name)
+        tmp_path = path + '.tmp'
+        try:
+            rows = self._write_batches(schema, batches, tmp_path)
+        except BaseException:
+            # Прерванная запись не оставляет файла, похожего на артефакт
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # Атомарная замена, чтобы читатель не увидел недописанный файл
+        os.replace(tmp_path, path)
+
+        stat = os.stat(path)
+        return {
+            'name': name,
+            'path': path,
+            'format': self.format,
+            'rows': rows,
+            'bytes': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'schema': {field.name: str(field.type) for field in schema},
+            'checksum': file_checksum(path),
+        }
+
+    def read_table(self, manifest, verify=False):
+        """
+        Чтение pyarrow.Table по манифесту
+        """
+        path = manifest['path']
+        check_manifest(manifest, verify)
+
+        table = self._read_table(path)
+        if table.num_rows != manifest['rows']:
+            raise ValueError(
+                f"Количество строк артефакта {path}: {table.num_rows}, "
+                f"ожидалось {manifest['rows']}"
+            )
+        return table
+
+    def read(self, manifest, verify=False):
+        """
+        Чтение артефакта в DataFrame
+        """
+        table = self.read_table(manifest, verify=verify)
+        # split_blocks позволяет не копировать числовые колонки без пропусков
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+
+    def iter_tables(self, manifest, rows, verify=False):
+        """
+        Чтение артефакта частями (pyarrow.Table) не больше rows строк
+        без загрузки всей таблицы в память
+        """
+        path = manifest['path']
+        check_manifest(manifest, verify)
+
+        total = 0
+        for table in _rebatch(self._iter_batches(path, rows), rows):
+            total += table.num_rows
+            yield table
+        if total != manifest['rows']:
+            raise ValueError(f"Количество строк артефакта {path}: {total}, ожидалось {manifest['rows']}")
+
+    def _write_batches(self, schema, batches, path):
+        raise NotImplementedError
+
+    def _read_table(self, path):
+        raise NotImplementedError
+
+    def _iter_batches(self, path, rows):
+        raise NotImplementedError
+
+
+def _rebatch(batches, rows):
+    """
+    Таблицы ровно по rows строк (последняя - остаток) из пакетов любого
+    размера; срезы пакетов не копируют данные
+    """
+    pending, pending_rows = [], 0
+    for batch in batches:
+        while batch.num_rows:
+            take = min(rows - pending_rows, batch.num_rows)
+            pending.append(batch.slice(0, take))
+            pending_rows += take
+            batch = batch.slice(take)
+            if pending_rows == rows:
+                yield pa.Table.from_batches(pending)
+                pending, pending_rows = [], 0
+    if pending:
+        yield pa.Table.from_batches(pending)
+
+
+class ArrowArtifactStore(ArtifactStore):
+    """
+    Несжатые файлы Arrow IPC: чтение через memory map без копирования
+    """
+
+    format = 'arrow'
+    extension = 'arrow'
+
+    def _write_batches(self, schema, batches, path):
+        rows = 0
+        with pa.OSFile(path, 'wb') as sink:
+            with ipc.new_file(sink, schema) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+        return rows
+
+    def _read_table(self, path):
+        source = pa.memory_map(path, 'r')
+        return ipc.open_file(source).read_all()
+
+    def _iter_batches(self, path, rows):
+        # Пакеты файла через memory map: страницы прочитанных частей может вытеснить ОС
+        reader = ipc.open_file(pa.memory_map(path, 'r'))
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+class ParquetArtifactStore(ArtifactStore):
+    """
+    Сжатые файлы Parquet: меньше места на диске ценой декодирования
+    """
+
+    format = 'parquet'
+    extension = 'parquet'
+
+    def __init__(self, base_dir, compression='snappy'):
+        super().__init__(base_dir)
+        self.compression = compression
+
+    def _write_batches(self, schema, batches, path):
+        rows = 0
+        with pq.ParquetWriter(path, schema, compression=self.compression) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        return rows
+
+    def _read_table(self, path):
+        return pq.read_table(path, memory_map=True)
+
+    def _iter_batches(self, path, rows):
+        return pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=rows)
+
+
+ARTIFACT_STORES = {
+    ArrowArtifactStore.format: ArrowArtifactStore,
+    ParquetArtifactStore.format: ParquetArtifactStore,
+}
+
+
+def get_artifact_store(base_dir, kind='arrow'):
+    """
+    Получение хранилища артефактов по названию формата
+    """
+    try:
+        store_cls = ARTIFACT_STORES[kind]
+    except KeyError:
+        raise ValueError(
+            f"Неизвестный формат артефактов: {kind}. "
+            f"Доступны: {', '.join(sorted(ARTIFACT_STORES))}"
+        )
+    return store_cls(base_dir)
+
+
+def store_for_manifest(manifest, base_dir):
+    """
+    Хранилище, которым был записан артефакт из манифеста
+    """
+    return get_artifact_store(base_dir, manifest['format'])
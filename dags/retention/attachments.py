@@ -0,0 +1,141 @@
+"""
+Вложения письма с результатами: сжатие файлов отчета и ограничение размера.
+
+Файлы отчета сжимаются задачей генерации отчета (gzip - каждый файл
+отдельно, zip - один архив на отчет) в каталог запуска хранилища
+артефактов, а через XCom передаются только описания архивов. Задача
+письма прикладывает архивы, пока их суммарный размер в письме (base64
+с переносами строк и заголовками части MIME) не превышает лимит;
+остальные заменяются в письме путем к файлу в хранилище или ссылкой,
+если задан базовый URL хранилища. Поэтому размер письма и время
+отправки не зависят от размера отчета.
+"""
+
+import gzip
+import math
+import os
+import shutil
+import zipfile
+from urllib.parse import quote
+
+COMPRESSION_FORMATS = ('gzip', 'zip', 'none')
+
+# Уровень сжатия: 6 - почти как 9 на CSV и тексте, но в несколько раз быстрее
+COMPRESS_LEVEL = 6
+
+# Размер буфера потокового копирования в архив
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# base64 во вложении письма: строки по 76 символов с CRLF; заголовки части MIME
+# (Content-Type, Content-Disposition с именем файла, граница) - с запасом
+BASE64_LINE_LENGTH = 76
+MIME_PART_OVERHEAD = 512
+
+
+def _archive(path, source_bytes, files):
+    return {
+        'name': os.path.basename(path),
+        'path': path,
+        'bytes': os.path.getsize(path),
+        'source_bytes': source_bytes,
+        'files': files,
+    }
+
+
+def _gzip_file(path, target):
+    tmp_path = target + '.tmp'
+    with open(path, 'rb') as source, open(tmp_path, 'wb') as sink:
+        # Имя и mtime в заголовке фиксированы: архив одинаковых данных не меняется
+        with gzip.GzipFile(os.path.basename(path), 'wb', COMPRESS_LEVEL, sink, mtime=0) as packed:
+            shutil.copyfileobj(source, packed, COPY_BUFFER_SIZE)
+    os.replace(tmp_path, target)
+
+
+def _zip_files(paths, target):
+    tmp_path = target + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as archive:
+        for path in paths:
+            archive.write(path, os.path.basename(path))
+    os.replace(tmp_path, target)
+
+
+def pack_files(paths, directory, compression='zip', archive_name='report'):
+    """
+    Сжатие существующих файлов из paths в directory; список описаний архивов
+    (name, path, bytes, source_bytes, files) для XCom
+    """
+    if compression not in COMPRESSION_FORMATS:
+        raise ValueError(
+            f"Неизвестный формат сжатия вложений: {compression}. "
+            f"Доступны: {', '.join(COMPRESSION_FORMATS)}"
+        )
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        return []
+
+    if compression == 'zip':
+        target = os.path.join(directory, f"{archive_name}.zip")
+        _zip_files(paths, target)
+        return [_archive(target, sum(map(os.path.getsize, paths)), [os.path.basename(path) for path in paths])]
+
+    archives = []
+    for path in paths:
+        target = path
+        if compression == 'gzip':
+            target = os.path.join(directory, os.path.basename(path) + '.gz')
+            _gzip_file(path, target)
+        archives.append(_archive(target, os.path.getsize(path), [os.path.basename(path)]))
+    return archives
+
+
+def artifact_link(path, link_base=None, base_dir=None):
+    """
+    Ссылка на файл хранилища: link_base + путь относительно base_dir, иначе сам путь
+    """
+    if not link_base:
+        return path
+    relative = os.path.relpath(path, base_dir) if base_dir else os.path.basename(path)
+    return f"{link_base.rstrip('/')}/{quote(relative.replace(os.sep, '/'))}"
+
+
+def encoded_size(archive):
+    """
+    Верхняя оценка размера архива во вложении письма: base64 (4 байта на 3)
+    с переносами строк и заголовки части MIME
+    """
+    encoded = math.ceil(archive['bytes'] / 3) * 4
+    line_breaks = 2 * math.ceil(encoded / BASE64_LINE_LENGTH)
+    return encoded + line_breaks + MIME_PART_OVERHEAD + len(archive['name'].encode('utf-8'))
+
+
+def plan_attachments(archives, max_bytes, link_base=None, base_dir=None):
+    """
+    Разделение архивов в порядке списка на вложения (в письме суммарно
+    не больше max_bytes), ссылки и отсутствующие на диске;
+    возвращает (вложения, ссылки, отсутствующие)
+    """
+    attached = []
+    linked = []
+    missing = []
+    total = 0
+    for archive in archives:
+        if not os.path.exists(archive['path']):
+            missing.append(archive)
+            continue
+        size = encoded_size(archive)
+        if total + size <= max_bytes:
+            attached.append(archive)
+            total += size
+        else:
+            linked.append(dict(archive, link=artifact_link(archive['path'], link_base, base_dir)))
+    return attached, linked, missing
+
+
+def format_size(size):
+    """
+    Размер файла для письма: 512 Б, 1.5 КБ, 12.3 МБ
+    """
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024 or unit == 'МБ':
+            return f"{size} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
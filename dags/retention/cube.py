@@ -0,0 +1,303 @@
+"""
+Куб агрегатов (rollup) по отделам и курсам за один проход.
+
+Объединение обучения с сотрудниками и курсами (join_engine.encode_join)
+агрегируется один раз до самой детальной ячейки отдел × курс, а более
+грубые наборы группировки сворачиваются из нее, как GROUPING SETS в SQL:
+- department_course - (отдел, курс);
+- department - (отдел), совпадает с retention_analysis;
+- course - (курс), совпадает с join_engine.course_stats;
+- total - () - итог по всем строкам.
+
+Аддитивные меры (записи, сумма и число оценок) суммируются из ячеек
+отдел × курс. Число уникальных сотрудников не аддитивно, поэтому оно
+считается по уникальным тройкам (отдел, курс, сотрудник), спроецированным
+на каждый набор группировки, без повторного прохода по строкам.
+
+Свернутое измерение хранится значением ALL_DEPARTMENTS или ALL_COURSES,
+а не NULL: ключ (analysis_date, grouping_set, department, course_id)
+должен быть уникальным для upsert раздела. Колонка period - метка периода
+даты запуска (CUBE_PERIODS). Куб даты строится по всему снимку источников
+на эту дату - файлы обучения хранят накопленную историю, поэтому ячейки
+разных дат не складываются: иначе одни и те же строки учитывались бы
+в мерах каждый день. Свертка по периоду (cube_query с by_period) берет
+для каждого периода ячейки последней даты запуска в нем - состояние на
+конец периода, как sketches.sketch_stats.
+"""
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from retention.join_engine import encode_join
+
+GROUPING_SETS = ('department_course', 'department', 'course', 'total')
+
+ALL_DEPARTMENTS = ''
+ALL_COURSES = -1
+
+CUBE_PERIODS = ('day', 'week', 'month', 'quarter', 'year')
+
+# Уникальные ключи битовой картой, если их диапазон не больше UNIQUE_BITMAP_DENSITY
+# значений на ключ и UNIQUE_BITMAP_BYTES байт, иначе сортировкой
+UNIQUE_BITMAP_DENSITY = 8
+UNIQUE_BITMAP_BYTES = 256 * 1024 * 1024
+
+# Колонки ячейки куба (rollup_cube и артефакт staging)
+CELL_COLUMNS = [
+    'grouping_set', 'department', 'course_id', 'course_name',
+    'total_employees', 'total_records', 'score_sum', 'score_count', 'avg_score',
+]
+
+CUBE_COLUMNS = [
+    ('analysis_date', 'TEXT'),
+    ('period', 'TEXT'),
+    ('grouping_set', 'TEXT'),
+    ('department', 'TEXT'),
+    ('course_id', 'INTEGER'),
+    ('course_name', 'TEXT'),
+    ('total_employees', 'INTEGER'),
+    ('total_records', 'INTEGER'),
+    ('score_sum', 'REAL'),
+    ('score_count', 'INTEGER'),
+    ('avg_score', 'REAL'),
+]
+CUBE_KEY = ['analysis_date', 'grouping_set', 'department', 'course_id']
+
+_CUBE_VALUES = """
+    course_name {text},
+    total_employees {integer} NOT NULL,
+    total_records {integer} NOT NULL,
+    score_sum {real} NOT NULL,
+    score_count {integer} NOT NULL,
+    avg_score {real}
+"""
+
+CUBE_DDL = {
+    'sqlite': [
+        f"""
+        CREATE TABLE IF NOT EXISTS retention_cube (
+            analysis_date TEXT NOT NULL,
+            period TEXT NOT NULL,
+            grouping_set TEXT NOT NULL,
+            department TEXT NOT NULL,
+            course_id INTEGER NOT NULL,
+            {_CUBE_VALUES.format(text='TEXT', integer='INTEGER', real='REAL')}
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_retention_cube_cell "
+        "ON retention_cube (analysis_date, grouping_set, department, course_id)",
+        # Ячейки набора группировки за период и история одной ячейки без просмотра всех разделов
+        "CREATE INDEX IF NOT EXISTS ix_retention_cube_period "
+        "ON retention_cube (grouping_set, period, department, course_id)",
+        "CREATE INDEX IF NOT EXISTS ix_retention_cube_history "
+        "ON retention_cube (grouping_set, department, course_id, analysis_date)",
+    ],
+    'duckdb': [
+        f"""
+        CREATE TABLE IF NOT EXISTS retention_cube (
+            analysis_date DATE NOT NULL,
+            period VARCHAR NOT NULL,
+            grouping_set VARCHAR NOT NULL,
+            department VARCHAR NOT NULL,
+            course_id INTEGER NOT NULL,
+            {_CUBE_VALUES.format(text='VARCHAR', integer='BIGINT', real='DOUBLE')},
+            PRIMARY KEY (analysis_date, grouping_set, department, course_id)
+        )
+        """,
+    ],
+    'postgresql': [
+        f"""
+        CREATE TABLE IF NOT EXISTS retention_cube (
+            analysis_date DATE NOT NULL,
+            period TEXT NOT NULL,
+            grouping_set TEXT NOT NULL,
+            department TEXT NOT NULL,
+            course_id INTEGER NOT NULL,
+            {_CUBE_VALUES.format(text='TEXT', integer='BIGINT', real='DOUBLE PRECISION')}
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_retention_cube_cell "
+        "ON retention_cube (analysis_date, grouping_set, department, course_id)",
+        "CREATE INDEX IF NOT EXISTS ix_retention_cube_period "
+        "ON retention_cube (grouping_set, period, department, course_id)",
+        "CREATE INDEX IF NOT EXISTS ix_retention_cube_history "
+        "ON retention_cube (grouping_set, department, course_id, analysis_date)",
+    ],
+}
+
+
+def period_label(analysis_date, period='day'):
+    """
+    Метка периода даты запуска: 2024-10-02, 2024-W40, 2024-10, 2024-Q4, 2024
+    """
+    if period not in CUBE_PERIODS:
+        raise ValueError(f"Неизвестный период куба: {period}. Доступны: {', '.join(CUBE_PERIODS)}")
+    day = date.fromisoformat(str(analysis_date))
+    if period == 'week':
+        year, week = day.isocalendar()[:2]
+        return f"{year}-W{week:02d}"
+    if period == 'month':
+        return f"{day.year}-{day.month:02d}"
+    if period == 'quarter':
+        return f"{day.year}-Q{(day.month - 1) // 3 + 1}"
+    if period == 'year':
+        return str(day.year)
+    return day.isoformat()
+
+
+def _unique(keys, bound):
+    """
+    Отсортированные уникальные ключи из [0, bound): битовой картой, если
+    диапазон плотный (UNIQUE_BITMAP_DENSITY), иначе через np.unique
+    """
+    if bound > min(UNIQUE_BITMAP_DENSITY * len(keys), UNIQUE_BITMAP_BYTES):
+        return np.unique(keys)
+    seen = np.zeros(bound, dtype=bool)
+    seen[keys] = True
+    return np.flatnonzero(seen)
+
+
+def _distinct(groups, employees, n_employees, n_groups):
+    """
+    Число уникальных сотрудников по группам из пар (группа, сотрудник) с повторами
+    """
+    pairs = _unique(groups * n_employees + employees, n_groups * n_employees)
+    return np.bincount(pairs // n_employees, minlength=n_groups)
+
+
+def _cells(grouping_set, departments, course_ids, employees, records, score_sum, score_count):
+    present = records > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_score = np.where(score_count > 0, score_sum / score_count, np.nan)
+    return pd.DataFrame({
+        'grouping_set': grouping_set,
+        'department': np.asarray(departments, dtype=object)[present],
+        'course_id': np.asarray(course_ids, dtype=np.int64)[present],
+        'total_employees': employees[present].astype(np.int64),
+        'total_records': records[present].astype(np.int64),
+        'score_sum': score_sum[present],
+        'score_count': score_count[present].astype(np.int64),
+        'avg_score': np.round(avg_score[present], 2),
+    })
+
+
+def rollup_cube(employees_df, training_df, courses_df):
+    """
+    Ячейки всех наборов группировки GROUPING_SETS за один проход по объединению;
+    DataFrame с колонками CELL_COLUMNS, отсортированный по набору и ключам
+    """
+    joined = encode_join(employees_df, courses_df, training_df, extra_columns=('course_id',))
+    departments = joined['department'].cat.categories.to_numpy(dtype=object)
+    dept = joined['department'].cat.codes.to_numpy().astype(np.int64)
+    course, courses = pd.factorize(joined['course_id'], sort=True)
+    courses = np.asarray(courses, dtype=np.int64)
+    n_departments, n_courses = len(departments), len(courses)
+    size = n_departments * n_courses
+
+    weight = joined['multiplicity'].to_numpy(dtype='float64')
+    score = joined['score'].to_numpy(dtype='float64')
+    scored = ~np.isnan(score)
+
+    # Самая детальная ячейка отдел × курс: один bincount на меру
+    cell = dept * n_courses + course
+    shape = (n_departments, n_courses)
+    records = np.bincount(cell, weights=weight, minlength=size).reshape(shape)
+    score_sum = np.bincount(cell[scored], weights=score[scored] * weight[scored], minlength=size).reshape(shape)
+    score_count = np.bincount(cell[scored], weights=weight[scored], minlength=size).reshape(shape)
+
+    # Уникальные тройки (ячейка, сотрудник) - основа для уникальных сотрудников всех наборов
+    employee, _ = pd.factorize(joined['employee_id'])
+    n_employees = int(employee.max()) + 1 if len(employee) else 1
+    triples = _unique(cell * n_employees + employee, size * n_employees)
+    triple_cell, triple_employee = np.divmod(triples, n_employees)
+
+    frames = [
+        _cells(
+            'department_course', np.repeat(departments, n_courses), np.tile(courses, n_departments),
+            np.bincount(triple_cell, minlength=size), records.ravel(), score_sum.ravel(), score_count.ravel(),
+        ),
+        _cells(
+            'department', departments, np.full(n_departments, ALL_COURSES),
+            _distinct(triple_cell // n_courses, triple_employee, n_employees, n_departments),
+            records.sum(axis=1), score_sum.sum(axis=1), score_count.sum(axis=1),
+        ),
+        _cells(
+            'course', np.full(n_courses, ALL_DEPARTMENTS, dtype=object), courses,
+            _distinct(triple_cell % n_courses, triple_employee, n_employees, n_courses),
+            records.sum(axis=0), score_sum.sum(axis=0), score_count.sum(axis=0),
+        ),
+        _cells(
+            'total', [ALL_DEPARTMENTS], [ALL_COURSES], np.array([len(_unique(triple_employee, n_employees))]),
+            records.sum(keepdims=True).ravel(), score_sum.sum(keepdims=True).ravel(),
+            score_count.sum(keepdims=True).ravel(),
+        ),
+    ]
+    cube = pd.concat(frames, ignore_index=True)
+
+    names = courses_df.drop_duplicates('course_id').set_index('course_id')['course_name']
+    cube['course_name'] = cube['course_id'].map(names).astype(object)
+    cube.loc[cube['course_id'] == ALL_COURSES, 'course_name'] = None
+    return cube[CELL_COLUMNS]
+
+
+def cube_cells(cube, grouping_set):
+    """
+    Ячейки одного набора группировки по убыванию среднего балла
+    """
+    cells = cube[cube['grouping_set'] == grouping_set]
+    return cells.sort_values(
+        ['avg_score', 'department', 'course_id'], ascending=[False, True, True], na_position='last'
+    ).reset_index(drop=True)
+
+
+def cube_rows(analysis_date, period, cube):
+    """
+    Кортежи строк таблицы retention_cube из DataFrame ячеек
+    """
+    cube = cube[CELL_COLUMNS].astype(object).where(cube[CELL_COLUMNS].notna(), None)
+    for cell in cube.itertuples(index=False):
+        yield (analysis_date, period) + tuple(cell)
+
+
+def cube_query(columns, grouping_set, date_from=None, date_to=None, departments=(), course_ids=(),
+               by_period=False):
+    """
+    Запрос ячеек набора группировки за диапазон дат (индексы retention_cube)
+    по убыванию среднего балла. С by_period - только ячейки последней даты
+    запуска каждого периода диапазона (состояние на конец периода)
+    """
+    def conditions(alias=''):
+        where, params = [f"{alias}grouping_set = ?"], [grouping_set]
+        if date_from:
+            where.append(f"{alias}analysis_date >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append(f"{alias}analysis_date <= ?")
+            params.append(date_to)
+        return where, params
+
+    where, params = conditions()
+    if departments:
+        where.append(f"department IN ({', '.join('?' for _ in departments)})")
+        params.extend(departments)
+    if course_ids:
+        where.append(f"course_id IN ({', '.join('?' for _ in course_ids)})")
+        params.extend(course_ids)
+    if by_period:
+        # Индекс (grouping_set, period, ...): последняя дата периода без просмотра всех разделов
+        latest, latest_params = conditions('latest.')
+        where.append(f"""analysis_date = (
+            SELECT MAX(latest.analysis_date)
+            FROM retention_cube latest
+            WHERE {' AND '.join(latest)} AND latest.period = retention_cube.period
+        )""")
+        params.extend(latest_params)
+    query = f"""
+        SELECT {', '.join(columns)}
+        FROM retention_cube
+        WHERE {' AND '.join(where)}
+        ORDER BY avg_score IS NULL, avg_score DESC, analysis_date DESC, department, course_id
+        """
+    return query, params
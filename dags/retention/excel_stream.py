@@ -0,0 +1,94 @@
+"""
+Потоковое чтение training.xlsx.
+
+openpyxl в режиме read_only разбирает лист построчно, не строя дерево
+всех ячеек в памяти. Строки собираются в пакеты фиксированного размера
+и превращаются в типизированные pyarrow.RecordBatch, поэтому пиковое
+потребление памяти определяется размером пакета, а не размером листа.
+Типы колонок берутся из реестра схем; строки, которые к ним не
+приводятся, собираются в список rejected.
+"""
+
+import pyarrow as pa
+from openpyxl import load_workbook
+
+from retention.schemas import SOURCE_SCHEMAS
+
+# Схема данных об обучении с компактными типами
+TRAINING = SOURCE_SCHEMAS['training']
+TRAINING_SCHEMA = TRAINING.arrow_schema
+
+DEFAULT_BATCH_SIZE = 65536
+
+
+def _column_positions(header, schema, sheet_title):
+    """
+    Позиции нужных колонок в строке заголовка листа
+    """
+    names = [str(value).strip() if value is not None else None for value in header]
+    positions = []
+    for name in schema.names:
+        if name not in names:
+            raise ValueError(f"В листе '{sheet_title}' нет колонки '{name}'")
+        positions.append(names.index(name))
+    return positions
+
+
+def _make_batches(columns, schema, path, rejected):
+    batches, rejected_rows = schema.batch_from_columns(columns, path)
+    if rejected_rows is not None:
+        if rejected is None:
+            raise ValueError(
+                f"В файле {path} есть строки, не подходящие под схему {schema.name}: "
+                f"{rejected_rows['reason'].iloc[0]}"
+            )
+        rejected.append(rejected_rows)
+    return batches
+
+
+def iter_excel_batches(path, schema=TRAINING, batch_size=DEFAULT_BATCH_SIZE,
+                       all_sheets=False, rejected=None):
+    """
+    Генератор типизированных RecordBatch из Excel файла.
+
+    По умолчанию читается только первый лист, как в pd.read_excel.
+    С all_sheets=True последовательно читаются все листы с одинаковым
+    заголовком: один лист Excel вмещает не более 1 048 576 строк.
+    Отклоненные схемой строки добавляются в список rejected,
+    без него первая такая строка прерывает чтение.
+    """
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheets = workbook.worksheets if all_sheets else workbook.worksheets[:1]
+        for sheet in sheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            positions = _column_positions(header, schema, sheet.title)
+
+            columns = [[] for _ in positions]
+            for row in rows:
+                # Пустые строки в конце листа openpyxl тоже возвращает
+                if all(value is None for value in row):
+                    continue
+                for values, position in zip(columns, positions):
+                    values.append(row[position] if position < len(row) else None)
+
+                if len(columns[0]) >= batch_size:
+                    yield from _make_batches(columns, schema, path, rejected)
+                    columns = [[] for _ in positions]
+
+            if columns[0]:
+                yield from _make_batches(columns, schema, path, rejected)
+    finally:
+        workbook.close()
+
+
+def read_excel_table(path, schema=TRAINING, batch_size=DEFAULT_BATCH_SIZE,
+                     all_sheets=False, rejected=None):
+    """
+    Чтение всего Excel файла в pyarrow.Table через потоковый разбор
+    """
+    batches = list(iter_excel_batches(path, schema, batch_size, all_sheets, rejected))
+    return pa.Table.from_batches(batches, schema=schema.arrow_schema)
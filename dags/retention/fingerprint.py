@@ -0,0 +1,201 @@
+"""
+Кэш отпечатков исходных файлов и состояний этапов DAG.
+
+Для каждого источника хранятся отпечатки его файлов (mtime, размер, SHA-256),
+ключ правил разбора (схема, политика отклонения) и манифест колоночного
+снимка. Если файлы и правила не менялись, задача извлечения повторно
+использует снимок вместо разбора. Этапы transform/load хранят
+ключ своих входов и пропускают работу, когда ключ не изменился.
+
+Результат этапа хранится отдельным файлом на ключ входов
+(stage_<этап>/<ключ>.json): параллельные запуски DAG (например, backfill
+и запуск по расписанию) с разными входами не затирают записи друг друга.
+Записи пишутся через временный файл и переименование; у этапа остается
+не больше STAGE_ENTRIES последних использованных записей.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from retention.artifacts import file_checksum
+
+
+def source_fingerprint(path, with_hash=True):
+    """
+    Отпечаток файла: время изменения, размер и (опционально) SHA-256
+    """
+    stat = os.stat(path)
+    fingerprint = {
+        'mtime': stat.st_mtime,
+        'size': stat.st_size,
+    }
+    if with_hash:
+        fingerprint['sha256'] = file_checksum(path)
+    return fingerprint
+
+
+def inputs_key(*parts):
+    """
+    Общий ключ набора входов: хэш от их контрольных сумм или значений
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Записей одного этапа в кэше: более давно использованные удаляются
+STAGE_ENTRIES = 16
+
+
+def _as_paths(source_paths):
+    return [source_paths] if isinstance(source_paths, str) else list(source_paths)
+
+
+class SourceCache:
+    """
+    Файловый кэш: отпечатки источников со снимками и ключи этапов
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def _load(self, name):
+        path = self._entry_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, name, entry):
+        path = self._entry_path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Временный файл уникален: одновременная запись той же записи не смешивает содержимое
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def lookup_source(self, name, source_paths, key=None):
+        """
+        Манифест снимка источника, если его файлы (один путь или список шардов)
+        и ключ правил разбора не изменились, иначе None
+        """
+        paths = _as_paths(source_paths)
+        entry = self._load(f"source_{name}")
+        if (entry is None or 'fingerprints' not in entry
+                or entry.get('key') != key
+                or not os.path.exists(entry['manifest']['path'])):
+            return None
+
+        fingerprints = entry['fingerprints']
+        # Добавился или пропал шард
+        if sorted(fingerprints) != sorted(paths):
+            return None
+
+        refreshed = False
+        for path in paths:
+            cached = fingerprints[path]
+            current = source_fingerprint(path, with_hash=False)
+            if current['mtime'] == cached['mtime'] and current['size'] == cached['size']:
+                continue
+
+            # mtime мог измениться без изменения содержимого (touch, повторное копирование)
+            if current['size'] != cached['size']:
+                return None
+            current['sha256'] = file_checksum(path)
+            if current['sha256'] != cached['sha256']:
+                return None
+            fingerprints[path] = current
+            refreshed = True
+
+        if refreshed:
+            self._save(f"source_{name}", entry)
+        return entry['manifest']
+
+    def save_source(self, name, source_paths, manifest, key=None):
+        """
+        Сохранение отпечатков файлов источника и ключа правил разбора
+        вместе с манифестом его снимка
+        """
+        self._save(f"source_{name}", {
+            'fingerprints': {path: source_fingerprint(path) for path in _as_paths(source_paths)},
+            'key': key,
+            'manifest': manifest,
+        })
+
+    def stage_result(self, stage, key):
+        """
+        Сохраненный результат этапа, если он был получен для того же ключа входов
+        (inputs_key)
+        """
+        name = os.path.join(f"stage_{stage}", key)
+        entry = self._load(name)
+        if entry is None or entry['key'] != key:
+            return None
+        try:
+            # Время изменения - время последнего использования для очистки старых записей
+            os.utime(self._entry_path(name))
+        except FileNotFoundError:
+            pass
+        return entry['result']
+
+    def save_stage(self, stage, key, result=None, keep=STAGE_ENTRIES):
+        """
+        Запоминание ключа входов этапа и его (небольшого) результата;
+        остаются keep последних использованных записей этапа
+        """
+        self._save(os.path.join(f"stage_{stage}", key), {'key': key, 'result': result})
+        directory = os.path.join(self.cache_dir, f"stage_{stage}")
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                try:
+                    entries.append((os.stat(os.path.join(directory, name)).st_mtime_ns, name))
+                except FileNotFoundError:
+                    continue
+        for _, name in sorted(entries, reverse=True)[keep:]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+    def referenced_paths(self):
+        """
+        Пути файлов (снимков и артефактов этапов), на которые ссылаются записи кэша
+        """
+        paths = set()
+        for directory, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                        _collect_paths(json.load(f), paths)
+                except (FileNotFoundError, ValueError):
+                    continue
+        return paths
+
+
+def _collect_paths(value, paths):
+    # Манифесты артефактов - словари с ключом path на любой глубине записи
+    if isinstance(value, dict):
+        if isinstance(value.get('path'), str):
+            paths.add(value['path'])
+        for item in value.values():
+            _collect_paths(item, paths)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_paths(item, paths)
@@ -0,0 +1,118 @@
+"""
+Режим fused: все этапы DAG в одной задаче.
+
+Для небольших запусков извлечение, проверка, трансформация, загрузка
+и отчет выполняются подряд в одном процессе: без планирования отдельных
+задач, запуска интерпретатора на каждую из них и обмена через XCom
+в базе метаданных. Функции этапов те же, что у задач DAG, но вместо
+task_instance получают LocalTaskInstance, а XCom хранится в памяти
+(FusedRun). Артефакты staging по-прежнему пишутся на диск (на них
+опираются кэш этапов, pushdown и инкрементальное состояние), но уже
+прочитанные в pandas источники передаются следующим этапам без
+повторного чтения (shared_frames).
+
+Режим выбирается по суммарному размеру исходных файлов (choose_mode):
+большие запуски идут по обычному графу задач.
+"""
+
+import contextvars
+import os
+
+EXECUTION_MODES = ('auto', 'fused', 'split')
+
+_run = contextvars.ContextVar('retention_fused_run', default=None)
+
+
+def source_bytes(paths):
+    """
+    Суммарный размер исходных файлов, байт
+    """
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def choose_mode(requested, total_bytes, max_bytes):
+    """
+    Режим выполнения: fused или split; auto - fused, если исходные файлы
+    занимают не больше max_bytes
+    """
+    if requested not in EXECUTION_MODES:
+        raise ValueError(f"Неизвестный режим выполнения: {requested}. Доступны: {', '.join(EXECUTION_MODES)}")
+    if requested != 'auto':
+        return requested
+    return 'fused' if total_bytes <= max_bytes else 'split'
+
+
+class LocalTaskInstance:
+    """
+    task_instance этапа внутри FusedRun: XCom в памяти процесса
+    """
+
+    def __init__(self, run, task_id, map_index=-1):
+        self.run = run
+        self.task_id = task_id
+        self.map_index = map_index
+
+    def xcom_push(self, key, value):
+        self.run.xcom[(self.task_id, self.map_index, key)] = value
+
+    def xcom_pull(self, key='return_value', task_ids=None):
+        task_id = task_ids or self.task_id
+        values = sorted(
+            (map_index, value) for (stored_task, map_index, stored_key), value in self.run.xcom.items()
+            if stored_task == task_id and stored_key == key
+        )
+        if not values:
+            return None
+        # Как у размноженной задачи Airflow: список значений по map_index
+        if values[0][0] >= 0:
+            return [value for _, value in values]
+        return values[0][1]
+
+
+class FusedRun:
+    """
+    Последовательное выполнение функций задач DAG в одном процессе
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.xcom = {}
+        self.frames = {}
+        self._token = None
+
+    def __enter__(self):
+        self._token = _run.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _run.reset(self._token)
+        self.frames.clear()
+
+    def run(self, task_id, func, map_index=-1, **kwargs):
+        """
+        Выполнение функции задачи task_id; возвращаемое значение - в XCom, как у PythonOperator
+        """
+        task_instance = LocalTaskInstance(self, task_id, map_index)
+        context = dict(self.context, task_instance=task_instance, ti=task_instance)
+        result = func(**kwargs, **context)
+        if result is not None:
+            task_instance.xcom_push('return_value', result)
+        return result
+
+    def values(self, task_id):
+        """
+        Значения XCom задачи task_id по ключам
+        """
+        return {key: value for (stored_task, _, key), value in self.xcom.items() if stored_task == task_id}
+
+
+def shared_frames(key, read):
+    """
+    Результат read() для ключа key: внутри FusedRun читается один раз на запуск
+    """
+    run = _run.get()
+    if run is None:
+        return read()
+    if key not in run.frames:
+        run.frames[key] = read()
+    return run.frames[key]
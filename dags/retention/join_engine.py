@@ -0,0 +1,299 @@
+"""
+Объединение сотрудников, обучения и курсов на словарном кодировании.
+
+Вместо двух pd.merge с построением широкого final_df:
+- отдел кодируется категорией (целочисленный код на сотрудника);
+- employee_id отображается в код отдела через плотный массив-индекс
+  (или через бинарный поиск, если идентификаторы сильно разрежены);
+- объединение с курсами сводится к semi-join: проверяется только наличие
+  course_id в справочнике, course_name не читается.
+
+Результат совпадает с inner-объединениями pd.merge, включая кратность
+строк при повторяющихся course_id в справочнике курсов.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Плотный индекс используется, если он не более чем в DENSE_INDEX_FACTOR раз
+# больше числа ключей (плюс запас DENSE_INDEX_SLACK элементов)
+DENSE_INDEX_FACTOR = 4
+DENSE_INDEX_SLACK = 1000000
+
+# Колонки частичных агрегатов по отделам (department_partials)
+PARTIAL_COLUMNS = ['department', 'score_sum', 'score_count', 'record_count', 'total_employees']
+
+
+def _as_int_keys(values):
+    """
+    Целочисленные неотрицательные ключи и маска допустимых значений
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_integer_dtype(values.dtype) and not values.hasnans:
+        keys = values.to_numpy(dtype=np.int64)
+        valid = keys >= 0
+        return np.where(valid, keys, 0), valid
+
+    values = pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    valid = ~np.isnan(values)
+    valid &= values >= 0
+    valid &= values == np.floor(values)
+    keys = np.zeros(len(values), dtype=np.int64)
+    keys[valid] = values[valid].astype(np.int64)
+    return keys, valid
+
+
+class KeyIndex:
+    """
+    Отображение целочисленного ключа в значение (код) без хэш-таблицы
+    """
+
+    def __init__(self, keys, codes, missing=-1):
+        self.missing = missing
+        max_key = int(keys.max()) if len(keys) else -1
+        self.dense = max_key < DENSE_INDEX_FACTOR * len(keys) + DENSE_INDEX_SLACK
+        if self.dense:
+            # Последний элемент всегда пустой: в него попадают ключи за пределами таблицы
+            self.table = np.full(max_key + 2, missing, dtype=codes.dtype)
+            self.table[keys] = codes
+        else:
+            order = np.argsort(keys, kind='stable')
+            self.keys = keys[order]
+            self.codes = codes[order]
+
+    def lookup(self, probe, valid):
+        if self.dense:
+            result = self.table[np.minimum(probe, len(self.table) - 1)]
+            if not valid.all():
+                result[~valid] = self.missing
+            return result
+
+        result = np.full(len(probe), self.missing, dtype=self.codes.dtype)
+        if len(self.keys) == 0:
+            return result
+        positions = np.minimum(np.searchsorted(self.keys, probe), len(self.keys) - 1)
+        matched = valid & (self.keys[positions] == probe)
+        result[matched] = self.codes[positions[matched]]
+        return result
+
+
+def _encode(employees_df, courses_df, training_df):
+    """
+    Кодирование объединения в массивы: коды отделов и кратности по строкам обучения
+    """
+    emp_keys, emp_valid = _as_int_keys(employees_df['employee_id'])
+    # Сотрудники без корректного идентификатора не могут совпасть ни с одной строкой
+    if not emp_valid.all():
+        employees_df = employees_df[emp_valid]
+        emp_keys = emp_keys[emp_valid]
+
+    original_ids = None
+    if pd.Series(emp_keys).duplicated().any():
+        merged = pd.merge(employees_df[['employee_id', 'department']], training_df, on='employee_id', how='inner')
+        original_ids = merged['employee_id'].to_numpy(dtype=np.int64)
+        # Каждая строка объединения получает собственный суррогатный ключ
+        surrogate = np.arange(len(merged), dtype=np.int64)
+        employees_df = pd.DataFrame({'employee_id': surrogate, 'department': merged['department'].to_numpy()})
+        training_df = merged.assign(employee_id=surrogate)
+        emp_keys = surrogate
+
+    department = employees_df['department']
+    if isinstance(department.dtype, pd.CategoricalDtype):
+        # Отдел закодирован при чтении артефакта (реестр схем): берем коды category
+        dept_codes, departments = department.cat.codes.to_numpy(), department.cat.categories
+    else:
+        dept_codes, departments = pd.factorize(department, sort=True)
+    dept_index = KeyIndex(emp_keys, dept_codes.astype(np.int32))
+
+    train_emp, train_emp_valid = _as_int_keys(training_df['employee_id'])
+    row_dept = dept_index.lookup(train_emp, train_emp_valid)
+
+    # Semi-join с курсами: кратность course_id в справочнике (0 - курса нет)
+    course_keys, course_valid = _as_int_keys(courses_df['course_id'])
+    unique_courses, course_counts = np.unique(course_keys[course_valid], return_counts=True)
+    course_index = KeyIndex(unique_courses, course_counts.astype(np.int32), missing=0)
+    train_course, train_course_valid = _as_int_keys(training_df['course_id'])
+    multiplicity = course_index.lookup(train_course, train_course_valid)
+
+    keep = (row_dept >= 0) & (multiplicity > 0)
+    return {
+        'training_df': training_df,
+        'departments': departments,
+        'dept_index': dept_index,
+        'keep': keep,
+        'dept_codes': row_dept[keep],
+        'employee_ids': original_ids[keep] if original_ids is not None else train_emp[keep],
+        'multiplicity': multiplicity[keep],
+        'unique_employees': original_ids is None,
+    }
+
+
+def _kept_scores(encoded):
+    return encoded['training_df']['score'].to_numpy(dtype='float64', na_value=np.nan)[encoded['keep']]
+
+
+def encode_join(employees_df, courses_df, training_df, extra_columns=()):
+    """
+    Объединение обучения с сотрудниками и semi-join с курсами.
+
+    Возвращает компактный DataFrame: department (category), employee_id,
+    score и multiplicity - сколько строк дало бы inner-объединение
+    с курсами (обычно 1), а также колонки extra_columns из обучения.
+    Если employee_id в справочнике сотрудников повторяются, объединение
+    по сотрудникам выполняется через pd.merge, чтобы сохранить кратность строк.
+    """
+    encoded = _encode(employees_df, courses_df, training_df)
+    joined = pd.DataFrame({
+        'department': pd.Categorical.from_codes(encoded['dept_codes'], categories=encoded['departments']),
+        'employee_id': encoded['employee_ids'],
+        'score': _kept_scores(encoded),
+        'multiplicity': encoded['multiplicity'].astype(np.int64),
+    })
+    for column in extra_columns:
+        joined[column] = encoded['training_df'][column].to_numpy()[encoded['keep']]
+    return joined
+
+
+def department_partials(employees_df, training_df, courses_df):
+    """
+    Частичные агрегаты по отделам: сумма и число оценок, число записей
+    и уникальных сотрудников. Агрегаты разделов, не пересекающихся по парам
+    (отдел, сотрудник), складываются в combine_partials.
+    """
+    encoded = _encode(employees_df, courses_df, training_df)
+    departments = encoded['departments']
+    codes = encoded['dept_codes']
+    weight = encoded['multiplicity']
+    score = _kept_scores(encoded)
+    n_departments = len(departments)
+
+    record_count = np.bincount(codes, weights=weight, minlength=n_departments)
+    has_score = ~np.isnan(score)
+    if has_score.all():
+        score_sum = np.bincount(codes, weights=score * weight, minlength=n_departments)
+        score_count = record_count
+    else:
+        score_sum = np.bincount(codes[has_score], weights=score[has_score] * weight[has_score], minlength=n_departments)
+        score_count = np.bincount(codes[has_score], weights=weight[has_score], minlength=n_departments)
+
+    employee_ids = encoded['employee_ids']
+    dept_index = encoded['dept_index']
+    if encoded['unique_employees'] and dept_index.dense:
+        # Отдел сотрудника однозначен: достаточно отметить встреченных сотрудников
+        seen = np.zeros(len(dept_index.table), dtype=bool)
+        seen[employee_ids] = True
+        distinct = np.bincount(dept_index.table[seen], minlength=n_departments)
+    else:
+        # Уникальные пары (отдел, сотрудник), упакованные в один int64
+        stride = int(employee_ids.max()) + 1 if len(employee_ids) else 1
+        pairs = np.unique(codes.astype(np.int64) * stride + employee_ids)
+        distinct = np.bincount(pairs // stride, minlength=n_departments)
+
+    present = record_count > 0
+    return pd.DataFrame({
+        'department': departments[present],
+        'score_sum': score_sum[present],
+        'score_count': score_count[present].astype(np.int64),
+        'record_count': record_count[present].astype(np.int64),
+        'total_employees': distinct[present].astype(np.int64),
+    })
+
+
+def combine_partials(partials):
+    """
+    Итоговая статистика по отделам из списка частичных агрегатов
+    (DataFrame или списков записей с колонками PARTIAL_COLUMNS)
+    """
+    partials = [pd.DataFrame(partial, columns=PARTIAL_COLUMNS) for partial in partials]
+    combined = pd.concat(partials, ignore_index=True).groupby('department', sort=True).sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_score = np.where(
+            combined['score_count'] > 0,
+            combined['score_sum'] / combined['score_count'],
+            np.nan,
+        )
+
+    dept_stats = pd.DataFrame({
+        'department': combined.index,
+        'total_employees': combined['total_employees'].to_numpy(dtype=np.int64),
+        'total_courses': combined['record_count'].to_numpy(dtype=np.int64),
+        'avg_score': avg_score,
+    })
+    dept_stats['avg_score'] = dept_stats['avg_score'].round(2)
+    return dept_stats
+
+
+def department_stats(employees_df, training_df, courses_df):
+    """
+    Средний балл по отделам за один проход без широкого промежуточного DataFrame
+    """
+    return combine_partials([department_partials(employees_df, training_df, courses_df)])
+
+
+def _grouped_stats(joined, keys):
+    """
+    Число записей и средний балл (с учетом кратности строк) по ключам keys
+    """
+    weight = joined['multiplicity']
+    scored = joined['score'].notna()
+    frame = joined[keys].assign(
+        records=weight,
+        score_sum=joined['score'].fillna(0) * weight,
+        score_count=weight.where(scored, 0),
+    )
+    grouped = frame.groupby(keys, sort=False, observed=True).sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grouped['avg_score'] = (grouped['score_sum'] / grouped['score_count'].where(grouped['score_count'] > 0)).round(2)
+    return grouped
+
+
+def _by_score(stats, key):
+    return stats.sort_values(['avg_score', key], ascending=[False, True], na_position='last').reset_index(drop=True)
+
+
+def course_stats(employees_df, training_df, courses_df):
+    """
+    Статистика по курсам: уникальные сотрудники, записи и средний балл
+    """
+    joined = encode_join(employees_df, courses_df, training_df, extra_columns=('course_id',))
+    grouped = _grouped_stats(joined, ['course_id'])
+    names = courses_df.drop_duplicates('course_id').set_index('course_id')['course_name']
+    stats = pd.DataFrame({
+        'course_id': grouped.index.to_numpy(dtype=np.int64),
+        'course_name': grouped.index.map(names).to_numpy(dtype=object),
+        'total_employees': joined.groupby('course_id', sort=False)['employee_id'].nunique()
+                                 .reindex(grouped.index).to_numpy(dtype=np.int64),
+        'total_records': grouped['records'].to_numpy(dtype=np.int64),
+        'avg_score': grouped['avg_score'].to_numpy(),
+    })
+    return _by_score(stats, 'course_id')
+
+
+def employee_stats(employees_df, training_df, courses_df):
+    """
+    Статистика по сотрудникам: отдел, число пройденных курсов и средний балл
+    """
+    joined = encode_join(employees_df, courses_df, training_df)
+    grouped = _grouped_stats(joined, ['department', 'employee_id']).reset_index()
+    stats = pd.DataFrame({
+        'employee_id': grouped['employee_id'].to_numpy(dtype=np.int64),
+        'department': grouped['department'].astype(object).to_numpy(),
+        'total_courses': grouped['records'].to_numpy(dtype=np.int64),
+        'avg_score': grouped['avg_score'].to_numpy(),
+    })
+    return _by_score(stats, 'employee_id')
+
+
+def merge_department_stats(employees_df, training_df, courses_df):
+    """
+    Исходный расчет через два pd.merge и groupby (эталон для сравнения)
+    """
+    merged_df = pd.merge(employees_df, training_df, on='employee_id', how='inner')
+    final_df = pd.merge(merged_df, courses_df, on='course_id', how='inner')
+    dept_stats = final_df.groupby('department').agg(
+        total_employees=('employee_id', 'nunique'),
+        total_courses=('course_id', 'count'),
+        avg_score=('score', 'mean')
+    ).reset_index()
+    dept_stats['avg_score'] = dept_stats['avg_score'].round(2)
+    return dept_stats
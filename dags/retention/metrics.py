@@ -0,0 +1,294 @@
+"""
+Инструментирование задач DAG: интервалы (spans) этапов и экспорт метрик.
+
+Функция задачи оборачивается декоратором instrument_task, а ее этапы
+(чтение, разбор, объединение, агрегация, запись, отчет, письмо) -
+контекстным менеджером span. Для каждого интервала записываются
+длительность, количество строк, байты и изменение RSS процесса.
+По завершении задачи интервалы выводятся в лог и экспортируются
+по URL (несколько через запятую):
+- sqlite:////opt/airflow/staging/metrics.db - таблица task_metrics;
+- prometheus:////var/lib/node_exporter - текстовые файлы *.prom
+  для textfile collector;
+- statsd://localhost:8125 - UDP-пакеты StatsD.
+
+Ошибка экспорта не прерывает задачу.
+"""
+
+import contextvars
+import functools
+import os
+import resource
+import socket
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+METRIC_COLUMNS = [
+    ('run_id', 'TEXT'),
+    ('task_id', 'TEXT'),
+    ('span', 'TEXT'),
+    ('started_at', 'TEXT'),
+    ('seconds', 'REAL'),
+    ('rows', 'INTEGER'),
+    ('bytes', 'INTEGER'),
+    ('rss_delta_mb', 'REAL'),
+    ('peak_rss_mb', 'REAL'),
+]
+
+TASK_METRICS_DDL = """
+CREATE TABLE IF NOT EXISTS task_metrics (
+    run_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    span TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    rows INTEGER,
+    bytes INTEGER,
+    rss_delta_mb REAL,
+    peak_rss_mb REAL
+)
+"""
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_recorder = contextvars.ContextVar('retention_metrics_recorder', default=None)
+_metrics_url = None
+
+
+def configure(url):
+    """
+    URL экспорта метрик по умолчанию; переменная RETENTION_METRICS_URL имеет приоритет
+    """
+    global _metrics_url
+    _metrics_url = url
+
+
+def current_rss_mb():
+    """
+    Текущий RSS процесса (Linux: /proc/self/statm), иначе пиковый
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux измеряется в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Span:
+    """
+    Замер одного этапа; rows и bytes заполняются внутри блока with
+    """
+
+    def __init__(self, name, rows=None, bytes=None):
+        self.name = name
+        self.rows = rows
+        self.bytes = bytes
+        self.started_at = None
+        self.seconds = None
+        self.rss_delta_mb = None
+        self.peak_rss_mb = None
+
+    def as_row(self, run_id, task_id):
+        return (
+            run_id, task_id, self.name, self.started_at, self.seconds,
+            self.rows, self.bytes, self.rss_delta_mb, self.peak_rss_mb,
+        )
+
+
+class MetricsRecorder:
+    """
+    Интервалы одной задачи (одного task instance)
+    """
+
+    def __init__(self, task_id, run_id):
+        self.task_id = task_id
+        self.run_id = run_id
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, rows=None, bytes=None):
+        span = Span(name, rows, bytes)
+        span.started_at = datetime.now().isoformat(timespec='milliseconds')
+        rss_before = current_rss_mb()
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - started
+            span.rss_delta_mb = current_rss_mb() - rss_before
+            span.peak_rss_mb = peak_rss_mb()
+            self.spans.append(span)
+
+    def rows(self):
+        return [span.as_row(self.run_id, self.task_id) for span in self.spans]
+
+    def summary(self):
+        lines = [f"{'этап':<12} {'время, с':>10} {'строк':>12} {'байт':>14} {'ΔRSS, МБ':>10}"]
+        for span in self.spans:
+            lines.append(
+                f"{span.name:<12} {span.seconds:>10.3f} {_fmt(span.rows):>12} "
+                f"{_fmt(span.bytes):>14} {span.rss_delta_mb:>10.1f}"
+            )
+        return '\n'.join(lines)
+
+
+def _fmt(value):
+    return '-' if value is None else f"{value:,}"
+
+
+@contextmanager
+def span(name, rows=None, bytes=None):
+    """
+    Интервал этапа в текущей задаче; вне instrument_task замер не сохраняется
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        yield Span(name, rows, bytes)
+        return
+    with recorder.span(name, rows, bytes) as current:
+        yield current
+
+
+def instrument_task(func):
+    """
+    Декоратор функции задачи: собирает интервалы и экспортирует их после выполнения
+    """
+
+    @functools.wraps(func)
+    def wrapper(**context):
+        task_instance = context.get('task_instance')
+        task_id = getattr(task_instance, 'task_id', None) or func.__name__
+        # Экземпляры динамически размноженной задачи различаются по map_index
+        map_index = getattr(task_instance, 'map_index', -1)
+        if isinstance(map_index, int) and map_index >= 0:
+            task_id = f"{task_id}_{map_index}"
+        recorder = MetricsRecorder(task_id, context.get('run_id') or 'manual')
+        token = _recorder.set(recorder)
+        try:
+            with recorder.span('task'):
+                return func(**context)
+        finally:
+            _recorder.reset(token)
+            print("Метрики этапов:")
+            print(recorder.summary())
+            export(recorder)
+
+    return wrapper
+
+
+def export(recorder, url=None):
+    """
+    Экспорт интервалов задачи по всем URL из настройки
+    """
+    url = url or os.environ.get('RETENTION_METRICS_URL') or _metrics_url
+    if not url:
+        return
+    for target in url.split(','):
+        target = target.strip()
+        if not target:
+            continue
+        try:
+            get_exporter(target).export(recorder)
+        except Exception as e:
+            print(f"Не удалось экспортировать метрики в {target}: {str(e)}")
+
+
+class SQLiteMetricsExporter:
+    """
+    Таблица task_metrics в локальной базе SQLite
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, recorder):
+        # Импорт при экспорте: модуль загружается и при разборе файла DAG планировщиком
+        from retention import sqlite_loader
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite_loader.connect(self.path)
+        try:
+            conn.execute(TASK_METRICS_DDL)
+            sqlite_loader.ensure_index(conn, 'task_metrics', 'ix_task_metrics_run_task', ['run_id', 'task_id'])
+            sqlite_loader.bulk_load(conn, 'task_metrics', METRIC_COLUMNS, recorder.rows())
+        finally:
+            conn.close()
+
+
+class PrometheusTextfileExporter:
+    """
+    Файл <каталог>/retention_<task_id>.prom для textfile collector node_exporter
+    """
+
+    GAUGES = [
+        ('seconds', 'retention_span_seconds', "Длительность этапа задачи"),
+        ('rows', 'retention_span_rows', "Строк обработано на этапе"),
+        ('bytes', 'retention_span_bytes', "Байт обработано на этапе"),
+        ('rss_delta_mb', 'retention_span_rss_delta_megabytes', "Изменение RSS за этап"),
+    ]
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def export(self, recorder):
+        os.makedirs(self.directory, exist_ok=True)
+        lines = []
+        for attribute, metric, help_text in self.GAUGES:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for span in recorder.spans:
+                value = getattr(span, attribute)
+                if value is not None:
+                    lines.append(f'{metric}{{task="{recorder.task_id}",span="{span.name}"}} {value}')
+
+        path = os.path.join(self.directory, f"retention_{recorder.task_id}.prom")
+        # Атомарная замена, чтобы collector не прочитал недописанный файл
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+class StatsDExporter:
+    """
+    Отправка метрик по UDP: длительность - таймер, строки и байты - gauge
+    """
+
+    def __init__(self, host, port=8125, prefix='retention'):
+        self.address = (host, port)
+        self.prefix = prefix
+
+    def export(self, recorder):
+        packets = []
+        for span in recorder.spans:
+            name = f"{self.prefix}.{recorder.task_id}.{span.name}"
+            packets.append(f"{name}.duration:{span.seconds * 1000:.3f}|ms")
+            if span.rows is not None:
+                packets.append(f"{name}.rows:{span.rows}|g")
+            if span.bytes is not None:
+                packets.append(f"{name}.bytes:{span.bytes}|g")
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for packet in packets:
+                sock.sendto(packet.encode('ascii'), self.address)
+
+
+def get_exporter(url):
+    """
+    Экспортер метрик по URL
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'sqlite':
+        return SQLiteMetricsExporter(url.split(':///', 1)[1])
+    if parsed.scheme == 'prometheus':
+        return PrometheusTextfileExporter(url.split(':///', 1)[1])
+    if parsed.scheme == 'statsd':
+        return StatsDExporter(parsed.hostname or 'localhost', parsed.port or 8125)
+    raise ValueError(f"Неизвестный экспортер метрик: {url}")
@@ -0,0 +1,420 @@
+"""
+Асинхронная пакетная отправка писем и таблица исходящих (outbox).
+
+airflow.utils.email.send_email открывает SMTP-соединение на каждое письмо
+и отправляет письма по одному. Здесь письма отправляет smtplib, а asyncio
+распределяет их между несколькими соединениями:
+- одно соединение smtplib (EHLO, STARTTLS, AUTH) переиспользуется для
+  нескольких писем, до SMTP_CONNECTIONS соединений работают параллельно;
+  блокирующие вызовы smtplib выполняются в пуле потоков (run_in_executor);
+- письмо нескольким получателям - одна транзакция MAIL FROM с несколькими
+  RCPT TO;
+- временные ошибки (4xx, обрыв соединения, тайм-аут) повторяются до
+  SMTP_RETRIES раз с экспоненциальной задержкой и случайным разбросом,
+  постоянные (5xx) не повторяются. Заголовок Message-ID задается один раз
+  на письмо, поэтому повтор не выглядит для получателя новым письмом.
+
+В режиме outbox задача DAG только записывает письмо в таблицу
+notification_outbox (enqueue) и сразу завершается, а deliver_outbox
+отправляет накопившиеся письма пакетом. Message-ID письма хранится в строке
+outbox и не меняется между попытками. Письмо, не отправленное из-за
+временной ошибки, остается в статусе pending до next_attempt_at и после
+OUTBOX_MAX_ATTEMPTS попыток помечается failed. Доставка - не реже одного
+раза: письмо, отправленное перед сбоем записи статуса, будет отправлено
+повторно. Письма с одинаковым message_id не дублируются: повторная запись
+уже отправленного письма ничего не меняет.
+
+Письмо - словарь с ключами message_id, sender, recipients, subject,
+html_content и files (пути вложений, читаются при отправке), а также
+необязательным smtp_message_id (заголовок Message-ID).
+"""
+
+import asyncio
+import json
+import os
+import random
+import smtplib
+import ssl
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.policy import SMTP
+from email.utils import formatdate, make_msgid
+
+# Параллельных SMTP-соединений на один запуск отправки
+SMTP_CONNECTIONS = 2
+
+# Повторы временной ошибки в пределах одного запуска и базовая задержка (с)
+SMTP_RETRIES = 3
+SMTP_RETRY_DELAY = 1.0
+SMTP_RETRY_MAX_DELAY = 30.0
+
+# Повторы через outbox: попыток (запусков отправки) до статуса failed и задержки (с)
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 60
+OUTBOX_RETRY_MAX_DELAY = 3600
+
+# Писем за один запуск deliver_outbox
+OUTBOX_BATCH = 100
+
+OUTBOX_STATUSES = ('pending', 'sent', 'failed')
+
+OUTBOX_COLUMNS = [
+    ('message_id', 'TEXT'),
+    ('created_at', 'TEXT'),
+    ('smtp_message_id', 'TEXT'),
+    ('sender', 'TEXT'),
+    ('recipients', 'TEXT'),
+    ('subject', 'TEXT'),
+    ('html_content', 'TEXT'),
+    ('files', 'TEXT'),
+    ('status', 'TEXT'),
+    ('attempts', 'INTEGER'),
+    ('next_attempt_at', 'TEXT'),
+    ('sent_at', 'TEXT'),
+    ('last_error', 'TEXT'),
+]
+
+_OUTBOX_VALUES = """
+    created_at TEXT NOT NULL,
+    smtp_message_id TEXT NOT NULL,
+    sender TEXT,
+    recipients TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    html_content TEXT NOT NULL,
+    files TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt_at TEXT NOT NULL,
+    sent_at TEXT,
+    last_error TEXT
+"""
+
+# Время хранится текстом ISO 8601 в UTC: сравнивается одинаково во всех диалектах
+OUTBOX_DDL = {
+    'sqlite': [
+        f"""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            message_id TEXT NOT NULL,
+            {_OUTBOX_VALUES}
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_notification_outbox_message "
+        "ON notification_outbox (message_id)",
+        # Выборка писем к отправке без просмотра отправленных
+        "CREATE INDEX IF NOT EXISTS ix_notification_outbox_pending "
+        "ON notification_outbox (status, next_attempt_at)",
+    ],
+    'duckdb': [
+        f"""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            message_id VARCHAR NOT NULL,
+            {_OUTBOX_VALUES.replace('TEXT', 'VARCHAR')},
+            PRIMARY KEY (message_id)
+        )
+        """,
+    ],
+    'postgresql': [
+        f"""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            message_id TEXT NOT NULL,
+            {_OUTBOX_VALUES}
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_notification_outbox_message "
+        "ON notification_outbox (message_id)",
+        "CREATE INDEX IF NOT EXISTS ix_notification_outbox_pending "
+        "ON notification_outbox (status, next_attempt_at)",
+    ],
+}
+
+
+class SmtpSettings:
+    """
+    Параметры SMTP-сервера (как секция [smtp] конфигурации Airflow);
+    context - SSL-контекст для SSL и STARTTLS, по умолчанию системный
+    """
+
+    def __init__(self, host='localhost', port=25, starttls=False, ssl=False, user=None, password=None,
+                 sender=None, timeout=30, context=None):
+        self.host = host
+        self.port = int(port)
+        self.starttls = starttls
+        self.ssl = ssl
+        self.user = user or None
+        self.password = password or None
+        self.sender = sender
+        self.timeout = timeout
+        self.context = context
+
+
+class SmtpError(Exception):
+    """
+    Ответ SMTP-сервера с неожиданным кодом
+    """
+
+    def __init__(self, code, text):
+        super().__init__(f"{code} {text}")
+        self.code = code
+        self.text = text
+
+    @property
+    def transient(self):
+        return 400 <= self.code < 500
+
+
+# Ошибки соединения: письмо повторяется на новом соединении
+# (smtplib.SMTPServerDisconnected и тайм-аут сокета - подклассы OSError)
+CONNECTION_ERRORS = (OSError,)
+
+
+def _text(value):
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+
+
+class SmtpClient:
+    """
+    Соединение smtplib для отправки нескольких писем подряд; соединение
+    открывается при первом письме. Методы блокирующие и вызываются в потоке пула
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.smtp = None
+
+    def _connect(self):
+        settings = self.settings
+        context = settings.context or ssl.create_default_context()
+        if settings.ssl:
+            smtp = smtplib.SMTP_SSL(settings.host, settings.port, timeout=settings.timeout, context=context)
+        else:
+            smtp = smtplib.SMTP(settings.host, settings.port, timeout=settings.timeout)
+        try:
+            smtp.ehlo_or_helo_if_needed()
+            if settings.starttls:
+                smtp.starttls(context=context)
+                smtp.ehlo()
+            if settings.user:
+                smtp.login(settings.user, settings.password or '')
+        except smtplib.SMTPResponseException as error:
+            smtp.close()
+            raise SmtpError(error.smtp_code, _text(error.smtp_error))
+        except smtplib.SMTPNotSupportedError as error:
+            # Сервер не объявил STARTTLS или AUTH: повтор не поможет
+            smtp.close()
+            raise SmtpError(504, str(error))
+        except BaseException:
+            smtp.close()
+            raise
+        return smtp
+
+    def send(self, sender, recipients, data):
+        """
+        Одна транзакция письма data (байты с CRLF) всем recipients;
+        список отклоненных получателей [(адрес, код, текст)]
+        """
+        if self.smtp is None:
+            self.smtp = self._connect()
+        # После отказа в транзакции smtplib сам сбрасывает ее (RSET), соединение остается годным
+        try:
+            refused = self.smtp.sendmail(sender, list(recipients), data)
+        except smtplib.SMTPRecipientsRefused as error:
+            code, text = next(iter(error.recipients.values()))
+            raise SmtpError(code, _text(text))
+        except smtplib.SMTPResponseException as error:
+            raise SmtpError(error.smtp_code, _text(error.smtp_error))
+        return [(address, code, _text(text)) for address, (code, text) in refused.items()]
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except CONNECTION_ERRORS:
+            pass
+        finally:
+            self.smtp.close()
+            self.smtp = None
+
+
+def backoff_delay(attempt, base, cap):
+    """
+    Задержка перед повтором attempt (с нуля): base * 2**attempt, не больше cap,
+    со случайным разбросом в пределах половины, чтобы повторы не совпадали
+    """
+    delay = min(cap, base * 2 ** attempt)
+    return delay * (0.5 + random.random() / 2)
+
+
+def build_message(message, sender):
+    """
+    Письмо в байтах (CRLF) с HTML-текстом и вложениями из message['files']
+    """
+    mail = EmailMessage()
+    mail['Subject'] = message['subject']
+    mail['From'] = sender
+    mail['To'] = ', '.join(message['recipients'])
+    mail['Date'] = formatdate(localtime=True)
+    mail['Message-ID'] = message.get('smtp_message_id') or make_msgid()
+    mail.set_content(message['html_content'], subtype='html')
+    for path in message.get('files') or []:
+        with open(path, 'rb') as f:
+            mail.add_attachment(
+                f.read(), maintype='application', subtype='octet-stream', filename=os.path.basename(path),
+            )
+    return mail.as_bytes(policy=SMTP)
+
+
+async def _deliver(messages, settings, connections, retries):
+    queue = asyncio.Queue()
+    for message in messages:
+        queue.put_nowait(message)
+    results = {}
+    workers = max(1, min(connections, len(messages)))
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='smtp') as executor:
+
+        async def worker():
+            client = SmtpClient(settings)
+            try:
+                while not queue.empty():
+                    message = queue.get_nowait()
+                    sender = message.get('sender') or settings.sender
+                    # Письмо собирается один раз: повторы отправляют те же байты с тем же Message-ID
+                    try:
+                        data = build_message(message, sender)
+                    except OSError as error:
+                        results[message['message_id']] = _result('failed', 0, f"Вложение не прочитано: {error}")
+                        continue
+
+                    for attempt in range(retries + 1):
+                        try:
+                            refused = await loop.run_in_executor(
+                                executor, client.send, sender, message['recipients'], data,
+                            )
+                            error = '; '.join(f"{address}: {code} {text}" for address, code, text in refused) or None
+                            results[message['message_id']] = _result('sent', attempt + 1, error)
+                            break
+                        except SmtpError as error:
+                            results[message['message_id']] = _result(
+                                'deferred' if error.transient else 'failed', attempt + 1, str(error),
+                            )
+                            if not error.transient:
+                                break
+                        except CONNECTION_ERRORS as error:
+                            results[message['message_id']] = _result('deferred', attempt + 1, repr(error))
+                            await loop.run_in_executor(executor, client.close)
+                        if attempt < retries:
+                            await asyncio.sleep(backoff_delay(attempt, SMTP_RETRY_DELAY, SMTP_RETRY_MAX_DELAY))
+            finally:
+                await loop.run_in_executor(executor, client.close)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    return results
+
+
+def _result(status, attempts, error=None):
+    return {'status': status, 'attempts': attempts, 'error': error}
+
+
+def dispatch(messages, settings, connections=SMTP_CONNECTIONS, retries=SMTP_RETRIES):
+    """
+    Отправка писем через переиспользуемые соединения; {message_id: результат}
+    со статусом sent, failed (постоянная ошибка) или deferred (временная
+    ошибка после всех повторов), числом попыток и текстом ошибки
+    """
+    if not messages:
+        return {}
+    return asyncio.run(_deliver(messages, settings, connections, retries))
+
+
+def _now():
+    return datetime.utcnow().replace(microsecond=0)
+
+
+def enqueue(backend, messages):
+    """
+    Запись писем в notification_outbox со статусом pending; уже отправленные
+    письма с тем же message_id не меняются. Message-ID письма создается
+    при первой записи и сохраняется при повторных
+    """
+    names = [name for name, _ in OUTBOX_COLUMNS]
+    updates = [name for name in names if name not in ('message_id', 'created_at', 'smtp_message_id')]
+    query = (
+        f"INSERT INTO notification_outbox ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)}) "
+        f"ON CONFLICT (message_id) DO UPDATE SET "
+        + ', '.join(f"{name} = excluded.{name}" for name in updates)
+        + " WHERE notification_outbox.status <> 'sent'"
+    )
+    now = _now().isoformat()
+    for message in messages:
+        backend.execute(query, (
+            message['message_id'], now, message.get('smtp_message_id') or make_msgid(),
+            message.get('sender'), json.dumps(list(message['recipients'])),
+            message['subject'], message['html_content'], json.dumps(list(message.get('files') or [])),
+            'pending', 0, now, None, None,
+        ))
+
+
+def pending_messages(backend, now=None, limit=OUTBOX_BATCH):
+    """
+    Письма outbox, готовые к отправке (индекс по status, next_attempt_at)
+    """
+    now = (now or _now()).isoformat()
+    messages = []
+    for row in backend.iter_rows(
+        "SELECT message_id, smtp_message_id, sender, recipients, subject, html_content, files, attempts "
+        "FROM notification_outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+        "ORDER BY next_attempt_at, message_id LIMIT ?",
+        (now, limit),
+    ):
+        message_id, smtp_message_id, sender, recipients, subject, html_content, files, attempts = row
+        messages.append({
+            'message_id': message_id, 'smtp_message_id': smtp_message_id,
+            'sender': sender, 'recipients': json.loads(recipients),
+            'subject': subject, 'html_content': html_content, 'files': json.loads(files),
+            'attempts': attempts,
+        })
+    return messages
+
+
+def pending_files(backend):
+    """
+    Пути вложений писем outbox, еще ожидающих отправки
+    """
+    files = set()
+    for files_json, in backend.iter_rows("SELECT files FROM notification_outbox WHERE status = 'pending'"):
+        files.update(json.loads(files_json))
+    return files
+
+
+def deliver_outbox(backend, settings, limit=OUTBOX_BATCH, max_attempts=OUTBOX_MAX_ATTEMPTS):
+    """
+    Отправка писем outbox одним пакетом и запись результатов; число писем
+    запуска по новым статусам outbox (pending - отложены до следующей попытки)
+    """
+    backend.ensure_schema(OUTBOX_DDL)
+    messages = pending_messages(backend, limit=limit)
+    results = dispatch(messages, settings)
+
+    summary = dict.fromkeys(OUTBOX_STATUSES, 0)
+    now = _now()
+    for message in messages:
+        result = results[message['message_id']]
+        attempts = message['attempts'] + 1
+        status, next_attempt_at, sent_at = 'failed', now, None
+        if result['status'] == 'sent':
+            status, sent_at = 'sent', now.isoformat()
+        elif result['status'] == 'deferred' and attempts < max_attempts:
+            status = 'pending'
+            next_attempt_at = now + timedelta(
+                seconds=backoff_delay(attempts - 1, OUTBOX_RETRY_DELAY, OUTBOX_RETRY_MAX_DELAY)
+            )
+        summary[status] += 1
+        backend.execute(
+            "UPDATE notification_outbox SET status = ?, attempts = ?, next_attempt_at = ?, sent_at = ?, "
+            "last_error = ? WHERE message_id = ?",
+            (status, attempts, next_attempt_at.isoformat(), sent_at, result['error'], message['message_id']),
+        )
+    return summary
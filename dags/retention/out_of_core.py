@@ -0,0 +1,163 @@
+"""
+Трансформация по частям для данных обучения больше памяти воркера (режим out_of_core).
+
+Справочники сотрудников и курсов небольшие и читаются целиком, а строки
+обучения идут частями по chunk_rows строк (ArtifactStore.iter_tables).
+Каждая часть объединяется со справочниками (join_engine.encode_join),
+и в массивы по отделам добавляются аддитивные агрегаты: число записей,
+сумма и число оценок. Итог собирается combine_partials и совпадает
+с department_stats по всем данным.
+
+Число уникальных сотрудников не аддитивно по частям, поэтому пары
+(отдел, сотрудник) собирает DistinctPairs: битовой картой, если она
+помещается в бюджет, иначе буфером уникальных ключей. Переполненный
+буфер сбрасывается на диск в SPILL_PARTITIONS файлов по остатку ключа.
+Одна пара всегда попадает в один и тот же файл, поэтому в конце каждый
+файл дедуплицируется отдельно и счетчики складываются точно.
+
+Бюджет памяти (plan_budget) делится пополам: на объединение одной части
+и на буфер уникальных пар. Справочники в бюджет не входят.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from retention.join_engine import PARTIAL_COLUMNS, combine_partials, encode_join
+
+# Оценка пиковой памяти на строку части при объединении: ключи, коды отделов,
+# кратности, оценки и колонки DataFrame объединения
+JOIN_BYTES_PER_ROW = 96
+MIN_CHUNK_ROWS = 10000
+
+# Буфер уникальных пар: np.unique по объединенному буферу требует примерно
+# втрое больше памяти, чем сами ключи int64
+PAIR_BUFFER_FACTOR = 3 * 8
+
+SPILL_PARTITIONS = 64
+
+
+def plan_budget(memory_bytes):
+    """
+    Размер части обучения (строк) и память под уникальные пары (байт) для бюджета memory_bytes
+    """
+    chunk_rows = max(MIN_CHUNK_ROWS, memory_bytes // 2 // JOIN_BYTES_PER_ROW)
+    return int(chunk_rows), memory_bytes // 2
+
+
+class DistinctPairs:
+    """
+    Точное число уникальных пар (группа, ключ) по группам в пределах
+    budget_bytes байт памяти со сбросом на диск в spill_dir
+    """
+
+    def __init__(self, n_groups, stride, budget_bytes, spill_dir):
+        self.n_groups = n_groups
+        self.stride = stride
+        self.spill_dir = spill_dir
+        self.spills = 0
+        self.buffer = []
+        self.buffered = 0
+        self.max_buffered = max(1, budget_bytes // PAIR_BUFFER_FACTOR)
+        # Битовая карта всех пар, если помещается в бюджет: без сортировки и сброса на диск
+        bound = n_groups * stride
+        self.bitmap = np.zeros(bound, dtype=bool) if bound <= budget_bytes else None
+
+    def add(self, groups, keys):
+        pairs = groups.astype(np.int64) * self.stride + keys
+        if self.bitmap is not None:
+            self.bitmap[pairs] = True
+            return
+        pairs = np.unique(pairs)
+        self.buffer.append(pairs)
+        self.buffered += len(pairs)
+        if self.buffered > self.max_buffered:
+            # Сначала повторы между частями удаляются в памяти; если буфер
+            # остается больше половины лимита - сброс на диск
+            self.buffer = [np.unique(np.concatenate(self.buffer))]
+            self.buffered = len(self.buffer[0])
+            if self.buffered > self.max_buffered // 2:
+                self._spill()
+
+    def _spill_path(self, partition):
+        return os.path.join(self.spill_dir, f"pairs_{partition:03d}.bin")
+
+    def _spill(self):
+        pairs = np.concatenate(self.buffer) if self.buffer else np.empty(0, dtype=np.int64)
+        partitions = pairs % SPILL_PARTITIONS
+        for partition in range(SPILL_PARTITIONS):
+            with open(self._spill_path(partition), 'ab') as f:
+                pairs[partitions == partition].astype(np.int64).tofile(f)
+        self.buffer, self.buffered = [], 0
+        self.spills += 1
+
+    def counts(self):
+        """
+        Число уникальных ключей по группам
+        """
+        if self.bitmap is not None:
+            return np.bincount(np.flatnonzero(self.bitmap) // self.stride, minlength=self.n_groups)
+        if not self.spills:
+            pairs = np.unique(np.concatenate(self.buffer)) if self.buffer else np.empty(0, dtype=np.int64)
+            return np.bincount(pairs // self.stride, minlength=self.n_groups)
+
+        self._spill()
+        counts = np.zeros(self.n_groups, dtype=np.int64)
+        for partition in range(SPILL_PARTITIONS):
+            pairs = np.unique(np.fromfile(self._spill_path(partition), dtype=np.int64))
+            counts += np.bincount(pairs // self.stride, minlength=self.n_groups)
+        return counts
+
+
+def chunked_department_stats(employees_df, courses_df, training_chunks, memory_bytes, spill_root=None):
+    """
+    Статистика по отделам (как department_stats) по частям обучения
+    training_chunks (DataFrame) с буфером уникальных пар в пределах
+    memory_bytes; возвращает (dept_stats, сведения о выполнении)
+    """
+    departments = pd.Index(pd.unique(employees_df['department'].dropna().astype(object))).sort_values()
+    n_departments = len(departments)
+    employee_ids = pd.to_numeric(employees_df['employee_id'], errors='coerce')
+    stride = int(employee_ids.max()) + 1 if employee_ids.notna().any() else 1
+
+    record_count = np.zeros(n_departments)
+    score_sum = np.zeros(n_departments)
+    score_count = np.zeros(n_departments)
+    info = {'chunks': 0, 'rows': 0, 'spills': 0}
+
+    if spill_root is not None:
+        os.makedirs(spill_root, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix='retention_spill_', dir=spill_root) as spill_dir:
+        distinct = DistinctPairs(n_departments, stride, plan_budget(memory_bytes)[1], spill_dir)
+        for chunk in training_chunks:
+            joined = encode_join(employees_df, courses_df, chunk)
+            # Коды отделов части - в общий порядок отделов справочника
+            mapping = departments.get_indexer(joined['department'].cat.categories.astype(object))
+            codes = mapping[joined['department'].cat.codes.to_numpy()].astype(np.int64)
+            weight = joined['multiplicity'].to_numpy(dtype='float64')
+            score = joined['score'].to_numpy(dtype='float64')
+            scored = ~np.isnan(score)
+
+            record_count += np.bincount(codes, weights=weight, minlength=n_departments)
+            score_sum += np.bincount(codes[scored], weights=score[scored] * weight[scored], minlength=n_departments)
+            score_count += np.bincount(codes[scored], weights=weight[scored], minlength=n_departments)
+            distinct.add(codes, joined['employee_id'].to_numpy(dtype=np.int64))
+
+            info['chunks'] += 1
+            info['rows'] += len(chunk)
+
+        total_employees = distinct.counts()
+        info['spills'] = distinct.spills
+        info['bitmap'] = distinct.bitmap is not None
+
+    present = record_count > 0
+    partial = pd.DataFrame({
+        'department': departments.to_numpy(dtype=object)[present],
+        'score_sum': score_sum[present],
+        'score_count': score_count[present].astype(np.int64),
+        'record_count': record_count[present].astype(np.int64),
+        'total_employees': total_employees[present].astype(np.int64),
+    })
+    return combine_partials([partial[PARTIAL_COLUMNS]]), info
@@ -0,0 +1,40 @@
+"""
+Разбиение трансформации на разделы для динамического маппинга задач.
+
+Строки обучения делятся по хэшу employee_id, либо справочник сотрудников
+делится по хэшу отдела. В обоих случаях пара (отдел, сотрудник) попадает
+ровно в один раздел, поэтому частичные агрегаты разделов
+(join_engine.department_partials) складываются в точный результат,
+включая число уникальных сотрудников.
+"""
+
+import math
+
+import pandas as pd
+
+PARTITION_BY = ('employee', 'department')
+
+
+def _bucket(values, partitions):
+    # Детерминированный хэш pandas одинаков во всех процессах, в отличие от hash()
+    return pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy() % partitions
+
+
+def partition_count(rows, max_partitions, min_partition_rows):
+    """
+    Число разделов: не больше max_partitions и не меньше min_partition_rows строк на раздел
+    """
+    return max(1, min(max_partitions, math.ceil(rows / min_partition_rows)))
+
+
+def select_partition(employees_df, training_df, partition, partitions, partition_by='employee'):
+    """
+    Сотрудники и строки обучения раздела partition из partitions
+    """
+    if partition_by not in PARTITION_BY:
+        raise ValueError(f"Неизвестный способ разбиения: {partition_by}. Доступны: {', '.join(PARTITION_BY)}")
+    if partition_by == 'employee':
+        mask = _bucket(training_df['employee_id'], partitions) == partition
+        return employees_df, training_df[mask]
+    mask = _bucket(employees_df['department'], partitions) == partition
+    return employees_df[mask], training_df
@@ -0,0 +1,124 @@
+"""
+Расчет статистики по отделам внутри DuckDB (pushdown).
+
+Staging-артефакты источников подключаются к DuckDB как таблицы, без
+чтения строк в pandas: Parquet сканируется через read_parquet, Arrow IPC
+открывается через memory map и регистрируется как Arrow-таблица.
+Объединение и агрегация выполняются одним SQL-запросом.
+
+Если хранилище результатов само DuckDB, результат записывается в
+retention_analysis запросом на том же соединении; для остальных бэкендов
+в Python передаются только итоговые строки по отделам.
+
+Семантика совпадает с merge_department_stats: inner-объединения
+с сотрудниками и курсами (с кратностью строк), сотрудники без отдела
+отбрасываются, средний балл округляется до 2 знаков с округлением
+половины к четному, как Series.round.
+"""
+
+from retention.artifacts import check_manifest, store_for_manifest
+
+SOURCES = ('employees', 'training', 'courses')
+
+DEPARTMENT_STATS_SQL = """
+    SELECT
+        e.department AS department,
+        COUNT(DISTINCT e.employee_id) AS total_employees,
+        COUNT(c.course_id) AS total_courses,
+        round_even(AVG(t.score), 2) AS avg_score
+    FROM employees AS e
+    JOIN training AS t ON t.employee_id = e.employee_id
+    JOIN courses AS c ON c.course_id = t.course_id
+    WHERE e.department IS NOT NULL
+    GROUP BY e.department
+"""
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def attach_sources(conn, manifests, base_dir):
+    """
+    Подключение артефактов employees/training/courses к соединению DuckDB.
+    Возвращает имена зарегистрированных Arrow-таблиц для detach_sources.
+    """
+    registered = []
+    for name in SOURCES:
+        manifest = manifests[name]
+        if manifest['format'] == 'parquet':
+            check_manifest(manifest)
+            conn.execute(
+                f"CREATE OR REPLACE TEMP VIEW {name} AS "
+                f"SELECT * FROM read_parquet({_quote(manifest['path'])})"
+            )
+        else:
+            table = store_for_manifest(manifest, base_dir).read_table(manifest)
+            conn.register(name, table)
+            registered.append(name)
+    return registered
+
+
+def detach_sources(conn, registered):
+    for name in SOURCES:
+        if name in registered:
+            conn.unregister(name)
+        else:
+            conn.execute(f"DROP VIEW IF EXISTS {name}")
+
+
+def department_stats(manifests, base_dir):
+    """
+    Статистика по отделам, посчитанная в DuckDB; DataFrame отсортирован по отделу
+    """
+    import duckdb
+
+    conn = duckdb.connect()
+    try:
+        attach_sources(conn, manifests, base_dir)
+        return conn.execute(DEPARTMENT_STATS_SQL + " ORDER BY department").df()
+    finally:
+        conn.close()
+
+
+def load_department_stats(backend, manifests, base_dir, table, columns, key_columns, partition):
+    """
+    Расчет и идемпотентная загрузка раздела таблицы результатов.
+
+    columns - колонки таблицы в порядке загрузки, partition - {колонка: значение}
+    раздела (значения подставляются в каждую строку). Возвращает статистику
+    по отделам и контрольную сумму загрузки.
+    """
+    names = [name for name, _ in columns]
+
+    if backend.dialect != 'duckdb':
+        dept_stats = department_stats(manifests, base_dir)
+        rows = (
+            tuple(partition[name] if name in partition else record[name] for name in names)
+            for record in dept_stats.to_dict('records')
+        )
+        checksum = backend.upsert_partition(table, columns, key_columns, rows, partition)
+        return dept_stats, checksum
+
+    # Хранилище - DuckDB: запись в таблицу результатов без выхода строк из движка
+    select_sql = (
+        f"SELECT {', '.join('?' if name in partition else name for name in names)} "
+        f"FROM ({DEPARTMENT_STATS_SQL}) AS stats"
+    )
+    params = [partition[name] for name in names if name in partition]
+    with backend.connection() as conn:
+        registered = attach_sources(conn, manifests, base_dir)
+        try:
+            checksum = backend.upsert_partition_query(
+                conn, table, columns, key_columns, select_sql, params, partition
+            )
+        finally:
+            detach_sources(conn, registered)
+        # Загруженный раздел (несколько строк) читается обратно для отчета и XCom
+        stats_columns = [name for name in names if name not in partition]
+        dept_stats = conn.execute(
+            f"SELECT {', '.join(stats_columns)} FROM {table} "
+            f"WHERE {' AND '.join(f'{name} = ?' for name in partition)} ORDER BY department",
+            list(partition.values()),
+        ).df()
+    return dept_stats, checksum
@@ -0,0 +1,397 @@
+"""
+Потоковая генерация отчетов по шаблонам.
+
+Шаблоны Jinja2 компилируются один раз при загрузке модуля. Строки данных
+проходят через отчет один раз и сразу пишутся в открытые файлы: текст,
+HTML и CSV. Отчет не собирается в памяти, поэтому потребление памяти
+не зависит от числа строк; для итогов хранятся только суммы, первая
+и последняя строки. Строки обрабатываются пакетами: шаблон строки
+выводится циклом по пакету через Template.generate(), и каждый файл
+получает одну запись на пакет. Поля строки - атрибуты row:
+{{ row.department }}; фильтр fmt форматирует значение по спецификации
+format() - {{ row.avg_score|fmt('.2f') }}, фильтр e экранирует для HTML.
+
+Гранулярности отчета (REPORTS):
+- department - по отделам, из таблицы retention_analysis хранилища;
+- course - по курсам, department_course - по отделам и курсам: из ячеек
+  куба retention_cube (params cube), иначе из артефактов staging
+  (join_engine.course_stats, cube.rollup_cube);
+- employee - по сотрудникам, из проверенных артефактов staging
+  (join_engine.employee_stats).
+"""
+
+import csv
+import os
+from collections import namedtuple
+from itertools import islice
+from operator import attrgetter
+from types import SimpleNamespace
+
+from jinja2 import Environment, StrictUndefined
+
+from retention.attachments import format_size
+
+ROWS_BATCH_SIZE = 10000
+
+# Окружение шаблонов: текстовый отчет не экранируется, HTML экранирует фильтр e;
+# неизвестное поле шаблона - ошибка, а не пустая строка
+TEMPLATES = Environment(autoescape=False, keep_trailing_newline=True, undefined=StrictUndefined)
+TEMPLATES.filters['fmt'] = format
+
+
+def compile_template(text):
+    """
+    Скомпилированный шаблон Jinja2 из текста
+    """
+    return TEMPLATES.from_string(text)
+
+
+class ReportLayout:
+    """
+    Скомпилированные шаблоны начала, строк и конца отчета одного формата
+    """
+
+    def __init__(self, header='', row='', footer='', empty_footer=None):
+        self.header = compile_template(header)
+        # Шаблон строки оборачивается циклом: один вызов шаблона на пакет строк
+        self.rows = compile_template('{% for row in rows %}' + row + '{% endfor %}')
+        self.footer = compile_template(footer)
+        self.empty_footer = compile_template(empty_footer) if empty_footer is not None else self.footer
+
+
+class TemplateWriter:
+    """
+    Запись отчета по шаблонам в открытый текстовый файл
+    """
+
+    def __init__(self, handle, layout):
+        self.handle = handle
+        self.layout = layout
+
+    def begin(self, info):
+        self.handle.writelines(self.layout.header.generate(vars(info)))
+
+    def rows(self, rows):
+        self.handle.write(''.join(self.layout.rows.generate(rows=rows)))
+
+    def end(self, summary):
+        footer = self.layout.footer if summary.rows else self.layout.empty_footer
+        self.handle.writelines(footer.generate(vars(summary)))
+
+
+class CsvWriter:
+    """
+    Запись строк отчета в CSV через csv.writer
+    """
+
+    def __init__(self, handle, columns):
+        self.writer = csv.writer(handle)
+        self.columns = columns
+
+    def begin(self, info):
+        self.writer.writerow(self.columns)
+
+    def rows(self, rows):
+        self.writer.writerows(rows)
+
+    def end(self, summary):
+        pass
+
+
+class ReportSummary:
+    """
+    Итоги отчета, собираемые за один проход: число строк, суммы колонок totals,
+    первая и последняя строки и первые keep строк
+    """
+
+    def __init__(self, totals=(), keep=0):
+        self.rows = 0
+        self.totals = dict.fromkeys(totals, 0)
+        self.first = None
+        self.last = None
+        self.keep = keep
+        self.kept = []
+
+    def add(self, rows):
+        if not rows:
+            return
+        if self.first is None:
+            self.first = rows[0]
+        self.last = rows[-1]
+        self.rows += len(rows)
+        if len(self.kept) < self.keep:
+            self.kept.extend(rows[:self.keep - len(self.kept)])
+        for name in self.totals:
+            self.totals[name] += sum(map(attrgetter(name), rows))
+
+    def namespace(self, **info):
+        return SimpleNamespace(
+            rows=self.rows, first=self.first, last=self.last,
+            totals=SimpleNamespace(**self.totals), **info
+        )
+
+
+class ReportSpec:
+    """
+    Гранулярность отчета: колонки, шаблоны текстового отчета и имена файлов.
+    HTML-таблица строится по колонкам: (имя, формат или None для текста)
+    """
+
+    def __init__(self, name, file_stem, columns, totals, text_header, text_row, text_footer,
+                 text_empty_footer=None):
+        self.name = name
+        self.file_stem = file_stem
+        self.columns = [column for column, _ in columns]
+        self.row_type = namedtuple(f"{name.title()}Row", self.columns)
+        self.totals = totals
+        self.text = ReportLayout(text_header, text_row, text_footer, text_empty_footer)
+        self.html_header = (
+            '<table border="1" style="border-collapse: collapse; width: 100%;">\n'
+            '<tr style="background-color: #f2f2f2;">'
+            + ''.join(f"<th>{column}</th>" for column in self.columns)
+            + '</tr>\n'
+        )
+        self.html_row = '<tr>' + ''.join(
+            f"<td>{{{{ row.{column}|e }}}}</td>" if spec is None
+            else f"<td>{{{{ row.{column}|fmt('{spec}') }}}}</td>"
+            for column, spec in columns
+        ) + '</tr>\n'
+        self.html = self.html_layout()
+
+    def html_layout(self, before='', after=''):
+        """
+        HTML-таблица отчета, окруженная шаблонами before и after (например, письма)
+        """
+        return ReportLayout(before + self.html_header, self.html_row, '</table>\n' + after)
+
+    def rows_from_tuples(self, rows):
+        make = self.row_type._make
+        return (make(row) for row in rows)
+
+    def rows_from_records(self, records):
+        return (self.row_type(**{column: record[column] for column in self.columns}) for record in records)
+
+    def rows_from_frame(self, df, batch_size=ROWS_BATCH_SIZE):
+        """
+        Строки DataFrame пакетами: в кортежи превращается только текущий пакет
+        """
+        make = self.row_type._make
+        for start in range(0, len(df), batch_size):
+            chunk = df.iloc[start:start + batch_size]
+            yield from map(make, zip(*(chunk[column].tolist() for column in self.columns)))
+
+    def paths(self, directory):
+        """
+        Пути текстового, HTML и CSV файлов отчета
+        """
+        return {
+            'text': os.path.join(directory, f"{self.file_stem}_report.txt"),
+            'html': os.path.join(directory, f"{self.file_stem}_report.html"),
+            'csv': os.path.join(directory, f"{self.file_stem}_data.csv"),
+        }
+
+
+def render_report(rows, writers, totals=(), keep=0, **info):
+    """
+    Один проход по строкам пакетами по ROWS_BATCH_SIZE с записью во все writers;
+    возвращает ReportSummary. info - значения для шаблонов начала и конца отчета
+    """
+    summary = ReportSummary(totals, keep)
+    header = SimpleNamespace(**info)
+    for writer in writers:
+        writer.begin(header)
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, ROWS_BATCH_SIZE))
+        if not batch:
+            break
+        summary.add(batch)
+        for writer in writers:
+            writer.rows(batch)
+    footer = summary.namespace(**info)
+    for writer in writers:
+        writer.end(footer)
+    return summary
+
+
+def render_files(spec, rows, paths, keep=0, **info):
+    """
+    Отчет гранулярности spec в текстовый, HTML и CSV файлы за один проход по строкам
+    """
+    with open(paths['text'], 'w', encoding='utf-8') as text_file, \
+            open(paths['html'], 'w', encoding='utf-8') as html_file, \
+            open(paths['csv'], 'w', encoding='utf-8', newline='') as csv_file:
+        writers = [
+            TemplateWriter(text_file, spec.text),
+            TemplateWriter(html_file, spec.html),
+            CsvWriter(csv_file, spec.columns),
+        ]
+        return render_report(rows, writers, spec.totals, keep, **info)
+
+
+DEPARTMENT_REPORT = ReportSpec(
+    'department', 'retention_analysis',
+    [('department', None), ('total_employees', ','), ('total_courses', ','), ('avg_score', '.2f')],
+    totals=('total_employees', 'total_courses'),
+    text_header="""ОТЧЕТ ПО АНАЛИЗУ КОЭФФИЦИЕНТА УДЕРЖАНИЯ МОБИЛЬНЫХ ПРИЛОЖЕНИЙ
+================================================================
+
+Дата анализа: {{ generated_at }}
+Общее количество категорий: {{ row_count }}
+
+РЕЗУЛЬТАТЫ ПО КАТЕГОРИЯМ:
+""",
+    text_row="""
+department: {{ row.department }}
+
+- общее количество сотрудников : {{ row.total_employees|fmt(',') }}
+- Общее количество курсов: {{ row.total_courses|fmt(',') }}
+- средний бал: {{ row.avg_score|fmt('.2f') }}
+""",
+    text_footer="""
+ОБЩАЯ СТАТИСТИКА:
+- Общее количество установок: {{ totals.total_employees|fmt(',') }}
+- Общее количество удалений: {{ totals.total_courses|fmt(',') }}
+
+
+РЕКОМЕНДАЦИИ:
+- Лучший показатель удержания у категории "{{ first.department }}" ({{ first.avg_score|fmt('.2f') }})
+- Требует внимания категория "{{ last.department }}" ({{ last.avg_score|fmt('.2f') }})
+- Рекомендуется изучить успешные практики категории "{{ first.department }}"
+""",
+    text_empty_footer="""
+Нет результатов анализа за эту дату.
+""",
+)
+
+COURSE_REPORT = ReportSpec(
+    'course', 'retention_analysis_course',
+    [('course_id', 'd'), ('course_name', None), ('total_employees', ','), ('total_records', ','),
+     ('avg_score', '.2f')],
+    totals=('total_records',),
+    text_header="""ОТЧЕТ ПО КУРСАМ
+================================================================
+
+Дата анализа: {{ generated_at }}
+Количество курсов: {{ row_count|fmt(',') }}
+
+course_id | course_name | сотрудников | записей | средний балл
+""",
+    text_row="{{ row.course_id }} | {{ row.course_name }} | {{ row.total_employees|fmt(',') }} | {{ row.total_records|fmt(',') }} | {{ row.avg_score|fmt('.2f') }}\n",
+    text_footer="""
+Всего записей об обучении: {{ totals.total_records|fmt(',') }}
+Лучший средний балл: "{{ first.course_name }}" ({{ first.avg_score|fmt('.2f') }})
+""",
+    text_empty_footer="\nНет данных об обучении.\n",
+)
+
+DEPARTMENT_COURSE_REPORT = ReportSpec(
+    'department_course', 'retention_analysis_department_course',
+    [('department', None), ('course_id', 'd'), ('course_name', None), ('total_employees', ','),
+     ('total_records', ','), ('avg_score', '.2f')],
+    totals=('total_records',),
+    text_header="""ОТЧЕТ ПО ОТДЕЛАМ И КУРСАМ
+================================================================
+
+Дата анализа: {{ generated_at }}
+Количество пар отдел-курс: {{ row_count|fmt(',') }}
+
+department | course_id | course_name | сотрудников | записей | средний балл
+""",
+    text_row="{{ row.department }} | {{ row.course_id }} | {{ row.course_name }} | {{ row.total_employees|fmt(',') }} | {{ row.total_records|fmt(',') }} | {{ row.avg_score|fmt('.2f') }}\n",
+    text_footer="""
+Всего записей об обучении: {{ totals.total_records|fmt(',') }}
+Лучший средний балл: "{{ first.department }}" / "{{ first.course_name }}" ({{ first.avg_score|fmt('.2f') }})
+""",
+    text_empty_footer="\nНет данных об обучении.\n",
+)
+
+EMPLOYEE_REPORT = ReportSpec(
+    'employee', 'retention_analysis_employee',
+    [('employee_id', 'd'), ('department', None), ('total_courses', ','), ('avg_score', '.2f')],
+    totals=('total_courses',),
+    text_header="""ОТЧЕТ ПО СОТРУДНИКАМ
+================================================================
+
+Дата анализа: {{ generated_at }}
+Количество сотрудников: {{ row_count|fmt(',') }}
+
+employee_id | department | курсов | средний балл
+""",
+    text_row="{{ row.employee_id }} | {{ row.department }} | {{ row.total_courses|fmt(',') }} | {{ row.avg_score|fmt('.2f') }}\n",
+    text_footer="""
+Всего записей об обучении: {{ totals.total_courses|fmt(',') }}
+""",
+    text_empty_footer="\nНет данных об обучении.\n",
+)
+
+# Письмо с результатами: таблица отчета по отделам между началом и концом письма
+EMAIL_HEADER = """
+<h2> analysis average grade point after training for each </h2>
+
+<h3>📊 Информация о выполнении:</h3>
+<ul>
+    <li><strong>DAG:</strong> average grade point after training for each</li>
+    <li><strong>Дата выполнения:</strong> {{ ds }}</li>
+    <li><strong>Статус:</strong> ✅ Все задачи выполнены без ошибок</li>
+    <li><strong>Результаты:</strong> Сохранены в хранилище {{ warehouse }}</li>
+</ul>
+
+<h3>📈 Краткие результаты анализа:</h3>
+"""
+
+EMAIL_FOOTER = """
+<p>Показаны первые {{ rows|fmt(',') }} из {{ total_rows|fmt(',') }} строк по убыванию среднего балла; полные результаты - в файлах отчета.</p>
+
+<h3>📎 Файлы результатов:</h3>
+<ul>
+{{ attachments }}</ul>
+
+<p><em>Детальный отчет также доступен в логах задачи generate_report в Airflow UI.</em></p>
+
+<hr>
+<p style="color: #666; font-size: 12px;">
+    Это автоматическое уведомление от системы Apache Airflow<br>
+    Время отправки: {{ sent_at }}
+</p>
+"""
+
+EMAIL_LAYOUT = DEPARTMENT_REPORT.html_layout(EMAIL_HEADER, EMAIL_FOOTER)
+
+# Строки списка файлов письма: приложенный архив или ссылка на файл в хранилище
+EMAIL_ATTACHED_ITEM = compile_template(
+    "    <li><strong>{{ name|e }}</strong> ({{ size }}) - во вложении: {{ files|e }}</li>\n"
+)
+EMAIL_LINKED_ITEM = compile_template(
+    "    <li><strong>{{ name|e }}</strong> ({{ size }}) - слишком большой для письма, "
+    "доступен в хранилище: <a href=\"{{ link|e }}\">{{ link|e }}</a></li>\n"
+)
+
+
+def email_attachments(attached, linked):
+    """
+    HTML-список файлов результатов письма по описаниям архивов (retention.attachments)
+    """
+    items = []
+    for template, archives in ((EMAIL_ATTACHED_ITEM, attached), (EMAIL_LINKED_ITEM, linked)):
+        for archive in archives:
+            items.append(template.render(
+                archive, size=format_size(archive['bytes']), files=', '.join(archive['files'])
+            ))
+    return ''.join(items) or "    <li>Файлы отчета не найдены</li>\n"
+
+
+REPORTS = {
+    spec.name: spec
+    for spec in (DEPARTMENT_REPORT, COURSE_REPORT, DEPARTMENT_COURSE_REPORT, EMPLOYEE_REPORT)
+}
+
+
+def get_report(name):
+    """
+    Описание отчета по гранулярности
+    """
+    try:
+        return REPORTS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестная гранулярность отчета: {name}. Доступны: {', '.join(REPORTS)}")
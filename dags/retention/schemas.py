@@ -0,0 +1,202 @@
+"""
+Реестр схем источников: сотрудники, обучение и курсы.
+
+Схема задает компактные типы колонок (int32 для идентификаторов, uint8
+для оценки) и применяется при разборе файлов: строки, значения которых
+не приводятся к типу колонки (пропуск в обязательной колонке, текст
+вместо числа, дробное число, выход за диапазон типа), не попадают
+в артефакт, а возвращаются отдельно с кодом причины вида 'type:score'.
+
+В артефакте отдел хранится строкой (Parquet сам кодирует ее словарем,
+а файл Arrow IPC не допускает разных словарей в пакетах), а при чтении
+в pandas превращается в category - колонки перечислены в categories.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+REJECT_POLICIES = ('quarantine', 'fail')
+
+# Версия правил приведения к схеме (Column.conform); увеличивается при их
+# изменении, чтобы кэш не выдал снимок, разобранный по старым правилам
+SCHEMA_VERSION = 1
+
+# Колонки отклоненных строк помимо исходных значений
+REJECTED_COLUMNS = ['file', 'reason']
+
+
+class Column:
+    """
+    Колонка схемы: тип pyarrow, обязательность и хранение как category в pandas
+    """
+
+    def __init__(self, name, type, nullable=False, categorical=False):
+        self.name = name
+        self.type = type
+        self.nullable = nullable
+        self.categorical = categorical
+
+    def conform(self, values):
+        """
+        Массив pyarrow и коды причин отклонения (None - значение подходит)
+        """
+        reasons = np.full(len(values), None, dtype=object)
+        nulls = values.isna().to_numpy()
+        if not self.nullable:
+            reasons[nulls] = f"null:{self.name}"
+
+        if pa.types.is_integer(self.type):
+            numeric = values if pd.api.types.is_integer_dtype(values) else pd.to_numeric(values, errors='coerce')
+            converted = numeric.notna().to_numpy()
+            bad_type = ~nulls & ~converted
+            if pd.api.types.is_float_dtype(numeric):
+                bad_type |= converted & (np.floor(numeric.to_numpy()) != numeric.to_numpy())
+            info = np.iinfo(self.type.to_pandas_dtype())
+            bad_range = converted & ~bad_type & ((numeric < info.min) | (numeric > info.max)).to_numpy()
+            reasons[bad_type] = f"type:{self.name}"
+            reasons[bad_range] = f"range:{self.name}"
+            return numeric, reasons
+
+        # Строковая колонка: числа из Excel и JSON приводятся к тексту
+        return values.where(nulls, values.astype(str)), reasons
+
+    def to_arrow(self, values):
+        array = pa.array(values, from_pandas=True)
+        return array if array.type == self.type else array.cast(self.type)
+
+
+class SourceSchema:
+    """
+    Схема одного источника
+    """
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns
+        self.names = [column.name for column in columns]
+        self.arrow_schema = pa.schema([
+            pa.field(column.name, column.type, nullable=column.nullable) for column in columns
+        ])
+        self.categories = [column.name for column in columns if column.categorical]
+
+    def describe(self):
+        """
+        Описание схемы для ключа кэша: версия правил и колонки с типами
+        """
+        return {
+            'version': SCHEMA_VERSION,
+            'columns': [
+                [column.name, str(column.type), column.nullable, column.categorical]
+                for column in self.columns
+            ],
+        }
+
+    def conform(self, df, file=None):
+        """
+        Приведение DataFrame к схеме: (pyarrow.Table подходящих строк,
+        DataFrame отклоненных строк с колонками file и reason)
+        """
+        missing = [name for name in self.names if name not in df.columns]
+        if missing:
+            raise ValueError(f"В источнике {self.name} нет колонок: {', '.join(missing)}")
+
+        reasons = np.full(len(df), None, dtype=object)
+        values = {}
+        for column in self.columns:
+            values[column.name], column_reasons = column.conform(df[column.name])
+            # Причиной считается первая колонка, значение которой не подходит
+            first = (reasons == None) & (column_reasons != None)  # noqa: E711
+            reasons[first] = column_reasons[first]
+
+        rejected = reasons != None  # noqa: E711
+        if rejected.any():
+            keep = ~rejected
+            table = pa.Table.from_arrays(
+                [column.to_arrow(values[column.name][keep]) for column in self.columns],
+                schema=self.arrow_schema,
+            )
+            return table, self.rejected_frame(df[rejected], reasons[rejected], file)
+
+        table = pa.Table.from_arrays(
+            [column.to_arrow(values[column.name]) for column in self.columns],
+            schema=self.arrow_schema,
+        )
+        return table, None
+
+    def batch_from_columns(self, columns, file=None):
+        """
+        RecordBatch из списков значений колонок; при неподходящих значениях
+        строки разбираются через conform. Возвращает (пакеты, отклоненные строки)
+        """
+        try:
+            arrays = [pa.array(values, type=column.type) for values, column in zip(columns, self.columns)]
+            if all(column.nullable or array.null_count == 0 for array, column in zip(arrays, self.columns)):
+                return [pa.RecordBatch.from_arrays(arrays, schema=self.arrow_schema)], None
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+            pass
+        df = pd.DataFrame(dict(zip(self.names, columns)), dtype=object)
+        table, rejected = self.conform(df, file)
+        return table.to_batches(), rejected
+
+    def rejected_frame(self, df, reasons, file=None):
+        # Исходные значения сохраняются текстом: их тип как раз и не подошел
+        rejected = pd.DataFrame({
+            name: df[name].where(df[name].isna(), df[name].astype(str)).astype(object)
+            for name in self.names
+        })
+        rejected['file'] = file
+        rejected['reason'] = reasons
+        return rejected.reset_index(drop=True)
+
+    def from_pandas(self, df):
+        """
+        pyarrow.Table по схеме из DataFrame, уже приведенного к ней (например, после фильтрации)
+        """
+        arrays = [column.to_arrow(df[column.name]) for column in self.columns]
+        return pa.Table.from_arrays(arrays, schema=self.arrow_schema)
+
+    def to_pandas(self, table):
+        """
+        DataFrame с компактными типами: category для колонок из categories
+        """
+        return table.to_pandas(categories=self.categories, split_blocks=True, self_destruct=True)
+
+
+SOURCE_SCHEMAS = {
+    'employees': SourceSchema('employees', [
+        Column('employee_id', pa.int32()),
+        Column('department', pa.string(), categorical=True),
+    ]),
+    'training': SourceSchema('training', [
+        Column('employee_id', pa.int32()),
+        Column('course_id', pa.int32()),
+        Column('score', pa.uint8(), nullable=True),
+    ]),
+    'courses': SourceSchema('courses', [
+        Column('course_id', pa.int32()),
+        Column('course_name', pa.string(), nullable=True),
+    ]),
+}
+
+
+def get_schema(name):
+    """
+    Схема источника из реестра по имени
+    """
+    try:
+        return SOURCE_SCHEMAS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный источник: {name}. Доступны: {', '.join(sorted(SOURCE_SCHEMAS))}")
+
+
+def rejected_summary(frames):
+    """
+    Отклоненные строки всех файлов и число строк по кодам причин
+    """
+    frames = [frame for frame in frames if frame is not None and len(frame)]
+    if not frames:
+        return None, {}
+    rejected = pd.concat(frames, ignore_index=True)
+    counts = rejected['reason'].value_counts()
+    return rejected, {reason: int(count) for reason, count in counts.sort_index().items()}
@@ -0,0 +1,182 @@
+"""
+Извлечение источника, состоящего из нескольких файлов-шардов.
+
+Источник задается относительно DATA_DIR одним из способов:
+- имя файла: employees.csv;
+- каталог шардов: employees/ (берутся файлы с расширением формата);
+- glob-шаблон: employees/2024-*/part-*.csv.
+Если файла employees.csv нет, но есть каталог employees/, используется он
+(так раскладывает шарды dags/generate_data.py --shards N).
+
+Шарды разбираются параллельно в пуле процессов (разбор Excel упирается
+в CPU) с ограниченным числом одновременно обрабатываемых файлов и
+сливаются в один колоночный артефакт. При упорядоченном слиянии строки
+идут в порядке отсортированных имен файлов, и контрольная сумма артефакта
+воспроизводима; неупорядоченное слияние записывает шарды по мере готовности.
+
+Каждый шард приводится к схеме источника из реестра (retention.schemas).
+Отклоненные строки либо откладываются в артефакт <источник>_rejected
+(карантин) с числом строк по причинам в манифесте, либо прерывают извлечение.
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+import pyarrow as pa
+
+from retention.excel_stream import iter_excel_batches
+from retention.schemas import REJECT_POLICIES, rejected_summary
+
+GLOB_CHARS = '*?['
+
+
+def resolve_source(data_dir, pattern, extension):
+    """
+    Отсортированный список файлов источника по имени, каталогу или glob-шаблону
+    """
+    path = os.path.join(data_dir, pattern)
+    if any(char in pattern for char in GLOB_CHARS):
+        paths = [p for p in glob.glob(path) if os.path.isfile(p)]
+    elif os.path.isfile(path):
+        paths = [path]
+    else:
+        # employees.csv -> каталог шардов employees/
+        directory = path if os.path.isdir(path) else os.path.splitext(path)[0]
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"Источник не найден: {path}")
+        paths = [
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.endswith(extension) and not name.startswith('.')
+        ]
+
+    if not paths:
+        raise FileNotFoundError(f"Нет файлов источника: {path}")
+    return sorted(paths)
+
+
+def _conformed(df, schema, path, rejected):
+    table, rejected_rows = schema.conform(df, path)
+    if rejected_rows is not None:
+        rejected.append(rejected_rows)
+    return schema.arrow_schema, table.to_batches()
+
+
+def read_csv_shard(path, schema, rejected, **options):
+    return _conformed(pd.read_csv(path), schema, path, rejected)
+
+
+def read_json_shard(path, schema, rejected, **options):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return _conformed(pd.DataFrame(data), schema, path, rejected)
+
+
+def read_excel_shard(path, schema, rejected, **options):
+    return schema.arrow_schema, iter_excel_batches(path, schema, rejected=rejected, **options)
+
+
+SHARD_READERS = {
+    'csv': read_csv_shard,
+    'json': read_json_shard,
+    'xlsx': read_excel_shard,
+}
+
+
+def _parse_shard(kind, path, schema, options):
+    # Выполняется в процессе пула: шард целиком возвращается как Table
+    rejected = []
+    arrow_schema, batches = SHARD_READERS[kind](path, schema, rejected, **options)
+    table = pa.Table.from_batches(list(batches), schema=arrow_schema)
+    return table, rejected
+
+
+def _pooled_tables(kind, paths, schema, rejected, options, max_workers, ordered):
+    """
+    Разбор шардов в пуле процессов; в работе не более 2 * max_workers файлов
+    """
+    # spawn: процесс задачи Airflow многопоточный, fork из него небезопасен
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        remaining = iter(paths)
+        pending = deque()
+
+        def submit_next():
+            path = next(remaining, None)
+            if path is not None:
+                pending.append(executor.submit(_parse_shard, kind, path, schema, options))
+
+        for _ in range(2 * max_workers):
+            submit_next()
+
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                future = next(iter(done))
+                pending.remove(future)
+            table, shard_rejected = future.result()
+            rejected.extend(shard_rejected)
+            submit_next()
+            yield table.schema, table.to_batches()
+
+
+def iter_source_parts(kind, paths, schema, rejected, options=None, max_workers=1, ordered=True):
+    """
+    Пары (схема, пакеты) по шардам: последовательно в текущем процессе
+    или параллельно в пуле процессов; отклоненные строки - в список rejected
+    """
+    options = options or {}
+    if len(paths) == 1 or max_workers <= 1:
+        # Один файл разбирается потоково, без пересылки таблицы между процессами
+        for path in paths:
+            yield SHARD_READERS[kind](path, schema, rejected, **options)
+        return
+    yield from _pooled_tables(kind, paths, schema, rejected, options, min(max_workers, len(paths)), ordered)
+
+
+def extract_source(store, name, run_id, kind, paths, source_schema, options=None, max_workers=1,
+                   ordered=True, on_reject='quarantine'):
+    """
+    Слияние шардов источника в один артефакт; возвращает манифест.
+
+    Все шарды приводятся к схеме source_schema. При on_reject='quarantine'
+    отклоненные строки записываются в артефакт <name>_rejected, при 'fail'
+    извлечение прерывается после первого шарда с отклоненными строками,
+    и артефакт не создается.
+    """
+    if on_reject not in REJECT_POLICIES:
+        raise ValueError(f"Неизвестная политика отклоненных строк: {on_reject}. Доступны: {', '.join(REJECT_POLICIES)}")
+    rejected = []
+    parts = iter_source_parts(kind, paths, source_schema, rejected, options, max_workers, ordered)
+    schema, first_batches = next(parts)
+
+    def checked(part_batches):
+        yield from part_batches
+        # Ошибка внутри потока пакетов: write_batches удаляет временный файл, не заменяя артефакт
+        if on_reject == 'fail' and rejected:
+            raise ValueError(f"Строки источника {name} не подходят под схему: {rejected_summary(rejected)[1]}")
+
+    def batches():
+        # Шарды приведены к одной схеме реестра и сливаются без преобразований
+        yield from checked(first_batches)
+        for _, part_batches in parts:
+            yield from checked(part_batches)
+
+    try:
+        manifest = store.write_batches(schema, batches(), name, run_id)
+    finally:
+        # Пул разбора шардов останавливается и при прерванном извлечении
+        parts.close()
+    manifest['shards'] = len(paths)
+
+    rejected_df, reasons = rejected_summary(rejected)
+    if rejected_df is not None:
+        rejected_manifest = store.write(rejected_df, f"{name}_rejected", run_id)
+        manifest['rejected'] = {'rows': len(rejected_df), 'reasons': reasons, 'manifest': rejected_manifest}
+    return manifest
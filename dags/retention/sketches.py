@@ -0,0 +1,307 @@
+"""
+Сливаемые скетчи по отделам для статистики за длинные периоды.
+
+Точное число уникальных сотрудников (nunique) и квантили оценок за
+несколько месяцев потребовали бы повторного чтения сырых строк обучения
+всех дат. Вместо этого (params sketches) для каждой даты запуска и отдела
+в таблицу department_sketches хранилища записываются скетчи:
+- HyperLogLog на 2**HLL_PRECISION регистрах (стандартная ошибка около
+  1.6%) - число уникальных сотрудников; слияние - поэлементный максимум
+  регистров;
+- гистограмма оценок по целым значениям SCORE_RANGE - медиана и p90.
+  Оценки после проверки - целые от 0 до 100, поэтому 101 счетчик меньше
+  t-digest или KLL и дает точные квантили; слияние - сумма счетчиков.
+
+Скетчи разделов режима mapped одной даты складываются без исходных строк
+(разделы не пересекаются). Скетч даты описывает весь снимок источников
+на эту дату - файлы обучения хранят накопленную историю, поэтому скетчи
+разных дат не складываются: иначе одни и те же строки учитывались бы
+в records и гистограмме каждый день. sketch_stats берет для отдела
+последний скетч диапазона дат.
+"""
+
+import base64
+import math
+import zlib
+
+import numpy as np
+
+from retention.join_engine import encode_join
+from retention.validation import SCORE_RANGE
+
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+SCORE_BINS = SCORE_RANGE[1] - SCORE_RANGE[0] + 1
+
+SKETCH_QUANTILES = {'score_median': 0.5, 'score_p90': 0.9}
+
+SKETCH_COLUMNS = [
+    ('analysis_date', 'TEXT'),
+    ('department', 'TEXT'),
+    ('records', 'INTEGER'),
+    ('employees_hll', 'TEXT'),
+    ('score_histogram', 'TEXT'),
+]
+SKETCH_KEY = ['analysis_date', 'department']
+
+# Колонки результата sketch_stats
+SKETCH_STAT_COLUMNS = [
+    'department', 'first_date', 'last_date', 'dates', 'records',
+    'distinct_employees', 'score_median', 'score_p90',
+]
+
+# Скетчи хранятся текстом (base64 от сжатого zlib массива): одинаково для всех бэкендов
+SKETCH_DDL = {
+    'sqlite': [
+        """
+        CREATE TABLE IF NOT EXISTS department_sketches (
+            analysis_date TEXT NOT NULL,
+            department TEXT NOT NULL,
+            records INTEGER NOT NULL,
+            employees_hll TEXT NOT NULL,
+            score_histogram TEXT NOT NULL
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_department_sketches_date_department "
+        "ON department_sketches (analysis_date, department)",
+    ],
+    'duckdb': [
+        """
+        CREATE TABLE IF NOT EXISTS department_sketches (
+            analysis_date DATE NOT NULL,
+            department VARCHAR NOT NULL,
+            records BIGINT NOT NULL,
+            employees_hll VARCHAR NOT NULL,
+            score_histogram VARCHAR NOT NULL,
+            PRIMARY KEY (analysis_date, department)
+        )
+        """,
+    ],
+    'postgresql': [
+        """
+        CREATE TABLE IF NOT EXISTS department_sketches (
+            analysis_date DATE NOT NULL,
+            department TEXT NOT NULL,
+            records BIGINT NOT NULL,
+            employees_hll TEXT NOT NULL,
+            score_histogram TEXT NOT NULL
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_department_sketches_date_department "
+        "ON department_sketches (analysis_date, department)",
+    ],
+}
+
+_REGISTER_DTYPE = np.dtype('<u1')
+_HISTOGRAM_DTYPE = np.dtype('<i8')
+
+
+def _hash64(values):
+    """
+    64-битный хэш целых ключей (финализатор splitmix64), векторно
+    """
+    x = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def hll_positions(keys):
+    """
+    Номер регистра (старшие HLL_PRECISION бит хэша) и ранг - позиция первой
+    единицы в остальных битах - для каждого ключа
+    """
+    hashed = _hash64(np.asarray(keys))
+    index = (hashed >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+    rest = hashed & np.uint64((1 << (64 - HLL_PRECISION)) - 1)
+    # Остаток занимает 52 бита и точно представим в float64: длина в битах - показатель frexp
+    bit_length = np.frexp(rest.astype(np.float64))[1]
+    rank = (64 - HLL_PRECISION) - bit_length + 1
+    return index, rank.astype(np.uint8)
+
+
+def hll_estimate(registers):
+    """
+    Оценка числа уникальных ключей по регистрам HyperLogLog
+    (с поправкой линейного счета для малых значений)
+    """
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.ldexp(1.0, -registers.astype(np.int64)).sum()
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return estimate
+
+
+def _pack(array, dtype):
+    return base64.b64encode(zlib.compress(array.astype(dtype).tobytes())).decode('ascii')
+
+
+def _unpack(text, dtype, size, name):
+    array = np.frombuffer(zlib.decompress(base64.b64decode(text)), dtype=dtype)
+    if len(array) != size:
+        raise ValueError(f"Скетч {name}: ожидалось {size} элементов, получено {len(array)}")
+    return array.copy()
+
+
+class DepartmentSketch:
+    """
+    Скетчи одного отдела: регистры HyperLogLog по сотрудникам,
+    гистограмма оценок и число записей обучения
+    """
+
+    def __init__(self, registers=None, histogram=None, records=0):
+        self.registers = registers if registers is not None else np.zeros(HLL_REGISTERS, dtype=np.uint8)
+        self.histogram = histogram if histogram is not None else np.zeros(SCORE_BINS, dtype=np.int64)
+        self.records = int(records)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        self.histogram += other.histogram
+        self.records += other.records
+        return self
+
+    @property
+    def distinct_employees(self):
+        return int(round(hll_estimate(self.registers)))
+
+    def quantile(self, q):
+        """
+        Квантиль оценок по ближайшему рангу; None, если оценок нет
+        """
+        total = int(self.histogram.sum())
+        if total == 0:
+            return None
+        rank = max(1, math.ceil(q * total))
+        return int(np.searchsorted(np.cumsum(self.histogram), rank)) + SCORE_RANGE[0]
+
+    def to_record(self, department):
+        return {
+            'department': department,
+            'records': self.records,
+            'employees_hll': _pack(self.registers, _REGISTER_DTYPE),
+            'score_histogram': _pack(self.histogram, _HISTOGRAM_DTYPE),
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(
+            _unpack(record['employees_hll'], _REGISTER_DTYPE, HLL_REGISTERS, 'employees_hll').astype(np.uint8),
+            _unpack(record['score_histogram'], _HISTOGRAM_DTYPE, SCORE_BINS, 'score_histogram').astype(np.int64),
+            record['records'],
+        )
+
+
+def department_sketches(employees_df, training_df, courses_df):
+    """
+    Скетчи по отделам за один проход по объединению (как department_partials):
+    {отдел: DepartmentSketch}; оценки учитываются с кратностью строк
+    """
+    joined = encode_join(employees_df, courses_df, training_df)
+    departments = joined['department'].cat.categories
+    codes = joined['department'].cat.codes.to_numpy().astype(np.int64)
+    weight = joined['multiplicity'].to_numpy()
+    n_departments = len(departments)
+
+    registers = np.zeros(n_departments * HLL_REGISTERS, dtype=np.uint8)
+    index, rank = hll_positions(joined['employee_id'].to_numpy())
+    np.maximum.at(registers, codes * HLL_REGISTERS + index, rank)
+
+    score = joined['score'].to_numpy(dtype='float64')
+    scored = ~np.isnan(score)
+    bins = np.clip(np.rint(score[scored]), *SCORE_RANGE).astype(np.int64) - SCORE_RANGE[0]
+    histogram = np.bincount(
+        codes[scored] * SCORE_BINS + bins, weights=weight[scored], minlength=n_departments * SCORE_BINS
+    ).astype(np.int64)
+    records = np.bincount(codes, weights=weight, minlength=n_departments).astype(np.int64)
+
+    registers = registers.reshape(n_departments, HLL_REGISTERS)
+    histogram = histogram.reshape(n_departments, SCORE_BINS)
+    return {
+        department: DepartmentSketch(registers[code].copy(), histogram[code].copy(), records[code])
+        for code, department in enumerate(departments)
+        if records[code] > 0
+    }
+
+
+def sketch_records(sketches):
+    """
+    Записи скетчей для XCom и кэша этапов (в порядке отделов)
+    """
+    return [sketches[department].to_record(department) for department in sorted(sketches)]
+
+
+def merge_sketch_records(*record_lists):
+    """
+    Слияние списков записей скетчей (разделов или дат) по отделам
+    """
+    merged = {}
+    for records in record_lists:
+        for record in records or []:
+            sketch = DepartmentSketch.from_record(record)
+            if record['department'] in merged:
+                merged[record['department']].merge(sketch)
+            else:
+                merged[record['department']] = sketch
+    return merged
+
+
+def sketch_rows(analysis_date, records):
+    """
+    Кортежи строк таблицы department_sketches
+    """
+    for record in records:
+        yield (
+            analysis_date, record['department'], record['records'],
+            record['employees_hll'], record['score_histogram'],
+        )
+
+
+def sketch_query(date_from=None, date_to=None, departments=()):
+    """
+    Запрос скетчей за диапазон дат (индекс по analysis_date) в порядке отделов
+    """
+    where, params = [], []
+    if date_from:
+        where.append("analysis_date >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("analysis_date <= ?")
+        params.append(date_to)
+    if departments:
+        where.append(f"department IN ({', '.join('?' for _ in departments)})")
+        params.extend(departments)
+    query = "SELECT department, analysis_date, records, employees_hll, score_histogram FROM department_sketches"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY department, analysis_date"
+    return query, params
+
+
+def sketch_stats(backend, date_from=None, date_to=None, departments=()):
+    """
+    Статистика по отделам на последнюю дату диапазона из скетчей хранилища
+    без чтения сырых строк: кортежи с колонками SKETCH_STAT_COLUMNS по отделам
+    """
+    query, params = sketch_query(date_from, date_to, departments)
+    current, latest, dates = None, None, []
+    for department, analysis_date, records, employees_hll, score_histogram in backend.iter_rows(query, tuple(params)):
+        if department != current:
+            if current is not None:
+                yield _stat_row(current, latest, dates)
+            current, dates = department, []
+        # Скетч каждой даты - полный снимок: разбирается только последний
+        latest = {'records': records, 'employees_hll': employees_hll, 'score_histogram': score_histogram}
+        dates.append(str(analysis_date))
+    if current is not None:
+        yield _stat_row(current, latest, dates)
+
+
+def _stat_row(department, record, dates):
+    sketch = DepartmentSketch.from_record(record)
+    return (
+        department, dates[0], dates[-1], len(dates), sketch.records, sketch.distinct_employees,
+        sketch.quantile(SKETCH_QUANTILES['score_median']), sketch.quantile(SKETCH_QUANTILES['score_p90']),
+    )
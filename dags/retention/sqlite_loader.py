@@ -0,0 +1,216 @@
+"""
+Пакетная транзакционная загрузка в SQLite.
+
+Соединение настраивается под загрузку (WAL, synchronous=NORMAL, крупный
+кэш страниц, временные таблицы в памяти), строки вставляются одним
+подготовленным executemany внутри явной транзакции, а проверка делается
+по количеству строк и контрольным суммам колонок вместо чтения таблицы.
+
+Для таблиц с историей используется bulk_upsert: строки логического
+раздела (например, даты запуска) вставляются или обновляются по
+естественному ключу, поэтому повторная загрузка раздела идемпотентна.
+"""
+
+import math
+import sqlite3
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # Отрицательное значение - размер кэша в КиБ (64 МиБ)
+    'cache_size': -65536,
+    'temp_store': 'MEMORY',
+}
+
+# Чтение без записи (например, проверка результатов при работающем DAG):
+# journal_mode не меняется, query_only запрещает изменения в соединении
+READ_ONLY_PRAGMAS = {
+    'query_only': 'ON',
+    'cache_size': -65536,
+    'temp_store': 'MEMORY',
+}
+
+NUMERIC_TYPES = ('INTEGER', 'REAL')
+
+# Относительная погрешность при сверке сумм вещественных колонок
+CHECKSUM_REL_TOL = 1e-9
+
+
+def connect(db_path, pragmas=None, **kwargs):
+    """
+    Соединение с SQLite с настройками для пакетной загрузки.
+    Транзакциями управляет вызывающий код (isolation_level=None).
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None, **kwargs)
+    for name, value in (pragmas or DEFAULT_PRAGMAS).items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+class RowsChecksum:
+    """
+    Контрольная сумма строк, считаемая на лету при передаче в executemany:
+    количество строк, суммы числовых колонок и суммарная длина текстовых
+    """
+
+    def __init__(self, columns, key_columns=()):
+        self.columns = columns
+        self.rows = 0
+        self.sums = [0] * len(columns)
+        names = [name for name, _ in columns]
+        self.key_positions = [names.index(name) for name in key_columns]
+        self.keys = []
+
+    def track(self, rows):
+        numeric = [sql_type in NUMERIC_TYPES for _, sql_type in self.columns]
+        for row in rows:
+            self.rows += 1
+            if self.key_positions:
+                self.keys.append(tuple(row[i] for i in self.key_positions))
+            for i, value in enumerate(row):
+                if value is None:
+                    continue
+                self.sums[i] += value if numeric[i] else len(str(value))
+            yield row
+
+    def as_dict(self):
+        result = {'rows': self.rows}
+        for (name, _), total in zip(self.columns, self.sums):
+            result[name] = total
+        return result
+
+
+def table_checksum(conn, table, columns, where=None, params=(), sum_template='TOTAL({})'):
+    """
+    Та же контрольная сумма, посчитанная агрегатным запросом.
+    sum_template позволяет использовать выражение суммы другого диалекта SQL.
+    """
+    expressions = ['COUNT(*)']
+    for name, sql_type in columns:
+        if sql_type in NUMERIC_TYPES:
+            expressions.append(sum_template.format(name))
+        else:
+            expressions.append(sum_template.format(f"LENGTH(CAST({name} AS TEXT))"))
+    query = f"SELECT {', '.join(expressions)} FROM {table}"
+    if where:
+        query += f" WHERE {where}"
+    values = conn.execute(query, params).fetchone()
+
+    result = {'rows': values[0]}
+    for (name, _), total in zip(columns, values[1:]):
+        result[name] = total
+    return result
+
+
+def checksums_match(expected, actual):
+    if expected['rows'] != actual['rows']:
+        return False
+    for name, value in expected.items():
+        if not math.isclose(value, actual[name], rel_tol=CHECKSUM_REL_TOL, abs_tol=1e-6):
+            return False
+    return True
+
+
+def bulk_load(conn, table, columns, rows, replace=False):
+    """
+    Загрузка строк (кортежей в порядке columns) одной транзакцией.
+
+    При replace=True таблица предварительно очищается в той же транзакции.
+    После вставки контрольная сумма таблицы сверяется с суммой вставленных
+    строк; при расхождении транзакция откатывается.
+    """
+    names = [name for name, _ in columns]
+    insert_query = (
+        f"INSERT INTO {table} ({', '.join(names)}) "
+        f"VALUES ({', '.join('?' for _ in names)})"
+    )
+
+    checksum = RowsChecksum(columns)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if replace:
+            conn.execute(f"DELETE FROM {table}")
+            before = None
+        else:
+            before = table_checksum(conn, table, columns)
+
+        conn.executemany(insert_query, checksum.track(rows))
+
+        expected = checksum.as_dict()
+        if before is not None:
+            expected = {key: value + before[key] for key, value in expected.items()}
+        actual = table_checksum(conn, table, columns)
+        if not checksums_match(expected, actual):
+            raise ValueError(f"Проверка загрузки в {table} не пройдена: ожидалось {expected}, получено {actual}")
+
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    return checksum.as_dict()
+
+
+def ensure_index(conn, table, name, columns, unique=False):
+    """
+    Создание индекса, если его еще нет
+    """
+    conn.execute(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} "
+        f"ON {table} ({', '.join(columns)})"
+    )
+
+
+def bulk_upsert(conn, table, columns, key_columns, rows, partition):
+    """
+    Идемпотентная загрузка логического раздела таблицы.
+
+    Строки (кортежи в порядке columns) вставляются через
+    INSERT ... ON CONFLICT (key_columns) DO UPDATE; для конфликта нужен
+    уникальный индекс по key_columns. partition - словарь {колонка: значение},
+    задающий раздел: строки раздела, которых нет в новой загрузке, удаляются.
+    Проверка контрольных сумм выполняется только по разделу.
+    """
+    names = [name for name, _ in columns]
+    updates = [name for name in names if name not in key_columns]
+    upsert_query = (
+        f"INSERT INTO {table} ({', '.join(names)}) "
+        f"VALUES ({', '.join('?' for _ in names)}) "
+        f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET "
+        + ', '.join(f"{name} = excluded.{name}" for name in updates)
+    )
+    partition_where = ' AND '.join(f"{name} = ?" for name in partition)
+    partition_params = tuple(partition.values())
+
+    checksum = RowsChecksum(columns, key_columns)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(upsert_query, checksum.track(rows))
+
+        # Удаление строк раздела, не вошедших в текущую загрузку
+        key_list = ', '.join(key_columns)
+        conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS loaded_keys AS SELECT {key_list} FROM {table} WHERE 0")
+        conn.execute("DELETE FROM loaded_keys")
+        conn.executemany(
+            f"INSERT INTO loaded_keys ({key_list}) VALUES ({', '.join('?' for _ in key_columns)})",
+            checksum.keys,
+        )
+        key_match = ' AND '.join(f"loaded_keys.{name} = {table}.{name}" for name in key_columns)
+        conn.execute(
+            f"DELETE FROM {table} WHERE {partition_where} "
+            f"AND NOT EXISTS (SELECT 1 FROM loaded_keys WHERE {key_match})",
+            partition_params,
+        )
+        conn.execute("DROP TABLE loaded_keys")
+
+        expected = checksum.as_dict()
+        actual = table_checksum(conn, table, columns, where=partition_where, params=partition_params)
+        if not checksums_match(expected, actual):
+            raise ValueError(f"Проверка загрузки в {table} не пройдена: ожидалось {expected}, получено {actual}")
+
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    return checksum.as_dict()
@@ -0,0 +1,325 @@
+"""
+Проверка данных между извлечением и трансформацией.
+
+Правила применяются к типизированным DataFrame (retention.schemas)
+булевыми масками по колонкам целиком:
+- null:score - оценка не указана;
+- range:score - оценка вне SCORE_RANGE;
+- ref:employee_id, ref:course_id - строка обучения ссылается на сотрудника
+  или курс, которых нет в справочнике;
+- dup:employee_id, dup:course_id, dup:employee_id+course_id - повтор ключа
+  (первая строка остается, повторы отклоняются).
+
+Строка, нарушившая несколько правил, получает код первого из них,
+а счетчики по правилам учитывают каждое нарушение. Отклоненные строки
+(вместе с отклоненными схемой при извлечении) записываются в таблицу
+quarantine хранилища, счетчики - в validation_counts.
+"""
+
+import numpy as np
+import pandas as pd
+
+SCORE_RANGE = (0, 100)
+
+# Версия набора правил validate_sources; увеличивается при изменении правил,
+# чтобы кэш не выдал результат проверки по старому набору
+RULES_VERSION = 1
+
+# Проверка ссылок и повторов битовой картой (без сортировки и хэш-таблиц), если
+# диапазон ключей не больше BITMAP_DENSITY значений на строку и BITMAP_BYTES байт:
+# карта тогда не больше самих колонок int64. Редкие ключи проверяются сортировкой
+BITMAP_DENSITY = 8
+BITMAP_BYTES = 256 * 1024 * 1024
+
+# Значения отклоненных строк хранятся текстом: схема источника могла их не принять
+VALUE_COLUMNS = ['employee_id', 'course_id', 'score', 'department', 'course_name']
+
+QUARANTINE_COLUMNS = [
+    ('analysis_date', 'TEXT'),
+    ('source', 'TEXT'),
+    ('row_index', 'INTEGER'),
+    ('reason', 'TEXT'),
+    ('employee_id', 'TEXT'),
+    ('course_id', 'TEXT'),
+    ('score', 'TEXT'),
+    ('department', 'TEXT'),
+    ('course_name', 'TEXT'),
+    ('file', 'TEXT'),
+]
+QUARANTINE_KEY = ['analysis_date', 'source', 'row_index']
+
+VALIDATION_COUNT_COLUMNS = [
+    ('analysis_date', 'TEXT'),
+    ('source', 'TEXT'),
+    ('rule', 'TEXT'),
+    ('row_count', 'INTEGER'),
+]
+VALIDATION_COUNT_KEY = ['analysis_date', 'source', 'rule']
+
+_QUARANTINE_VALUES = """
+    reason {text} NOT NULL,
+    employee_id {text},
+    course_id {text},
+    score {text},
+    department {text},
+    course_name {text},
+    file {text}
+"""
+
+# Таблицы карантина для каждого диалекта хранилища
+QUARANTINE_DDL = {
+    'sqlite': [
+        f"""
+        CREATE TABLE IF NOT EXISTS quarantine (
+            analysis_date TEXT NOT NULL,
+            source TEXT NOT NULL,
+            row_index INTEGER NOT NULL,
+            {_QUARANTINE_VALUES.format(text='TEXT')}
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_quarantine_date_source_row "
+        "ON quarantine (analysis_date, source, row_index)",
+        "CREATE INDEX IF NOT EXISTS ix_quarantine_reason ON quarantine (reason)",
+        """
+        CREATE TABLE IF NOT EXISTS validation_counts (
+            analysis_date TEXT NOT NULL,
+            source TEXT NOT NULL,
+            rule TEXT NOT NULL,
+            row_count INTEGER NOT NULL
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_validation_counts_date_source_rule "
+        "ON validation_counts (analysis_date, source, rule)",
+    ],
+    'duckdb': [
+        f"""
+        CREATE TABLE IF NOT EXISTS quarantine (
+            analysis_date DATE NOT NULL,
+            source VARCHAR NOT NULL,
+            row_index INTEGER NOT NULL,
+            {_QUARANTINE_VALUES.format(text='VARCHAR')},
+            PRIMARY KEY (analysis_date, source, row_index)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS validation_counts (
+            analysis_date DATE NOT NULL,
+            source VARCHAR NOT NULL,
+            rule VARCHAR NOT NULL,
+            row_count BIGINT NOT NULL,
+            PRIMARY KEY (analysis_date, source, rule)
+        )
+        """,
+    ],
+    'postgresql': [
+        f"""
+        CREATE TABLE IF NOT EXISTS quarantine (
+            analysis_date DATE NOT NULL,
+            source TEXT NOT NULL,
+            row_index INTEGER NOT NULL,
+            {_QUARANTINE_VALUES.format(text='TEXT')}
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_quarantine_date_source_row "
+        "ON quarantine (analysis_date, source, row_index)",
+        "CREATE INDEX IF NOT EXISTS ix_quarantine_reason ON quarantine (reason)",
+        """
+        CREATE TABLE IF NOT EXISTS validation_counts (
+            analysis_date DATE NOT NULL,
+            source TEXT NOT NULL,
+            rule TEXT NOT NULL,
+            row_count BIGINT NOT NULL
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_validation_counts_date_source_rule "
+        "ON validation_counts (analysis_date, source, rule)",
+    ],
+}
+
+
+class SourceValidation:
+    """
+    Результат проверки источника: маска годных строк, коды причин
+    отклоненных строк (в порядке строк) и число нарушений по правилам
+    """
+
+    def __init__(self, keep, reasons, counts):
+        self.keep = keep
+        self.reasons = reasons
+        self.counts = counts
+
+    @property
+    def rejected_rows(self):
+        return len(self.reasons)
+
+
+def _apply_rules(rules, rows):
+    """
+    Свертка масок правил [(код, маска)] в SourceValidation
+    """
+    rejected = np.zeros(rows, dtype=bool)
+    first_rule = np.zeros(rows, dtype=np.int8)
+    counts = {}
+    for position, (code, mask) in enumerate(rules):
+        count = int(np.count_nonzero(mask))
+        if not count:
+            continue
+        counts[code] = count
+        # Причиной строки считается первое нарушенное правило
+        first_rule[mask & ~rejected] = position
+        rejected |= mask
+    codes = np.array([code for code, _ in rules], dtype=object)
+    return SourceValidation(~rejected, codes[first_rule[rejected]], counts)
+
+
+def _int_keys(values):
+    # Идентификаторы уже целые по схеме источника: массив берется без копирования
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return values.to_numpy()
+    return values.to_numpy(dtype=np.int64)
+
+
+def _offset(values, low):
+    return values.astype(np.int64) - low if low else values
+
+
+def _bitmap_fits(span, rows):
+    return span <= min(BITMAP_DENSITY * rows, BITMAP_BYTES)
+
+
+def _isin(probe, keys):
+    """
+    Маска вхождения probe в keys: битовая карта по плотному диапазону ключей или np.isin
+    """
+    if len(probe) == 0 or len(keys) == 0:
+        return np.zeros(len(probe), dtype=bool)
+    low = min(int(probe.min()), int(keys.min()))
+    high = int(keys.max())
+    if not _bitmap_fits(high - low + 2, len(probe) + len(keys)):
+        return np.isin(probe, keys)
+    present = np.zeros(high - low + 2, dtype=bool)
+    present[_offset(keys, low)] = True
+    # Значения больше high попадают (mode='clip') в последний, всегда пустой элемент
+    return np.take(present, _offset(probe, low), mode='clip')
+
+
+def _duplicated(*columns):
+    """
+    Маска повторов составного целочисленного ключа (кроме первого вхождения)
+    """
+    rows = len(columns[0])
+    if rows == 0:
+        return np.zeros(0, dtype=bool)
+
+    packed = np.zeros(rows, dtype=np.int64)
+    span = 1
+    for values in columns:
+        low, high = int(values.min()), int(values.max())
+        width = high - low + 1
+        if span * width >= 2 ** 62:
+            # Ключ не упаковывается в int64 - проверка по хэшу pandas
+            return pd.DataFrame({str(i): values for i, values in enumerate(columns)}).duplicated().to_numpy()
+        packed *= width
+        packed += values
+        if low:
+            packed -= low
+        span *= width
+
+    if _bitmap_fits(span, rows):
+        # Обычно повторов нет: это подтверждает число отмеченных ключей битовой карты
+        seen = np.zeros(span, dtype=bool)
+        seen[packed] = True
+        if np.count_nonzero(seen) == rows:
+            return np.zeros(rows, dtype=bool)
+    return pd.Series(packed).duplicated().to_numpy()
+
+
+def rule_set():
+    """
+    Описание набора правил для ключа кэша
+    """
+    return {'version': RULES_VERSION, 'score_range': list(SCORE_RANGE)}
+
+
+def validate_sources(employees_df, training_df, courses_df):
+    """
+    Проверка сотрудников, обучения и курсов; словарь {источник: SourceValidation}
+    """
+    employee_ids = _int_keys(employees_df['employee_id'])
+    course_ids = _int_keys(courses_df['course_id'])
+
+    employees = _apply_rules([
+        ('dup:employee_id', _duplicated(employee_ids)),
+    ], len(employees_df))
+    courses = _apply_rules([
+        ('dup:course_id', _duplicated(course_ids)),
+    ], len(courses_df))
+
+    train_employees = _int_keys(training_df['employee_id'])
+    train_courses = _int_keys(training_df['course_id'])
+    score = training_df['score']
+    if pd.api.types.is_integer_dtype(score.dtype):
+        # uint8 без пропусков: сравнение без преобразования в float
+        score_nulls = np.zeros(len(score), dtype=bool)
+        score_values = score.to_numpy()
+    else:
+        score_nulls = score.isna().to_numpy()
+        score_values = score.to_numpy(dtype='float64', na_value=np.nan)
+    training = _apply_rules([
+        ('null:score', score_nulls),
+        ('range:score', (score_values < SCORE_RANGE[0]) | (score_values > SCORE_RANGE[1])),
+        # Справочники сверяются по всем ключам: повтор ключа не делает ссылку недействительной
+        ('ref:employee_id', ~_isin(train_employees, employee_ids)),
+        ('ref:course_id', ~_isin(train_courses, course_ids)),
+        ('dup:employee_id+course_id', _duplicated(train_employees, train_courses)),
+    ], len(training_df))
+
+    return {'employees': employees, 'training': training, 'courses': courses}
+
+
+def quarantine_frame(source, df, reasons, file=None):
+    """
+    Отклоненные строки источника в колонках таблицы quarantine (без даты и номера строки)
+    """
+    frame = pd.DataFrame(index=range(len(df)))
+    frame['source'] = source
+    frame['reason'] = np.asarray(reasons, dtype=object)
+    for name in VALUE_COLUMNS:
+        if name in df.columns:
+            values = df[name].reset_index(drop=True)
+            if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+                # uint8 с пропусками читается как float: 90, а не 90.0
+                values = values.astype('Int64')
+            values = values.astype(object)
+            frame[name] = values.where(values.isna(), values.astype(str))
+        else:
+            frame[name] = None
+    frame['file'] = df['file'].to_numpy(dtype=object) if 'file' in df.columns else file
+    return frame
+
+
+def quarantine_rows(analysis_date, frames):
+    """
+    Кортежи строк таблицы quarantine; номер строки - порядковый в пределах источника
+    """
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return iter(())
+    frame = pd.concat(frames, ignore_index=True)
+    frame = frame.assign(
+        analysis_date=analysis_date,
+        row_index=frame.groupby('source', sort=False).cumcount(),
+    )
+    names = [name for name, _ in QUARANTINE_COLUMNS]
+    frame = frame[names].astype(object)
+    frame = frame.where(frame.notna(), None)
+    return zip(*(frame[name].tolist() for name in names))
+
+
+def count_rows(analysis_date, counts):
+    """
+    Кортежи строк таблицы validation_counts из {источник: {правило: число строк}}
+    """
+    for source, rules in counts.items():
+        for rule, rows in sorted(rules.items()):
+            yield (analysis_date, source, rule, int(rows))
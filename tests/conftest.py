@@ -0,0 +1,55 @@
+"""
+Общие настройки тестов: модули retention лежат в каталоге dags
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dags'))
+
+
+def _typed(name, df):
+    from retention.schemas import get_schema
+
+    schema = get_schema(name)
+    table, rejected = schema.conform(df)
+    assert rejected is None
+    return schema.to_pandas(table)
+
+
+@pytest.fixture
+def make_sources():
+    """
+    Фабрика источников с типами из реестра схем: (employees, training, courses).
+    В обучении есть пропуски оценок, повторы пар и ссылки на сотрудников
+    и курсы, которых нет в справочниках; id_step - шаг идентификаторов сотрудников
+    """
+
+    def make(training_rows=2000, employees=300, courses=8, seed=0, id_step=1):
+        rng = np.random.default_rng(seed)
+        employees_df = pd.DataFrame({
+            'employee_id': np.arange(1, employees + 1) * id_step,
+            'department': rng.choice(['IT', 'HR', 'Finance', 'Sales'], employees),
+        })
+        score = rng.integers(0, 101, training_rows).astype('float64')
+        score[rng.random(training_rows) < 0.05] = np.nan
+        training_df = pd.DataFrame({
+            'employee_id': rng.integers(1, employees + 20, training_rows) * id_step,
+            'course_id': rng.integers(1, courses + 2, training_rows),
+            'score': score,
+        })
+        courses_df = pd.DataFrame({
+            'course_id': np.arange(1, courses + 1),
+            'course_name': [f"course {n}" for n in range(1, courses + 1)],
+        })
+        return (
+            _typed('employees', employees_df),
+            _typed('training', training_df),
+            _typed('courses', courses_df),
+        )
+
+    return make
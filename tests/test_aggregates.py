@@ -0,0 +1,76 @@
+"""
+Инкрементальное состояние агрегатов по отделам: после дописанных, удаленных
+и измененных строк обучения совпадает с полным пересчетом merge_department_stats
+"""
+
+import pandas as pd
+
+from retention import aggregates
+from retention.aggregates import DepartmentAggregateState, appended_rows, training_delta
+from retention.join_engine import merge_department_stats
+
+STAT_COLUMNS = ['department', 'total_employees', 'total_courses', 'avg_score']
+
+
+def assert_matches_merge(state, employees_df, training_df, courses_df):
+    expected = merge_department_stats(employees_df, training_df, courses_df)
+    expected = expected.astype({'department': object}).sort_values('department').reset_index(drop=True)
+    pd.testing.assert_frame_equal(state.dept_stats()[STAT_COLUMNS], expected[STAT_COLUMNS], check_dtype=False)
+
+
+def test_appended_rows_only_for_prefix_snapshots(make_sources):
+    _, training_df, _ = make_sources()
+    old = training_df.iloc[:1500]
+
+    appended = appended_rows(old, training_df)
+    assert len(appended) == 500
+    assert appended_rows(old, training_df.iloc[1:]) is None
+    assert appended_rows(training_df, old) is None
+
+
+def test_training_delta_weights(make_sources):
+    _, training_df, _ = make_sources(training_rows=200)
+    old = training_df.iloc[:150]
+    new = pd.concat([old.iloc[10:], training_df.iloc[150:]], ignore_index=True)
+
+    delta = training_delta(old, new)
+
+    assert delta['weight'].sum() == len(new) - len(old)
+    assert (delta['weight'] < 0).sum() >= 1
+
+
+def test_incremental_state_matches_full_recompute(make_sources, tmp_path, monkeypatch):
+    # Небольшой журнал дельт: проверяется и сжатие пар в один файл
+    monkeypatch.setattr(aggregates, 'EMPLOYEE_LOG_MAX', 3)
+    employees_df, training_df, courses_df = make_sources(training_rows=3000)
+    state_dir = str(tmp_path)
+    snapshot = training_df.iloc[:1000].reset_index(drop=True)
+
+    state = DepartmentAggregateState(state_dir)
+    state.rebuild(employees_df, courses_df, snapshot)
+    state.save('dims', {'rows': len(snapshot)})
+
+    for step in range(8):
+        previous = snapshot
+        if step % 3 == 2:
+            # Удаление строк и изменение оценок: снимок перестает быть продолжением прошлого
+            snapshot = snapshot.drop(index=snapshot.index[::17]).reset_index(drop=True)
+            snapshot.loc[::29, 'score'] = 42
+        else:
+            start = 1000 + step * 250
+            snapshot = pd.concat([snapshot, training_df.iloc[start:start + 250]], ignore_index=True)
+
+        state = DepartmentAggregateState(state_dir)
+        state.load()
+        state.apply_delta(employees_df, courses_df, training_delta(previous, snapshot))
+        state.save('dims', {'rows': len(snapshot)})
+
+        reloaded = DepartmentAggregateState(state_dir)
+        meta = reloaded.load()
+        assert meta['generation'] == step + 2
+        assert len(meta['employee_files']) <= aggregates.EMPLOYEE_LOG_MAX
+        assert_matches_merge(reloaded, employees_df, snapshot, courses_df)
+
+    # На диске только файлы текущего поколения
+    files = {path.name for path in tmp_path.iterdir() if path.suffix == '.parquet'}
+    assert files == {meta['departments_file'], *meta['employee_files']}
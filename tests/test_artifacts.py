@@ -0,0 +1,103 @@
+"""
+Хранилище артефактов: манифест с контрольной суммой, атомарная запись
+через временный файл и сверка файла с манифестом при чтении
+"""
+
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from retention.artifacts import file_checksum, get_artifact_store, store_for_manifest
+
+
+@pytest.fixture(params=['arrow', 'parquet'])
+def store(request, tmp_path):
+    return get_artifact_store(str(tmp_path), request.param)
+
+
+def frame(rows=10):
+    return pd.DataFrame({'employee_id': range(rows), 'department': ['IT', 'HR'] * (rows // 2)})
+
+
+def test_manifest_describes_written_file(store):
+    manifest = store.write(frame(), 'employees', 'manual__2024-10-02T00:00:00+00:00')
+
+    # run_id приводится к имени каталога
+    assert os.path.dirname(manifest['path']).endswith('manual__2024-10-02T00_00_00_00_00')
+    assert manifest['rows'] == 10
+    assert manifest['bytes'] == os.path.getsize(manifest['path'])
+    assert manifest['checksum'] == file_checksum(manifest['path'])
+    assert list(manifest['schema']) == ['employee_id', 'department']
+    assert manifest['schema']['employee_id'] == 'int64'
+    pd.testing.assert_frame_equal(store_for_manifest(manifest, store.base_dir).read(manifest), frame())
+
+
+def test_failed_write_keeps_previous_artifact(store):
+    manifest = store.write(frame(), 'employees', 'run')
+    schema = pa.schema([('employee_id', pa.int64()), ('department', pa.string())])
+
+    def broken():
+        yield pa.RecordBatch.from_pandas(frame(4), schema=schema, preserve_index=False)
+        raise RuntimeError('источник оборвался')
+
+    with pytest.raises(RuntimeError):
+        store.write_batches(schema, broken(), 'employees', 'run')
+
+    # Временный файл удален, прежний артефакт не заменен и читается по своему манифесту
+    assert sorted(name for name in os.listdir(os.path.dirname(manifest['path'])) if not name.startswith('.')) == [
+        os.path.basename(manifest['path'])
+    ]
+    assert len(store.read(manifest, verify=True)) == 10
+
+
+def test_failed_first_write_leaves_no_file(store):
+    schema = pa.schema([('employee_id', pa.int64())])
+
+    def broken():
+        raise KeyboardInterrupt
+        yield
+
+    with pytest.raises(KeyboardInterrupt):
+        store.write_batches(schema, broken(), 'training', 'run')
+
+    assert not [name for name in os.listdir(store.run_dir('run')) if not name.startswith('.')]
+
+
+def test_modified_artifact_is_detected(store):
+    manifest = store.write(frame(), 'employees', 'run')
+    with open(manifest['path'], 'ab') as f:
+        f.write(b'\0')
+
+    with pytest.raises(ValueError, match='изменен после записи'):
+        store.read(manifest)
+
+
+def test_verify_detects_same_size_rewrite(store):
+    manifest = store.write(frame(), 'employees', 'run')
+    stat = os.stat(manifest['path'])
+    with open(manifest['path'], 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)[0]
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last ^ 0xFF]))
+    # Размер и время изменения прежние: подмену находит только контрольная сумма
+    os.utime(manifest['path'], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    with pytest.raises(ValueError, match='Контрольная сумма'):
+        store.read_table(manifest, verify=True)
+
+
+def test_iter_tables_rebatches_rows(store):
+    manifest = store.write(frame(10), 'employees', 'run')
+
+    parts = list(store.iter_tables(manifest, 4))
+
+    assert [part.num_rows for part in parts] == [4, 4, 2]
+    assert sum((part.column('employee_id').to_pylist() for part in parts), []) == list(range(10))
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError, match='Неизвестный формат'):
+        get_artifact_store('/tmp', 'csv')
@@ -0,0 +1,72 @@
+"""
+Вложения письма: сжатие файлов отчета и лимит размера письма
+с учетом base64 и заголовков MIME
+"""
+
+import os
+import zipfile
+
+import pytest
+
+from retention.attachments import encoded_size, pack_files, plan_attachments
+from retention.notifications import build_message
+
+
+def write(path, size):
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def message(files=()):
+    return {'subject': 'report', 'recipients': ['a@example.com'], 'html_content': '<p>ok</p>', 'files': list(files)}
+
+
+@pytest.mark.parametrize('sizes', [[0], [1], [57], [1000, 1], [123457, 4096, 77]])
+def test_encoded_size_bounds_message_growth(tmp_path, sizes):
+    archives = pack_files([write(tmp_path / f"part_{n}.csv", size) for n, size in enumerate(sizes)], str(tmp_path), 'none')
+
+    base = len(build_message(message(), 'airflow@example.com'))
+    full = len(build_message(message(archive['path'] for archive in archives), 'airflow@example.com'))
+
+    estimate = sum(map(encoded_size, archives))
+    assert full - base <= estimate
+    # Оценка не слишком грубая: запас - заголовки частей, а не треть размера
+    assert estimate - (full - base) <= 512 * len(archives)
+
+
+def test_plan_attachments_caps_encoded_size(tmp_path):
+    archives = pack_files([write(tmp_path / f"{name}.csv", 30000) for name in 'abc'], str(tmp_path), 'none')
+    # Сырые байты всех трех файлов помещаются в лимит, закодированные - только двух
+    limit = sum(archive['bytes'] for archive in archives)
+    assert 2 * encoded_size(archives[0]) <= limit < 3 * encoded_size(archives[0])
+
+    attached, linked, missing = plan_attachments(archives, limit, 'https://reports.example.com/', str(tmp_path))
+
+    assert [archive['name'] for archive in attached] == ['a.csv', 'b.csv']
+    assert [archive['link'] for archive in linked] == ['https://reports.example.com/c.csv']
+    assert missing == []
+    mail = build_message(message(archive['path'] for archive in attached), 'airflow@example.com')
+    assert len(mail) - len(build_message(message(), 'airflow@example.com')) <= limit
+
+
+def test_plan_attachments_returns_missing_archives(tmp_path):
+    archives = pack_files([write(tmp_path / 'report.txt', 100)], str(tmp_path), 'gzip')
+    gone = dict(archives[0], name='gone.gz', path=str(tmp_path / 'gone.gz'))
+
+    attached, linked, missing = plan_attachments([gone] + archives, 10 ** 6)
+
+    assert attached == archives
+    assert linked == []
+    assert missing == [gone]
+
+
+def test_pack_files_zip_keeps_file_names(tmp_path):
+    paths = [write(tmp_path / 'report.txt', 500), write(tmp_path / 'data.csv', 700)]
+
+    archive, = pack_files(paths + [str(tmp_path / 'absent.csv')], str(tmp_path), 'zip', 'department')
+
+    assert archive['name'] == 'department.zip'
+    assert archive['source_bytes'] == 1200
+    assert archive['files'] == ['report.txt', 'data.csv']
+    with zipfile.ZipFile(archive['path']) as packed:
+        assert sorted(packed.namelist()) == ['data.csv', 'report.txt']
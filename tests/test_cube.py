@@ -0,0 +1,62 @@
+"""
+Свертка куба агрегатов по периодам: ячейки последней даты запуска периода,
+без сложения кумулятивных снимков разных дат
+"""
+
+import pytest
+
+from retention.cube import CUBE_COLUMNS, CUBE_DDL, CUBE_KEY, cube_query, cube_rows, period_label, rollup_cube
+from retention.warehouse import get_backend
+
+
+@pytest.fixture(params=['sqlite', 'duckdb'])
+def backend(request, tmp_path):
+    if request.param == 'duckdb':
+        pytest.importorskip('duckdb')
+    backend = get_backend(f"{request.param}:///{tmp_path / 'warehouse.db'}")
+    backend.ensure_schema(CUBE_DDL)
+    yield backend
+    backend.close()
+
+
+def load(backend, analysis_date, cube, period='month'):
+    backend.upsert_partition(
+        'retention_cube', CUBE_COLUMNS, CUBE_KEY,
+        cube_rows(analysis_date, period_label(analysis_date, period), cube),
+        partition={'analysis_date': analysis_date},
+    )
+
+
+def test_period_label():
+    assert period_label('2024-10-02') == '2024-10-02'
+    assert period_label('2024-10-02', 'week') == '2024-W40'
+    assert period_label('2024-10-02', 'month') == '2024-10'
+    assert period_label('2024-10-02', 'quarter') == '2024-Q4'
+    assert period_label('2024-10-02', 'year') == '2024'
+    with pytest.raises(ValueError):
+        period_label('2024-10-02', 'decade')
+
+
+def test_by_period_takes_latest_date_of_each_period(backend, make_sources):
+    # Снимок источников накапливается: каждая следующая дата содержит больше строк обучения
+    employees_df, training_df, courses_df = make_sources(training_rows=3000, seed=6)
+    snapshots = {
+        '2024-09-10': 1000, '2024-09-28': 1500, '2024-10-01': 2000, '2024-10-15': 2500, '2024-10-30': 3000,
+    }
+    cubes = {}
+    for analysis_date, rows in snapshots.items():
+        cubes[analysis_date] = rollup_cube(employees_df, training_df.iloc[:rows], courses_df)
+        load(backend, analysis_date, cubes[analysis_date])
+
+    query, params = cube_query(['analysis_date', 'period', 'total_records'], 'total', by_period=True)
+    rows = sorted(backend.iter_rows(query, params), key=lambda row: row[1])
+
+    expected = [
+        ('2024-09-28', '2024-09', int(cubes['2024-09-28']['total_records'].iloc[-1])),
+        ('2024-10-30', '2024-10', int(cubes['2024-10-30']['total_records'].iloc[-1])),
+    ]
+    assert [(str(date), period, records) for date, period, records in rows] == expected
+
+    # Диапазон дат ограничивает и выбор последней даты периода
+    query, params = cube_query(['analysis_date'], 'total', date_to='2024-10-20', by_period=True)
+    assert sorted(str(date) for date, in backend.iter_rows(query, params)) == ['2024-09-28', '2024-10-15']
@@ -0,0 +1,58 @@
+"""
+Зависимости задач DAG по исходному тексту файла (без Airflow): связи
+задаются цепочками оператора >> на уровне модуля
+"""
+
+import ast
+import os
+
+DAG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dags',
+                        'mobile_apps_retention_dag.py')
+
+
+def _operands(node):
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.RShift):
+        return _operands(node.left) + _operands(node.right)
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [[element.id for element in node.elts]]
+    return [[node.id]]
+
+
+def dag_edges():
+    """
+    Пары (переменная задачи выше, переменная задачи ниже) из цепочек a >> b >> c
+    """
+    with open(DAG_PATH, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    edges = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.BinOp) \
+                and isinstance(node.value.op, ast.RShift):
+            operands = _operands(node.value)
+            for upstream, downstream in zip(operands, operands[1:]):
+                edges.update((a, b) for a in upstream for b in downstream)
+    return edges
+
+
+def test_transform_runs_when_partition_mapping_is_empty():
+    # При пустом списке разделов transform_partition пропускается целиком;
+    # прямая связь с plan_transform_partitions дает transform_data успешного предка
+    edges = dag_edges()
+    assert ('plan_partitions_task', 'partition_tasks') in edges
+    assert ('partition_tasks', 'transform_task') in edges
+    assert ('plan_partitions_task', 'transform_task') in edges
+
+
+def test_pipeline_order():
+    edges = dag_edges()
+    for extract in ('extract_apps_task', 'extract_installs_task', 'extract_uninstalls_task'):
+        assert ('choose_mode_task', extract) in edges
+        assert (extract, 'validate_task') in edges
+    for edge in [('validate_task', 'plan_partitions_task'), ('transform_task', 'load_task'),
+                 ('load_task', 'report_task'), ('report_task', 'email_task'), ('fused_task', 'email_task')]:
+        assert edge in edges
+
+
+def test_cleanup_runs_after_notifications():
+    edges = dag_edges()
+    assert {('deliver_task', 'cleanup_task'), ('email_task', 'cleanup_task')} & edges
@@ -0,0 +1,107 @@
+"""
+Совпадение быстрых расчетов статистики по отделам с эталоном
+merge_department_stats (два pd.merge и groupby)
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from retention.cube import cube_cells, rollup_cube
+from retention.join_engine import department_stats, merge_department_stats
+from retention.out_of_core import chunked_department_stats
+
+STAT_COLUMNS = ['department', 'total_employees', 'total_courses', 'avg_score']
+
+
+def assert_same_stats(actual, expected):
+    # Отдел бывает category: сортировка по тексту, а не по порядку категорий
+    actual, expected = (
+        frame[STAT_COLUMNS].astype({'department': object}).sort_values('department').reset_index(drop=True)
+        for frame in (actual, expected)
+    )
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def chunks(df, rows):
+    return (df.iloc[start:start + rows] for start in range(0, len(df), rows))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_department_stats_matches_merge(make_sources, seed):
+    employees_df, training_df, courses_df = make_sources(seed=seed)
+
+    assert_same_stats(
+        department_stats(employees_df, training_df, courses_df),
+        merge_department_stats(employees_df, training_df, courses_df),
+    )
+
+
+# Бюджет памяти определяет способ подсчета уникальных сотрудников:
+# битовая карта пар, буфер пар в памяти или сброс буфера на диск. Редкие
+# идентификаторы сотрудников делают битовую карту больше бюджета
+@pytest.mark.parametrize('memory_bytes, bitmap, spilled', [
+    (64 * 1024 * 1024, True, False),
+    (400 * 1024, False, False),
+    (1024, False, True),
+])
+def test_chunked_department_stats_matches_merge(make_sources, tmp_path, memory_bytes, bitmap, spilled):
+    employees_df, training_df, courses_df = make_sources(training_rows=3000, id_step=1000)
+
+    stats, info = chunked_department_stats(
+        employees_df, courses_df, chunks(training_df, 400), memory_bytes, spill_root=str(tmp_path),
+    )
+
+    assert_same_stats(stats, merge_department_stats(employees_df, training_df, courses_df))
+    assert info['chunks'] == 8
+    assert info['rows'] == len(training_df)
+    assert info['bitmap'] is bitmap
+    assert (info['spills'] > 0) is spilled
+    # Файлы сброса удаляются вместе с временным каталогом
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rollup_cube_department_cells_match_merge(make_sources):
+    employees_df, training_df, courses_df = make_sources(seed=3)
+
+    cells = cube_cells(rollup_cube(employees_df, training_df, courses_df), 'department')
+
+    assert_same_stats(
+        cells.rename(columns={'total_records': 'total_courses'}),
+        merge_department_stats(employees_df, training_df, courses_df),
+    )
+
+
+def test_rollup_cube_department_course_cells_match_merge(make_sources):
+    employees_df, training_df, courses_df = make_sources(seed=4)
+    merged = employees_df.merge(training_df, on='employee_id').merge(courses_df, on='course_id')
+    expected = merged.groupby(['department', 'course_id'], observed=True).agg(
+        total_employees=('employee_id', 'nunique'),
+        total_records=('course_id', 'count'),
+        avg_score=('score', 'mean'),
+    ).reset_index()
+    expected['avg_score'] = expected['avg_score'].round(2)
+
+    cells = cube_cells(rollup_cube(employees_df, training_df, courses_df), 'department_course')
+    cells = cells[cells['total_records'] > 0]
+
+    key = ['department', 'course_id']
+    actual = cells[key + ['total_employees', 'total_records', 'avg_score']].astype({'department': object})
+    expected = expected.astype({'department': object})
+    pd.testing.assert_frame_equal(
+        actual.sort_values(key).reset_index(drop=True),
+        expected.sort_values(key).reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_rollup_cube_total_cell(make_sources):
+    employees_df, training_df, courses_df = make_sources(seed=5)
+    merged = employees_df.merge(training_df, on='employee_id').merge(courses_df, on='course_id')
+
+    total, = cube_cells(rollup_cube(employees_df, training_df, courses_df), 'total').itertuples()
+
+    assert total.total_employees == merged['employee_id'].nunique()
+    assert total.total_records == len(merged)
+    assert total.avg_score == pytest.approx(round(merged['score'].mean(), 2))
+    assert np.isclose(total.score_sum, merged['score'].sum())
@@ -0,0 +1,62 @@
+"""
+Кэш этапов по ключу входов и очистка каталогов запусков staging
+"""
+
+import os
+import time
+
+import pandas as pd
+
+from retention.artifacts import RUN_MARKER, get_artifact_store
+from retention.fingerprint import SourceCache, inputs_key
+
+
+def test_stage_entries_are_kept_per_key(tmp_path):
+    # Два запуска с разными входами не затирают результаты друг друга
+    cache = SourceCache(str(tmp_path))
+    backfill, scheduled = inputs_key('2024-09-01'), inputs_key('2024-10-01')
+
+    cache.save_stage('transform', backfill, [{'department': 'IT'}])
+    cache.save_stage('transform', scheduled, [{'department': 'HR'}])
+
+    assert cache.stage_result('transform', backfill) == [{'department': 'IT'}]
+    assert cache.stage_result('transform', scheduled) == [{'department': 'HR'}]
+    assert cache.stage_result('transform', inputs_key('other')) is None
+    assert not [name for name in os.listdir(tmp_path / 'stage_transform') if name.endswith('.tmp')]
+
+
+def test_stage_keeps_recently_used_entries(tmp_path):
+    cache = SourceCache(str(tmp_path))
+    keys = [inputs_key(n) for n in range(4)]
+    for n, key in enumerate(keys[:3]):
+        cache.save_stage('load', key, {'rows': n}, keep=3)
+        os.utime(tmp_path / 'stage_load' / f"{key}.json", (n, n))
+
+    # Использованная запись становится новой, вытесняется самая давно использованная
+    assert cache.stage_result('load', keys[0]) == {'rows': 0}
+    cache.save_stage('load', keys[3], {'rows': 3}, keep=3)
+
+    assert cache.stage_result('load', keys[1]) is None
+    assert [cache.stage_result('load', key) for key in (keys[0], keys[2], keys[3])] == [
+        {'rows': 0}, {'rows': 2}, {'rows': 3},
+    ]
+
+
+def test_prune_runs_keeps_referenced_and_recent_runs(tmp_path):
+    staging = tmp_path / 'staging'
+    store = get_artifact_store(str(staging), 'arrow')
+    frame = pd.DataFrame({'value': [1, 2, 3]})
+    manifests = {run_id: store.write(frame, 'training', run_id) for run_id in ('old', 'cached', 'current', 'recent')}
+    cache = SourceCache(str(staging / 'cache'))
+    cache.save_stage('validate', inputs_key('cached'), {'training': manifests['cached']})
+    # Каталоги, не созданные хранилищем артефактов, не удаляются
+    (staging / 'dept_state').mkdir()
+    past = time.time() - 10 * 24 * 3600
+    for name in ('old', 'cached', 'current', 'dept_state'):
+        os.utime(staging / name, (past, past))
+
+    removed = store.prune_runs(cache.referenced_paths(), 7 * 24 * 3600, keep_run_ids=['current'])
+
+    assert removed == [str(staging / 'old')]
+    assert sorted(os.listdir(staging)) == ['cache', 'cached', 'current', 'dept_state', 'recent']
+    assert (staging / 'cached' / RUN_MARKER).exists()
@@ -0,0 +1,337 @@
+"""
+Отправка писем retention.notifications через локальный SMTP-сервер на asyncio:
+EHLO, STARTTLS, AUTH, DATA, повторы и outbox
+"""
+
+import asyncio
+import base64
+import email
+import shutil
+import ssl
+import subprocess
+import threading
+from email.policy import default as default_policy
+
+import pytest
+
+from retention import notifications
+from retention.notifications import OUTBOX_DDL, SmtpSettings, deliver_outbox, dispatch, enqueue
+from retention.warehouse import get_backend
+
+USER, PASSWORD = 'airflow', 'secret'
+RECIPIENTS = ['a@example.com', 'b@example.com']
+
+
+class _StubSession(asyncio.Protocol):
+    """
+    Одно SMTP-соединение сервера-заглушки
+    """
+
+    def __init__(self, stub):
+        self.stub = stub
+        self.transport = None
+        self.buffer = b''
+        self.tls = False
+        self.authenticated = False
+        self.sender = None
+        self.recipients = []
+        self.data = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.stub.connections += 1
+        self.reply(220, 'stub ESMTP')
+
+    def reply(self, code, *texts):
+        lines = [f"{code}-{text}" for text in texts[:-1]] + [f"{code} {texts[-1]}"]
+        self.transport.write(''.join(line + '\r\n' for line in lines).encode('utf-8'))
+
+    def data_received(self, data):
+        self.buffer += data
+        while b'\r\n' in self.buffer and self.transport.is_reading():
+            line, self.buffer = self.buffer.split(b'\r\n', 1)
+            if self.data is not None:
+                self.data_line(line)
+            else:
+                self.command(line.decode('utf-8'))
+
+    def command(self, line):
+        self.stub.commands.append(line)
+        verb, _, arg = line.partition(' ')
+        verb = verb.upper()
+        if verb == 'EHLO':
+            extensions = ['stub']
+            if self.stub.tls_context is not None and not self.tls:
+                extensions.append('STARTTLS')
+            if self.stub.auth:
+                extensions.append('AUTH PLAIN')
+            self.reply(250, *extensions)
+        elif verb == 'STARTTLS':
+            # Чтение останавливается до рукопожатия: следующие байты - уже TLS
+            self.transport.pause_reading()
+            self.reply(220, 'go ahead')
+            asyncio.ensure_future(self.start_tls())
+        elif verb == 'AUTH':
+            mechanism, _, token = arg.partition(' ')
+            expected = base64.b64encode(f"\0{USER}\0{PASSWORD}".encode('utf-8')).decode('ascii')
+            self.authenticated = mechanism.upper() == 'PLAIN' and token == expected
+            self.reply(*((235, 'ok') if self.authenticated else (535, 'bad credentials')))
+        elif verb == 'MAIL':
+            if self.stub.tls_context is not None and not self.tls:
+                self.reply(530, 'STARTTLS required')
+            elif self.stub.auth and not self.authenticated:
+                self.reply(530, 'authentication required')
+            else:
+                self.sender, self.recipients = _address(arg), []
+                self.reply(250, 'ok')
+        elif verb == 'RCPT':
+            address = _address(arg)
+            code = self.stub.refuse.get(address)
+            if code:
+                self.reply(code, 'refused')
+            else:
+                self.recipients.append(address)
+                self.reply(250, 'ok')
+        elif verb == 'DATA':
+            if not self.recipients:
+                self.reply(554, 'no valid recipients')
+            else:
+                self.data = []
+                self.reply(354, 'end with <CRLF>.<CRLF>')
+        elif verb == 'RSET':
+            self.sender, self.recipients = None, []
+            self.reply(250, 'ok')
+        elif verb == 'NOOP':
+            self.reply(250, 'ok')
+        elif verb == 'QUIT':
+            self.reply(221, 'bye')
+            self.transport.close()
+        else:
+            self.reply(502, 'command not implemented')
+
+    def data_line(self, line):
+        if line != b'.':
+            self.data.append(line[1:] if line.startswith(b'.') else line)
+            return
+        mail = email.message_from_bytes(b'\r\n'.join(self.data) + b'\r\n', policy=default_policy)
+        self.data = None
+        self.stub.attempts.append(mail)
+        subject = mail['Subject']
+        if self.stub.drop.get(subject):
+            self.stub.drop[subject] -= 1
+            self.transport.abort()
+        elif self.stub.defer.get(subject):
+            self.stub.defer[subject] -= 1
+            self.reply(451, 'try again later')
+        else:
+            self.stub.messages.append((self.sender, list(self.recipients), mail))
+            self.reply(250, 'queued')
+
+    async def start_tls(self):
+        loop = asyncio.get_running_loop()
+        self.transport = await loop.start_tls(self.transport, self, self.stub.tls_context, server_side=True)
+        self.tls = True
+
+
+def _address(arg):
+    return arg.split(':', 1)[1].split()[0].strip('<>')
+
+
+class SmtpStub:
+    """
+    SMTP-сервер на asyncio в отдельном потоке. defer и drop - число ответов
+    451 и обрывов соединения после DATA по теме письма, refuse - код отказа
+    RCPT по адресу; attempts - все полученные DATA, messages - принятые письма
+    """
+
+    def __init__(self, tls_context=None, auth=False):
+        self.tls_context = tls_context
+        self.auth = auth
+        self.connections = 0
+        self.commands, self.attempts, self.messages = [], [], []
+        self.defer, self.drop, self.refuse = {}, {}, {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(self._serve(), self.loop).result()
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def _serve(self):
+        return await self.loop.create_server(lambda: _StubSession(self), '127.0.0.1', 0)
+
+    def settings(self, **options):
+        options.setdefault('sender', 'airflow@example.com')
+        options.setdefault('timeout', 5)
+        return SmtpSettings(host='127.0.0.1', port=self.port, **options)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+@pytest.fixture(scope='session')
+def certificate(tmp_path_factory):
+    if shutil.which('openssl') is None:
+        pytest.skip('нужен openssl для самоподписанного сертификата')
+    directory = tmp_path_factory.mktemp('tls')
+    cert, key = directory / 'cert.pem', directory / 'key.pem'
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=localhost', '-addext', 'subjectAltName=IP:127.0.0.1',
+         '-keyout', str(key), '-out', str(cert)],
+        check=True, capture_output=True,
+    )
+    return str(cert), str(key)
+
+
+@pytest.fixture
+def tls_stub(certificate):
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(*certificate)
+    stub = SmtpStub(tls_context=server_context, auth=True)
+    stub.client_context = ssl.create_default_context(cafile=certificate[0])
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def stub():
+    stub = SmtpStub()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(notifications, 'SMTP_RETRY_DELAY', 0)
+    monkeypatch.setattr(notifications, 'OUTBOX_RETRY_DELAY', 0)
+
+
+def make_message(n, recipients=RECIPIENTS, **fields):
+    message = {
+        'message_id': f"retention/run/{n}",
+        'recipients': recipients,
+        'subject': f"report {n}",
+        'html_content': f"<p>{n}</p>\n.dot line\n",
+        'files': [],
+    }
+    message.update(fields)
+    return message
+
+
+def test_starttls_auth_and_connection_reuse(tls_stub):
+    settings = tls_stub.settings(starttls=True, user=USER, password=PASSWORD, context=tls_stub.client_context)
+    messages = [make_message(n) for n in range(5)]
+
+    results = dispatch(messages, settings, connections=2)
+
+    assert {result['status'] for result in results.values()} == {'sent'}
+    assert all(result['attempts'] == 1 for result in results.values())
+    # Два соединения на пять писем, на каждом EHLO до и после STARTTLS и одна AUTH
+    assert tls_stub.connections == 2
+    assert sum(command.upper().startswith('EHLO') for command in tls_stub.commands) == 4
+    assert sum(command.upper() == 'STARTTLS' for command in tls_stub.commands) == 2
+    assert sum(command.startswith('AUTH PLAIN') for command in tls_stub.commands) == 2
+
+    received = sorted(tls_stub.messages, key=lambda item: item[2]['Subject'])
+    assert [mail['Subject'] for _, _, mail in received] == [f"report {n}" for n in range(5)]
+    for sender, recipients, mail in received:
+        assert sender == 'airflow@example.com'
+        assert recipients == RECIPIENTS
+        assert '\n.dot line' in mail.get_content()
+
+
+def test_attachments_are_sent(stub, tmp_path):
+    archive = tmp_path / 'report.zip'
+    archive.write_bytes(b'PK\x03\x04 archive')
+
+    results = dispatch([make_message(0, files=[str(archive)])], stub.settings())
+
+    assert results['retention/run/0']['status'] == 'sent'
+    (_, _, mail), = stub.messages
+    attachment, = mail.iter_attachments()
+    assert attachment.get_filename() == 'report.zip'
+    assert attachment.get_content() == b'PK\x03\x04 archive'
+
+
+def test_transient_reply_is_retried_with_same_message_id(stub):
+    stub.defer['report 0'] = 2
+
+    result = dispatch([make_message(0)], stub.settings(), retries=3)['retention/run/0']
+
+    assert result == {'status': 'sent', 'attempts': 3, 'error': None}
+    assert len(stub.attempts) == 3
+    assert len({mail['Message-ID'] for mail in stub.attempts}) == 1
+    assert len(stub.messages) == 1
+
+
+def test_dropped_connection_is_retried_on_new_connection(stub):
+    stub.drop['report 0'] = 1
+
+    results = dispatch([make_message(0), make_message(1)], stub.settings(), connections=1)
+
+    assert results['retention/run/0'] == {'status': 'sent', 'attempts': 2, 'error': None}
+    assert results['retention/run/1']['status'] == 'sent'
+    assert stub.connections == 2
+
+
+def test_transient_errors_after_all_retries_are_deferred(stub):
+    stub.defer['report 0'] = 10
+
+    result = dispatch([make_message(0)], stub.settings(), retries=2)['retention/run/0']
+
+    assert result['status'] == 'deferred'
+    assert result['attempts'] == 3
+    assert result['error'].startswith('451')
+
+
+def test_permanent_errors_are_not_retried(stub):
+    stub.refuse = {'a@example.com': 550, 'b@example.com': 550, 'c@example.com': 550}
+
+    results = dispatch(
+        [make_message(0), make_message(1, recipients=['c@example.com', 'd@example.com'])],
+        stub.settings(), connections=1,
+    )
+
+    assert results['retention/run/0']['status'] == 'failed'
+    assert results['retention/run/0']['attempts'] == 1
+    # Письмо уходит принявшим получателям, отказы записываются в error
+    assert results['retention/run/1']['status'] == 'sent'
+    assert results['retention/run/1']['error'].startswith('c@example.com: 550')
+    (_, recipients, _), = stub.messages
+    assert recipients == ['d@example.com']
+    assert stub.connections == 1
+
+
+def test_rejected_credentials_fail_without_retry(tls_stub):
+    settings = tls_stub.settings(starttls=True, user=USER, password='wrong', context=tls_stub.client_context)
+
+    result = dispatch([make_message(0)], settings)['retention/run/0']
+
+    assert result['status'] == 'failed'
+    assert result['attempts'] == 1
+    assert result['error'].startswith('535')
+    assert tls_stub.attempts == []
+
+
+def test_outbox_keeps_message_id_between_attempts(stub, tmp_path):
+    backend = get_backend(f"sqlite:///{tmp_path / 'outbox.db'}")
+    backend.ensure_schema(OUTBOX_DDL)
+    message = make_message(0)
+    enqueue(backend, [message])
+    # Все повторы первого запуска получают 451: письмо откладывается
+    stub.defer['report 0'] = notifications.SMTP_RETRIES + 1
+
+    assert deliver_outbox(backend, stub.settings()) == {'pending': 1, 'sent': 0, 'failed': 0}
+
+    # Повторная запись того же письма (повтор задачи) не меняет его Message-ID
+    enqueue(backend, [message])
+    assert deliver_outbox(backend, stub.settings()) == {'pending': 0, 'sent': 1, 'failed': 0}
+    assert len({mail['Message-ID'] for mail in stub.attempts}) == 1
+
+    # Отправленное письмо не отправляется снова, даже если его записали еще раз
+    enqueue(backend, [message])
+    assert deliver_outbox(backend, stub.settings()) == {'pending': 0, 'sent': 0, 'failed': 0}
+    assert len(stub.messages) == 1
@@ -0,0 +1,111 @@
+"""
+Реестр схем источников: приведение к компактным типам и отклонение
+строк с кодом причины первой неподходящей колонки
+"""
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from retention.schemas import SCHEMA_VERSION, get_schema, rejected_summary
+
+
+def test_conform_keeps_compact_types():
+    schema = get_schema('training')
+    df = pd.DataFrame({'employee_id': [1, 2], 'course_id': [10, 20], 'score': [90.0, None]})
+
+    table, rejected = schema.conform(df)
+
+    assert rejected is None
+    assert table.schema == schema.arrow_schema
+    assert table.column('score').to_pylist() == [90, None]
+    assert table.schema.field('employee_id').type == pa.int32()
+
+
+def test_conform_rejects_rows_with_reason_of_first_bad_column():
+    schema = get_schema('training')
+    df = pd.DataFrame({
+        'employee_id': [1, None, 'x', 3, 2 ** 40, 5, 6],
+        'course_id': [10, 'y', 10, 10.5, 10, 10, 10],
+        'score': [50, 60, 70, 80, 90, 300, -1],
+    })
+
+    table, rejected = schema.conform(df, 'training_01.xlsx')
+
+    assert table.num_rows == 1
+    assert table.to_pylist() == [{'employee_id': 1, 'course_id': 10, 'score': 50}]
+    assert rejected['reason'].tolist() == [
+        'null:employee_id', 'type:employee_id', 'type:course_id', 'range:employee_id', 'range:score', 'range:score',
+    ]
+    # Отклоненные значения сохраняются текстом вместе с файлом
+    assert rejected.loc[1, 'employee_id'] == 'x'
+    assert rejected['employee_id'].isna().tolist()[0]
+    assert set(rejected['file']) == {'training_01.xlsx'}
+
+
+def test_string_columns_accept_numbers_and_nullability():
+    employees = get_schema('employees')
+    table, rejected = employees.conform(pd.DataFrame({
+        'employee_id': [1, 2], 'department': pd.Series([101, None], dtype=object),
+    }))
+
+    assert table.column('department').to_pylist() == ['101']
+    assert rejected['reason'].tolist() == ['null:department']
+
+    courses = get_schema('courses')
+    table, rejected = courses.conform(pd.DataFrame({'course_id': [1], 'course_name': [None]}))
+    assert rejected is None
+    assert table.column('course_name').to_pylist() == [None]
+
+
+def test_missing_column_and_unknown_source():
+    with pytest.raises(ValueError, match='нет колонок: score'):
+        get_schema('training').conform(pd.DataFrame({'employee_id': [1], 'course_id': [1]}))
+    with pytest.raises(ValueError, match='Неизвестный источник'):
+        get_schema('payments')
+
+
+def test_batch_from_columns_fast_path_and_fallback():
+    schema = get_schema('training')
+
+    batches, rejected = schema.batch_from_columns([[1, 2], [10, 20], [70, None]])
+    assert rejected is None
+    assert pa.Table.from_batches(batches).to_pylist()[1] == {'employee_id': 2, 'course_id': 20, 'score': None}
+
+    batches, rejected = schema.batch_from_columns([[1, 'bad'], [10, 20], [70, 80]], 'part.xlsx')
+    assert sum(batch.num_rows for batch in batches) == 1
+    assert rejected['reason'].tolist() == ['type:employee_id']
+
+
+def test_to_pandas_uses_categories():
+    schema = get_schema('employees')
+    table, _ = schema.conform(pd.DataFrame({'employee_id': [1, 2, 3], 'department': ['IT', 'HR', 'IT']}))
+
+    df = schema.to_pandas(table)
+
+    assert isinstance(df['department'].dtype, pd.CategoricalDtype)
+    assert df['employee_id'].dtype == 'int32'
+
+
+def test_describe_changes_with_schema_version(monkeypatch):
+    schema = get_schema('training')
+    before = schema.describe()
+
+    monkeypatch.setattr('retention.schemas.SCHEMA_VERSION', SCHEMA_VERSION + 1)
+
+    assert schema.describe() != before
+    assert before['columns'][2] == ['score', 'uint8', True, False]
+
+
+def test_rejected_summary_counts_reasons():
+    frames = [
+        pd.DataFrame({'reason': ['type:score', 'null:score']}),
+        None,
+        pd.DataFrame({'reason': ['type:score']}),
+    ]
+
+    rejected, reasons = rejected_summary(frames)
+
+    assert len(rejected) == 3
+    assert reasons == {'null:score': 1, 'type:score': 2}
+    assert rejected_summary([None]) == (None, {})
@@ -0,0 +1,112 @@
+"""
+Извлечение источника из шардов: поиск файлов, упорядоченное слияние
+в пуле процессов и политика отклоненных строк
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from retention.artifacts import get_artifact_store
+from retention.schemas import get_schema
+from retention.shards import extract_source, resolve_source
+
+
+def write_shards(directory, parts):
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, df in parts.items():
+        path = directory / name
+        df.to_csv(path, index=False)
+        paths.append(str(path))
+    return paths
+
+
+def employee_shards(count=4, rows=50):
+    return {
+        f"part-{n:02d}.csv": pd.DataFrame({
+            'employee_id': range(n * rows + 1, (n + 1) * rows + 1),
+            'department': ['IT', 'HR'] * (rows // 2),
+        })
+        for n in reversed(range(count))
+    }
+
+
+def test_resolve_source_by_file_directory_and_glob(tmp_path):
+    (tmp_path / 'courses.json').write_text('[]')
+    write_shards(tmp_path / 'employees', employee_shards(3))
+    (tmp_path / 'employees' / '.hidden.csv').write_text('')
+    (tmp_path / 'employees' / 'notes.txt').write_text('')
+
+    assert resolve_source(str(tmp_path), 'courses.json', '.json') == [str(tmp_path / 'courses.json')]
+    # Нет employees.csv - берется каталог employees/, файлы по имени
+    expected = [str(tmp_path / 'employees' / f"part-{n:02d}.csv") for n in range(3)]
+    assert resolve_source(str(tmp_path), 'employees.csv', '.csv') == expected
+    assert resolve_source(str(tmp_path), 'employees/part-0[12].csv', '.csv') == expected[1:]
+    with pytest.raises(FileNotFoundError):
+        resolve_source(str(tmp_path), 'training.xlsx', '.xlsx')
+    with pytest.raises(FileNotFoundError):
+        resolve_source(str(tmp_path), 'employees/part-9*.csv', '.csv')
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_ordered_merge_follows_file_names(tmp_path, max_workers):
+    write_shards(tmp_path / 'employees', employee_shards())
+    paths = resolve_source(str(tmp_path), 'employees', '.csv')
+    store = get_artifact_store(str(tmp_path / 'staging'), 'arrow')
+
+    manifest = extract_source(
+        store, 'employees', f"run_{max_workers}", 'csv', paths, get_schema('employees'), max_workers=max_workers,
+    )
+
+    assert manifest['shards'] == 4
+    assert manifest['rows'] == 200
+    assert store.read(manifest)['employee_id'].tolist() == list(range(1, 201))
+    assert 'rejected' not in manifest
+
+
+def test_ordered_merge_checksum_is_reproducible(tmp_path):
+    paths = sorted(write_shards(tmp_path / 'employees', employee_shards()))
+    store = get_artifact_store(str(tmp_path / 'staging'), 'arrow')
+    schema = get_schema('employees')
+
+    sequential = extract_source(store, 'employees', 'one', 'csv', paths, schema, max_workers=1)
+    pooled = extract_source(store, 'employees', 'two', 'csv', paths, schema, max_workers=3)
+    unordered = extract_source(store, 'employees', 'three', 'csv', paths, schema, max_workers=3, ordered=False)
+
+    assert pooled['checksum'] == sequential['checksum']
+    assert sorted(store.read(unordered)['employee_id']) == list(range(1, 201))
+
+
+def bad_shards():
+    return {
+        'part-00.csv': pd.DataFrame({'employee_id': [1, 2], 'department': ['IT', 'HR']}),
+        'part-01.csv': pd.DataFrame({'employee_id': ['x', 4], 'department': ['IT', None]}),
+    }
+
+
+def test_rejected_rows_go_to_quarantine_artifact(tmp_path):
+    paths = sorted(write_shards(tmp_path / 'employees', bad_shards()))
+    store = get_artifact_store(str(tmp_path / 'staging'), 'arrow')
+
+    manifest = extract_source(store, 'employees', 'run', 'csv', paths, get_schema('employees'))
+
+    assert manifest['rows'] == 2
+    assert manifest['rejected']['rows'] == 2
+    assert manifest['rejected']['reasons'] == {'null:department': 1, 'type:employee_id': 1}
+    rejected = store.read(manifest['rejected']['manifest'])
+    assert set(rejected['file']) == {paths[1]}
+
+
+def test_fail_policy_leaves_no_artifact(tmp_path):
+    paths = sorted(write_shards(tmp_path / 'employees', bad_shards()))
+    store = get_artifact_store(str(tmp_path / 'staging'), 'arrow')
+
+    with pytest.raises(ValueError, match='не подходят под схему'):
+        extract_source(store, 'employees', 'run', 'csv', paths, get_schema('employees'), on_reject='fail')
+    with pytest.raises(ValueError, match='Неизвестная политика'):
+        extract_source(store, 'employees', 'run', 'csv', paths, get_schema('employees'), on_reject='skip')
+
+    run_dir = tmp_path / 'staging' / 'run'
+    assert not [name for name in os.listdir(run_dir) if not name.startswith('.')]
@@ -0,0 +1,68 @@
+"""
+Скетчи по отделам: слияние разделов одной даты и статистика за диапазон
+дат без повторного учета накопленных снимков
+"""
+
+import numpy as np
+import pytest
+
+from retention.sketches import (
+    SKETCH_COLUMNS, SKETCH_DDL, SKETCH_KEY, department_sketches, merge_sketch_records, sketch_records,
+    sketch_rows, sketch_stats,
+)
+from retention.warehouse import get_backend
+
+DATES = ['2024-10-01', '2024-10-02', '2024-10-03']
+
+
+def joined_by_department(employees_df, training_df, courses_df):
+    merged = employees_df.merge(training_df, on='employee_id').merge(courses_df, on='course_id')
+    return {str(department): rows for department, rows in merged.groupby('department', observed=True)}
+
+
+def test_partition_sketches_merge_to_whole(make_sources):
+    employees_df, training_df, courses_df = make_sources()
+    # Разделы режима mapped не пересекаются по сотрудникам
+    odd = training_df['employee_id'] % 2 == 1
+    partials = [
+        sketch_records(department_sketches(employees_df, training_df[mask], courses_df))
+        for mask in (odd, ~odd)
+    ]
+
+    merged = merge_sketch_records(*partials)
+    whole = department_sketches(employees_df, training_df, courses_df)
+
+    assert sorted(merged) == sorted(whole)
+    for department, sketch in whole.items():
+        assert merged[department].records == sketch.records
+        assert np.array_equal(merged[department].histogram, sketch.histogram)
+        assert np.array_equal(merged[department].registers, sketch.registers)
+
+
+def test_sketch_stats_use_latest_cumulative_snapshot(make_sources, tmp_path):
+    employees_df, training_df, courses_df = make_sources(training_rows=3000)
+    backend = get_backend(f"sqlite:///{tmp_path / 'warehouse.db'}")
+    backend.ensure_schema(SKETCH_DDL)
+    # Файл обучения - накопленная история: каждая дата видит все прошлые строки
+    snapshots = {date: training_df.iloc[:1000 * (n + 1)] for n, date in enumerate(DATES)}
+    for date, snapshot in snapshots.items():
+        records = sketch_records(department_sketches(employees_df, snapshot, courses_df))
+        backend.upsert_partition(
+            'department_sketches', SKETCH_COLUMNS, SKETCH_KEY, sketch_rows(date, records),
+            partition={'analysis_date': date},
+        )
+
+    for date_to in DATES[1:]:
+        expected = joined_by_department(employees_df, snapshots[date_to], courses_df)
+        stats = list(sketch_stats(backend, DATES[0], date_to))
+
+        assert [row[0] for row in stats] == sorted(expected)
+        for department, first_date, last_date, dates, records, distinct, median, p90 in stats:
+            rows = expected[department]
+            assert (first_date, last_date) == (DATES[0], date_to)
+            assert dates == DATES.index(date_to) + 1
+            assert records == len(rows)
+            assert distinct == pytest.approx(rows['employee_id'].nunique(), rel=0.05)
+            scores = rows['score'].dropna()
+            assert median == pytest.approx(scores.median(), abs=1)
+            assert p90 == pytest.approx(scores.quantile(0.9), abs=1)
@@ -0,0 +1,121 @@
+"""
+Пакетная загрузка в SQLite: upsert раздела, удаление устаревших строк,
+контрольные суммы и откат при расхождении
+"""
+
+import pytest
+
+from retention import sqlite_loader
+from retention.sqlite_loader import RowsChecksum, bulk_load, bulk_upsert, connect, table_checksum
+
+COLUMNS = [
+    ('analysis_date', 'TEXT'),
+    ('department', 'TEXT'),
+    ('total_employees', 'INTEGER'),
+    ('avg_score', 'REAL'),
+]
+KEY = ['analysis_date', 'department']
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = connect(str(tmp_path / 'results.db'))
+    conn.execute(
+        "CREATE TABLE results (analysis_date TEXT NOT NULL, department TEXT NOT NULL, "
+        "total_employees INTEGER NOT NULL, avg_score REAL)"
+    )
+    conn.execute("CREATE UNIQUE INDEX ux_results ON results (analysis_date, department)")
+    yield conn
+    conn.close()
+
+
+def rows(conn, date=None):
+    query = "SELECT analysis_date, department, total_employees, avg_score FROM results"
+    if date:
+        return conn.execute(query + " WHERE analysis_date = ? ORDER BY department", (date,)).fetchall()
+    return conn.execute(query + " ORDER BY analysis_date, department").fetchall()
+
+
+def test_connect_uses_wal(conn):
+    assert conn.execute("PRAGMA journal_mode").fetchone() == ('wal',)
+
+
+def test_bulk_upsert_updates_and_deletes_stale_rows_of_partition(conn):
+    bulk_upsert(conn, 'results', COLUMNS, KEY, [
+        ('2024-10-01', 'IT', 10, 80.0), ('2024-10-01', 'HR', 5, 70.0),
+    ], {'analysis_date': '2024-10-01'})
+    bulk_upsert(conn, 'results', COLUMNS, KEY, [
+        ('2024-10-02', 'IT', 11, 81.0), ('2024-10-02', 'HR', 6, 71.0), ('2024-10-02', 'Sales', 3, 60.0),
+    ], {'analysis_date': '2024-10-02'})
+
+    # Повторная загрузка раздела: IT обновлен, Sales удален, Finance добавлен
+    checksum = bulk_upsert(conn, 'results', COLUMNS, KEY, [
+        ('2024-10-02', 'IT', 12, 82.5), ('2024-10-02', 'HR', 6, 71.0), ('2024-10-02', 'Finance', 4, None),
+    ], {'analysis_date': '2024-10-02'})
+
+    assert rows(conn, '2024-10-02') == [
+        ('2024-10-02', 'Finance', 4, None), ('2024-10-02', 'HR', 6, 71.0), ('2024-10-02', 'IT', 12, 82.5),
+    ]
+    # Другой раздел не затронут
+    assert rows(conn, '2024-10-01') == [('2024-10-01', 'HR', 5, 70.0), ('2024-10-01', 'IT', 10, 80.0)]
+    assert checksum == {
+        'rows': 3, 'analysis_date': 30, 'department': len('ITHRFinance'), 'total_employees': 22, 'avg_score': 153.5,
+    }
+    assert sqlite_loader.checksums_match(
+        checksum, table_checksum(conn, 'results', COLUMNS, 'analysis_date = ?', ('2024-10-02',))
+    )
+
+
+def test_bulk_upsert_is_idempotent(conn):
+    batch = [('2024-10-02', 'IT', 12, 82.5), ('2024-10-02', 'HR', 6, 71.0)]
+    first = bulk_upsert(conn, 'results', COLUMNS, KEY, batch, {'analysis_date': '2024-10-02'})
+    second = bulk_upsert(conn, 'results', COLUMNS, KEY, iter(batch), {'analysis_date': '2024-10-02'})
+
+    assert first == second
+    assert len(rows(conn)) == 2
+
+
+def test_bulk_upsert_empty_load_clears_partition(conn):
+    bulk_upsert(conn, 'results', COLUMNS, KEY, [('2024-10-02', 'IT', 1, 1.0)], {'analysis_date': '2024-10-02'})
+
+    checksum = bulk_upsert(conn, 'results', COLUMNS, KEY, [], {'analysis_date': '2024-10-02'})
+
+    assert checksum['rows'] == 0
+    assert rows(conn) == []
+
+
+def test_checksum_mismatch_rolls_back(conn, monkeypatch):
+    bulk_upsert(conn, 'results', COLUMNS, KEY, [('2024-10-02', 'IT', 1, 1.0)], {'analysis_date': '2024-10-02'})
+    monkeypatch.setattr(sqlite_loader, 'checksums_match', lambda expected, actual: False)
+
+    with pytest.raises(ValueError, match='Проверка загрузки'):
+        bulk_upsert(conn, 'results', COLUMNS, KEY, [('2024-10-02', 'HR', 2, 2.0)], {'analysis_date': '2024-10-02'})
+    with pytest.raises(ValueError, match='Проверка загрузки'):
+        bulk_load(conn, 'results', COLUMNS, [('2024-10-03', 'HR', 2, 2.0)], replace=True)
+
+    assert rows(conn) == [('2024-10-02', 'IT', 1, 1.0)]
+    assert not conn.in_transaction
+
+
+def test_bulk_load_appends_or_replaces(conn):
+    bulk_load(conn, 'results', COLUMNS, [('2024-10-01', 'IT', 1, 1.0)])
+    bulk_load(conn, 'results', COLUMNS, [('2024-10-02', 'IT', 2, 2.0)])
+    assert len(rows(conn)) == 2
+
+    checksum = bulk_load(conn, 'results', COLUMNS, [('2024-10-03', 'HR', 3, 3.0)], replace=True)
+
+    assert rows(conn) == [('2024-10-03', 'HR', 3, 3.0)]
+    assert checksum['rows'] == 1
+
+
+def test_rows_checksum_matches_table_checksum(conn):
+    batch = [('2024-10-02', 'IT', 7, 0.1), ('2024-10-02', 'Отдел продаж', 3, None), ('2024-10-02', 'HR', 2, 0.2)]
+    checksum = RowsChecksum(COLUMNS)
+    conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?)", checksum.track(batch))
+
+    actual = table_checksum(conn, 'results', COLUMNS)
+
+    assert actual['rows'] == 3
+    assert actual['department'] == len('IT') + len('Отдел продаж') + len('HR')
+    assert sqlite_loader.checksums_match(checksum.as_dict(), actual)
+    assert not sqlite_loader.checksums_match(dict(checksum.as_dict(), avg_score=0.4), actual)
@@ -0,0 +1,104 @@
+"""
+Правила проверки данных: порядок причин отклонения, счетчики и строки
+карантина; битовая карта и сортировка дают одинаковые маски
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from retention import validation
+from retention.validation import _duplicated, _isin, quarantine_frame, quarantine_rows, validate_sources
+
+
+def sources():
+    employees_df = pd.DataFrame({'employee_id': [1, 2, 2, 3], 'department': ['IT', 'HR', 'HR', 'Sales']})
+    courses_df = pd.DataFrame({'course_id': [10, 20], 'course_name': ['SQL', 'Python']})
+    training_df = pd.DataFrame({
+        'employee_id': [1, 1, 2, 9, 3, 1, 9],
+        'course_id': [10, 20, 10, 10, 30, 10, 10],
+        'score': [80.0, np.nan, 150.0, 70.0, 60.0, 90.0, np.nan],
+    })
+    return employees_df, training_df, courses_df
+
+
+def test_rule_precedence_and_counts():
+    employees_df, training_df, courses_df = sources()
+
+    result = validate_sources(employees_df, training_df, courses_df)
+
+    training = result['training']
+    assert training.keep.tolist() == [True, False, False, False, False, False, False]
+    # Причина - первое нарушенное правило: строка 6 без оценки ссылается на
+    # отсутствующего сотрудника и повторяет пару строки 3, но ее причина - null:score
+    assert list(training.reasons) == [
+        'null:score', 'range:score', 'ref:employee_id', 'ref:course_id', 'dup:employee_id+course_id', 'null:score',
+    ]
+    # Счетчики учитывают каждое нарушение
+    assert training.counts == {
+        'null:score': 2, 'range:score': 1, 'ref:employee_id': 2, 'ref:course_id': 1,
+        'dup:employee_id+course_id': 2,
+    }
+    assert result['employees'].keep.tolist() == [True, True, False, True]
+    assert list(result['employees'].reasons) == ['dup:employee_id']
+    assert result['courses'].rejected_rows == 0
+
+
+def test_quarantine_rows_number_rows_per_source():
+    employees_df, training_df, courses_df = sources()
+    result = validate_sources(employees_df, training_df, courses_df)
+    frames = [
+        quarantine_frame(name, df[~result[name].keep], result[name].reasons, file=f"{name}.src")
+        for name, df in (('employees', employees_df), ('training', training_df), ('courses', courses_df))
+    ]
+
+    rows = list(quarantine_rows('2024-10-02', frames))
+
+    assert [(row[1], row[2], row[3]) for row in rows] == [
+        ('employees', 0, 'dup:employee_id'),
+        ('training', 0, 'null:score'),
+        ('training', 1, 'range:score'),
+        ('training', 2, 'ref:employee_id'),
+        ('training', 3, 'ref:course_id'),
+        ('training', 4, 'dup:employee_id+course_id'),
+        ('training', 5, 'null:score'),
+    ]
+    first = dict(zip([name for name, _ in validation.QUARANTINE_COLUMNS], rows[2]))
+    # Значения хранятся текстом, целая оценка - без дробной части; пропуск - NULL
+    assert (first['employee_id'], first['course_id'], first['score'], first['file']) == ('2', '10', '150', 'training.src')
+    assert dict(zip([name for name, _ in validation.QUARANTINE_COLUMNS], rows[1]))['score'] is None
+
+
+@pytest.mark.parametrize('step', [1, 10 ** 6])
+def test_bitmap_and_sort_paths_agree(monkeypatch, step):
+    rng = np.random.default_rng(7)
+    keys = np.unique(rng.integers(0, 5000, 3000)) * step
+    probe = rng.integers(0, 6000, 20000) * step
+    pairs = (rng.integers(0, 300, 20000) * step, rng.integers(0, 50, 20000))
+
+    fast = _isin(probe, keys), _duplicated(probe), _duplicated(*pairs)
+    monkeypatch.setattr(validation, 'BITMAP_BYTES', 0)
+    slow = _isin(probe, keys), _duplicated(probe), _duplicated(*pairs)
+
+    np.testing.assert_array_equal(fast[0], np.isin(probe, keys))
+    np.testing.assert_array_equal(fast[1], pd.Series(probe).duplicated().to_numpy())
+    np.testing.assert_array_equal(fast[2], pd.DataFrame({'a': pairs[0], 'b': pairs[1]}).duplicated().to_numpy())
+    for expected, actual in zip(fast, slow):
+        np.testing.assert_array_equal(expected, actual)
+
+
+def test_sparse_keys_skip_the_bitmap(monkeypatch):
+    # Диапазон в миллионы значений на несколько строк не выделяет карту такого размера
+    allocations = []
+    zeros = np.zeros
+
+    def tracked(shape, *args, **kwargs):
+        allocations.append(int(np.prod(shape)))
+        return zeros(shape, *args, **kwargs)
+
+    monkeypatch.setattr(validation.np, 'zeros', tracked)
+    probe = np.array([1, 50_000_000, 99_000_000], dtype=np.int64)
+
+    assert _isin(probe, np.array([1, 99_000_000])).tolist() == [True, False, True]
+    assert _duplicated(np.array([5, 90_000_000, 5])).tolist() == [False, False, True]
+    assert max(allocations) < 1000
@@ -0,0 +1,89 @@
+"""
+Пул соединений хранилища и подстановка плейсхолдеров диалекта
+"""
+
+from itertools import islice
+
+import pytest
+
+from retention.warehouse import ConnectionPool, PostgresBackend, get_backend
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_reuses_connection_after_success():
+    pool = ConnectionPool(FakeConnection, max_size=1)
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert second is first
+    assert not first.closed
+
+
+def test_pool_closes_connection_after_error():
+    pool = ConnectionPool(FakeConnection, max_size=1)
+
+    with pytest.raises(ValueError):
+        with pool.connection() as broken:
+            raise ValueError('boom')
+    with pool.connection() as fresh:
+        pass
+
+    assert broken.closed
+    assert fresh is not broken
+
+
+def test_pool_closes_connection_when_consumer_stops_early():
+    pool = ConnectionPool(FakeConnection, max_size=1)
+
+    def rows():
+        with pool.connection() as conn:
+            yield conn
+            yield conn
+
+    reader = rows()
+    conn = next(reader)
+    reader.close()
+
+    assert conn.closed
+    assert pool._idle.empty()
+
+
+def test_iter_rows_stopped_early_closes_connection(tmp_path):
+    backend = get_backend(f"sqlite:///{tmp_path / 'warehouse.db'}")
+    backend.execute("CREATE TABLE numbers (n INTEGER)")
+    backend.execute(
+        "WITH RECURSIVE s(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM s WHERE n < 100) "
+        "INSERT INTO numbers SELECT n FROM s"
+    )
+    try:
+        rows = backend.iter_rows("SELECT n FROM numbers ORDER BY n", batch_size=10)
+        assert [n for n, in islice(rows, 3)] == [1, 2, 3]
+        rows.close()
+
+        # Соединение с недочитанным курсором не возвращается в пул, слот освобожден
+        assert backend.pool._idle.empty()
+        assert list(backend.iter_rows("SELECT COUNT(*) FROM numbers")) == [(100,)]
+    finally:
+        backend.close()
+
+
+@pytest.mark.parametrize('query, expected', [
+    ("SELECT a FROM t WHERE x = ? AND y = ?", "SELECT a FROM t WHERE x = %s AND y = %s"),
+    ("SELECT '?' AS q, \"a?\" FROM t WHERE x = ?", "SELECT '?' AS q, \"a?\" FROM t WHERE x = %s"),
+    ("SELECT 'it''s ?' FROM t WHERE x = ?", "SELECT 'it''s ?' FROM t WHERE x = %s"),
+    ("SELECT a -- why?\nFROM t /* ? */ WHERE x = ?", "SELECT a -- why?\nFROM t /* ? */ WHERE x = %s"),
+])
+def test_postgres_placeholders_skip_literals(query, expected):
+    backend = PostgresBackend('postgresql://localhost/db')
+
+    assert backend.sql(query) == expected
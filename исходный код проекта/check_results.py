@@ -1,200 +1,529 @@
 #!/usr/bin/env python3
 """
-Скрипт для проверки результатов анализа в SQLite базе данных
-Работает как с локальной базой, так и с базой внутри Docker контейнера
+Скрипт для проверки результатов анализа в хранилище результатов.
+
+База открывается на месте только для чтения, без копирования из контейнера:
+SQLite - по URI file:...?mode=ro (каталог results/ смонтирован в контейнеры
+Airflow, см. docker-compose.yml), DuckDB - с read_only, Postgres - в read-only
+транзакциях. Каждая проверка - отдельный запрос по индексам таблицы
+retention_analysis: раздел за дату или диапазон дат, история отдела,
+первые N строк по среднему баллу. Строки выводятся по мере чтения
+пакетами, поэтому проверка не замедляется с ростом истории.
+Файлы отчета (--files) тоже читаются из смонтированного каталога results/.
+
+С --sketches статистика по отделам на последнюю дату периода (уникальные
+сотрудники, медиана и p90 оценок) берется из скетчей таблицы
+department_sketches (params sketches в DAG) без чтения сырых строк
+обучения, а с --cube выводятся
+готовые ячейки куба агрегатов retention_cube (params cube): по курсам,
+по отделам и курсам или итог. С --by-period ячейки куба сворачиваются
+по периодам (params cube_period): для каждого периода - последняя дата
+запуска в нем, ячейки разных дат не складываются.
 """
 
-import sqlite3
-import pandas as pd
+import argparse
+import csv
+import json
 import os
-import subprocess
 import sys
+from itertools import islice
 
-DB_PATH = 'mobile_apps_retention.db'
-CONTAINER_DB_PATH = '/opt/airflow/mobile_apps_retention.db'
+# Модули хранилища результатов лежат рядом с DAG
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dags'))
+from retention.warehouse import get_backend
 
-def check_docker_container():
-    """Проверка наличия запущенного контейнера scheduler"""
-    try:
-        result = subprocess.run(['sudo', 'docker', 'ps', '--format', '{{.Names}}'], 
-                              capture_output=True, text=True, check=True)
-        containers = result.stdout.strip().split('\n')
-        scheduler_containers = [c for c in containers if 'scheduler' in c]
-        return scheduler_containers[0] if scheduler_containers else None
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return None
-
-def copy_db_from_container(container_name):
-    """Копирование базы данных из контейнера на хост"""
-    try:
-        print(f"Копируем базу данных из контейнера {container_name}...")
-        subprocess.run([
-            'sudo', 'docker', 'cp', 
-            f'{container_name}:{CONTAINER_DB_PATH}', 
-            DB_PATH
-        ], check=True)
-        print("✅ База данных успешно скопирована из контейнера")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Ошибка при копировании базы данных: {e}")
-        return False
-
-def check_database():
-    """Проверка результатов в базе данных"""
-    
-    # Сначала проверяем локальную базу данных
-    if not os.path.exists(DB_PATH):
-        print(f"База данных {DB_PATH} не найдена локально!")
-        
-        # Пытаемся найти и скопировать из контейнера
-        container_name = check_docker_container()
-        if container_name:
-            print(f"Найден контейнер scheduler: {container_name}")
-            if not copy_db_from_container(container_name):
-                print("Не удалось скопировать базу данных из контейнера.")
-                print("\n🔧 Попробуйте выполнить вручную:")
-                print(f"sudo docker cp {container_name}:{CONTAINER_DB_PATH} {DB_PATH}")
-                return
-        else:
-            print("Контейнер scheduler не найден!")
-            print("Убедитесь, что DAG был выполнен успешно и контейнеры запущены.")
+# Каталог results/ смонтирован в контейнеры Airflow (/opt/airflow/results): база и файлы отчета
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+DB_PATH = os.path.join(RESULTS_DIR, 'mobile_apps_retention.db')
+
+# Окончания имен файлов отчета (retention.reports.ReportSpec.paths)
+REPORT_FILE_SUFFIXES = ('_report.txt', '_report.html', '_data.csv')
+
+# Хранилище результатов: по умолчанию SQLite база из смонтированного каталога results/
+WAREHOUSE_URL = os.environ.get('RETENTION_WAREHOUSE_URL', f'sqlite:///{DB_PATH}')
+
+# Строк в пакете при чтении результата запроса
+FETCH_BATCH_SIZE = 1000
+
+RESULT_COLUMNS = ['analysis_date', 'department', 'total_employees', 'total_courses', 'avg_score']
+DATE_COLUMNS = ['analysis_date', 'departments']
+QUARANTINE_COLUMNS = ['analysis_date', 'source', 'rule', 'row_count']
+
+# Колонки вывода ячеек куба по набору группировки: свернутые измерения не выводятся
+CUBE_MEASURE_COLUMNS = ['total_employees', 'total_records', 'avg_score']
+CUBE_OUTPUT_COLUMNS = {
+    'department_course': ['analysis_date', 'period', 'department', 'course_id', 'course_name'],
+    'department': ['analysis_date', 'period', 'department'],
+    'course': ['analysis_date', 'period', 'course_id', 'course_name'],
+    'total': ['analysis_date', 'period'],
+}
+
+# Колонки табличного вывода: (выравнивание и ширина, формат значения);
+# строки печатаются сразу, поэтому ширина не подбирается по данным
+TABLE_FORMATS = {
+    'analysis_date': ('<12', ''),
+    'department': ('<24', ''),
+    'total_employees': ('>15', ','),
+    'total_courses': ('>13', ','),
+    'avg_score': ('>9', '.2f'),
+    'departments': ('>11', ','),
+    'source': ('<10', ''),
+    'rule': ('<28', ''),
+    'row_count': ('>10', ','),
+    'first_date': ('<12', ''),
+    'last_date': ('<12', ''),
+    'dates': ('>6', ','),
+    'records': ('>10', ','),
+    'distinct_employees': ('>18', ','),
+    'score_median': ('>12', ''),
+    'score_p90': ('>9', ''),
+    'period': ('<10', ''),
+    'course_id': ('>9', 'd'),
+    'course_name': ('<24', ''),
+    'total_records': ('>13', ','),
+}
+
+# Наборы группировки куба (retention.cube.GROUPING_SETS): модуль куба импортируется только с --cube
+GROUPING_SET_CHOICES = ['department_course', 'department', 'course', 'total']
+
+EXPLAIN_PREFIX = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'duckdb': 'EXPLAIN ',
+    'postgresql': 'EXPLAIN ',
+}
+
+
+def read_only_url(url):
+    """
+    URL хранилища с параметром mode=ro
+    """
+    if 'mode=' in url:
+        return url
+    return f"{url}&mode=ro" if '?' in url else f"{url}?mode=ro"
+
+
+def date_filter(args, where, params):
+    """
+    Условия по разделам: одна дата или диапазон (используют индекс по analysis_date)
+    """
+    if args.date:
+        where.append("analysis_date = ?")
+        params.append(args.date)
+    if args.date_from:
+        where.append("analysis_date >= ?")
+        params.append(args.date_from)
+    if args.date_to:
+        where.append("analysis_date <= ?")
+        params.append(args.date_to)
+
+
+def results_query(args):
+    """
+    Запрос строк retention_analysis по фильтрам командной строки
+    """
+    where, params = [], []
+    date_filter(args, where, params)
+    if args.department:
+        # Индекс (department, analysis_date): история отдела без просмотра всех разделов
+        where.append(f"department IN ({', '.join('?' for _ in args.department)})")
+        params.extend(args.department)
+
+    direction = 'ASC' if args.worst else 'DESC'
+    query = f"""
+        SELECT {', '.join(RESULT_COLUMNS)}
+        FROM retention_analysis
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY avg_score {direction}, analysis_date DESC, department
+        """
+    if args.top:
+        query += "LIMIT ?"
+        params.append(args.top)
+    return query, params
+
+
+def dates_query(args):
+    """
+    Запрос списка разделов: количество отделов за каждую дату (покрывающий индекс)
+    """
+    where, params = [], []
+    date_filter(args, where, params)
+    query = f"""
+        SELECT analysis_date, COUNT(*) AS departments
+        FROM retention_analysis
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        GROUP BY analysis_date
+        ORDER BY analysis_date DESC
+        """
+    if args.top:
+        query += "LIMIT ?"
+        params.append(args.top)
+    return query, params
+
+
+def quarantine_query(args):
+    """
+    Запрос счетчиков правил проверки данных (таблица validation_counts)
+    """
+    where, params = [], []
+    date_filter(args, where, params)
+    query = f"""
+        SELECT {', '.join(QUARANTINE_COLUMNS)}
+        FROM validation_counts
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY analysis_date DESC, source, rule
+        """
+    return query, params
+
+
+def latest_date(backend, table='retention_analysis'):
+    """
+    Дата последнего раздела: MAX по первой колонке индекса читается без просмотра таблицы
+    """
+    with backend.connection() as conn:
+        row = conn.execute(f"SELECT MAX(analysis_date) FROM {table}").fetchone()
+    return None if row[0] is None else str(row[0])
+
+
+class TableWriter:
+    """
+    Вывод строк выровненными колонками по мере чтения
+    """
+
+    def __init__(self, out, columns):
+        self.out = out
+        self.columns = columns
+        self.row_format = ' '.join(
+            f"{{{i}:{TABLE_FORMATS[name][0]}{TABLE_FORMATS[name][1]}}}" for i, name in enumerate(columns)
+        )
+        # Дата из DuckDB и Postgres - объект date: выводится текстом
+        self.date_position = columns.index('analysis_date') if 'analysis_date' in columns else None
+        header = ' '.join(f"{name:{TABLE_FORMATS[name][0]}}" for name in columns)
+        self.out.write(header + '\n' + '-' * len(header) + '\n')
+
+    def rows(self, rows):
+        row_format = self.row_format
+        position = self.date_position
+        if position is None:
+            self.out.write(''.join(row_format.format(*row) + '\n' for row in rows))
             return
-    
+        self.out.write(''.join(
+            row_format.format(*row[:position], str(row[position]), *row[position + 1:]) + '\n'
+            for row in rows
+        ))
+
+
+class CsvWriter:
+    def __init__(self, out, columns):
+        self.writer = csv.writer(out)
+        self.writer.writerow(columns)
+
+    def rows(self, rows):
+        self.writer.writerows(rows)
+
+
+class JsonLinesWriter:
+    def __init__(self, out, columns):
+        self.out = out
+        self.columns = columns
+
+    def rows(self, rows):
+        self.out.write(''.join(
+            json.dumps(dict(zip(self.columns, row)), ensure_ascii=False, default=str) + '\n'
+            for row in rows
+        ))
+
+
+WRITERS = {'table': TableWriter, 'csv': CsvWriter, 'jsonl': JsonLinesWriter}
+
+
+class ResultsSummary:
+    """
+    Итоги выведенных строк, собираемые на лету: число строк, суммы, первая и последняя строки
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.total_employees = 0
+        self.total_courses = 0
+        self.first = None
+        self.last = None
+
+    def add(self, rows):
+        if self.first is None:
+            self.first = rows[0]
+        self.last = rows[-1]
+        self.rows += len(rows)
+        self.total_employees += sum(row[2] for row in rows)
+        self.total_courses += sum(row[3] for row in rows)
+
+
+def stream(backend, query, params, writer, summary=None):
+    """
+    Выполнение запроса и вывод строк пакетами по FETCH_BATCH_SIZE; возвращает число строк
+    """
+    return write_batches(backend.iter_rows(query, tuple(params), FETCH_BATCH_SIZE), writer, summary)
+
+
+def write_batches(rows, writer, summary=None):
+    """
+    Вывод строк итератора пакетами по FETCH_BATCH_SIZE; возвращает число строк
+    """
+    count = 0
+    while True:
+        batch = list(islice(rows, FETCH_BATCH_SIZE))
+        if not batch:
+            break
+        writer.rows(batch)
+        if summary is not None:
+            summary.add(batch)
+        count += len(batch)
+    return count
+
+
+def explain(backend, query, params):
+    """
+    План запроса: какие индексы использует проверка
+    """
+    with backend.connection() as conn:
+        cursor = conn.execute(backend.sql(EXPLAIN_PREFIX[backend.dialect] + query), tuple(params))
+        print("План запроса:")
+        for row in cursor.fetchall():
+            print('  ' + ' | '.join(str(value) for value in row))
+    print()
+
+
+def check_database(args):
+    """
+    Проверка результатов в базе данных
+    """
+    url = read_only_url(args.url)
+    if url.startswith('sqlite:') and not os.path.exists(url.split(':///', 1)[1].split('?', 1)[0]):
+        print(f"База данных {url} не найдена!")
+        print("Убедитесь, что DAG был выполнен успешно и каталог results/ смонтирован в контейнеры.")
+        return 1
+
+    backend = get_backend(url)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        
-        # Проверка существования таблицы
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        
-        print("Найденные таблицы в базе данных:")
-        for table in tables:
-            print(f"  - {table[0]}")
-        
-        if ('retention_analysis',) not in tables:
-            print("\nТаблица 'retention_analysis' не найдена!")
-            return
-        
-        # Чтение результатов анализа
-        query = """
-        SELECT 
-            category,
-            total_installs,
-            total_uninstalls,
-            retained_users,
-            retention_rate,
-            churn_rate,
-            analysis_date
-        FROM retention_analysis 
-        ORDER BY retention_rate DESC
-        """
-        
-        df = pd.read_sql_query(query, conn)
-        
-        print(f"\nРезультаты анализа коэффициента удержания:")
-        print("=" * 80)
-        print(df.to_string(index=False))
-        
-        # Общая статистика
-        total_installs = df['total_installs'].sum()
-        total_uninstalls = df['total_uninstalls'].sum()
-        overall_retention = (total_installs - total_uninstalls) / total_installs * 100
-        
-        print(f"\nОбщая статистика:")
-        print(f"  Общее количество установок: {total_installs:,}")
-        print(f"  Общее количество удалений: {total_uninstalls:,}")
-        print(f"  Общий коэффициент удержания: {overall_retention:.2f}%")
-        
-        # Лучшая и худшая категории
-        best_category = df.iloc[0]
-        worst_category = df.iloc[-1]
-        
-        print(f"\nЛучший показатель удержания:")
-        print(f"  {best_category['category']}: {best_category['retention_rate']:.2f}%")
-        
-        print(f"\nТребует внимания:")
-        print(f"  {worst_category['category']}: {worst_category['retention_rate']:.2f}%")
-        
-        conn.close()
-        
+        tables = backend.list_tables()
+        if args.tables:
+            print("Найденные таблицы в базе данных:")
+            for table in tables:
+                print(f"  - {table}")
+            return 0
+
+        table = 'retention_analysis'
+        if args.quarantine:
+            table = 'validation_counts'
+        elif args.sketches:
+            table = 'department_sketches'
+        elif args.cube:
+            table = 'retention_cube'
+        if table not in tables:
+            print(f"Таблица '{table}' не найдена!")
+            return 1
+
+        if args.sketches:
+            return check_sketches(backend, args)
+        if args.cube:
+            return check_cube(backend, args)
+
+        if args.quarantine:
+            query, params = quarantine_query(args)
+            columns = QUARANTINE_COLUMNS
+        elif args.dates:
+            query, params = dates_query(args)
+            columns = DATE_COLUMNS
+        else:
+            # Без фильтров показывается последний раздел, с --top - лучшие строки за все время
+            if not (args.date or args.date_from or args.date_to or args.department or args.top):
+                args.date = latest_date(backend)
+                if args.date is None:
+                    print("Таблица 'retention_analysis' пуста")
+                    return 0
+            query, params = results_query(args)
+            columns = RESULT_COLUMNS
+
+        if args.explain:
+            explain(backend, query, params)
+
+        summary = ResultsSummary() if columns is RESULT_COLUMNS and args.format == 'table' else None
+        if args.format == 'table' and columns is RESULT_COLUMNS:
+            print(f"Результаты анализа ({describe_filters(args)}):")
+        rows = stream(backend, query, params, WRITERS[args.format](sys.stdout, columns), summary)
+        if args.format == 'table':
+            print_summary(rows, summary, args)
+        return 0
+
+    except BrokenPipeError:
+        raise
     except Exception as e:
         print(f"Ошибка при проверке базы данных: {str(e)}")
+        return 1
+    finally:
+        backend.close()
 
-def copy_result_files():
-    """Копирование файлов результатов из контейнера"""
-    container_name = check_docker_container()
-    if not container_name:
-        print("Контейнер scheduler не найден для копирования файлов!")
-        return
-    
-    files_to_copy = [
-        ('/opt/airflow/retention_analysis_report.txt', 'retention_analysis_report.txt'),
-        ('/opt/airflow/retention_analysis_data.csv', 'retention_analysis_data.csv')
-    ]
-    
-    print(f"\n📁 Копируем файлы результатов из контейнера {container_name}...")
-    
-    for container_path, local_path in files_to_copy:
-        try:
-            subprocess.run([
-                'sudo', 'docker', 'cp', 
-                f'{container_name}:{container_path}', 
-                local_path
-            ], check=True)
-            print(f"✅ Скопирован файл: {local_path}")
-            
-            # Показываем размер файла
-            if os.path.exists(local_path):
-                size = os.path.getsize(local_path)
-                print(f"   Размер файла: {size} байт")
-                
-        except subprocess.CalledProcessError:
-            print(f"⚠️  Файл {container_path} не найден в контейнере")
-    
-    print("\n📄 Доступные файлы результатов:")
-    for _, local_path in files_to_copy:
-        if os.path.exists(local_path):
-            print(f"✅ {local_path}")
-        else:
-            print(f"❌ {local_path} - не найден")
 
-def show_help():
-    """Показать справку по использованию скрипта"""
-    print("""
-🔍 СКРИПТ ПРОВЕРКИ РЕЗУЛЬТАТОВ АНАЛИЗА КОЭФФИЦИЕНТА УДЕРЖАНИЯ
+def check_sketches(backend, args):
+    """
+    Статистика по отделам на последнюю дату периода из скетчей: одна строка на отдел
+    """
+    from retention.sketches import SKETCH_STAT_COLUMNS, sketch_query, sketch_stats
 
-Использование:
-    python3 check_results.py [опция]
+    date_from, date_to = args.date_from or args.date, args.date_to or args.date
+    if args.explain:
+        query, params = sketch_query(date_from, date_to, args.department or ())
+        explain(backend, query, params)
 
-Опции:
-    (без параметров)  - Проверить результаты в базе данных
-    --files          - Скопировать файлы результатов из контейнера
-    --help           - Показать эту справку
+    if args.format == 'table':
+        print(f"Статистика по скетчам ({describe_filters(args)}):")
+    rows = write_batches(
+        sketch_stats(backend, date_from, date_to, args.department or ()),
+        WRITERS[args.format](sys.stdout, SKETCH_STAT_COLUMNS),
+    )
+    if args.format == 'table':
+        print(f"\nОтделов: {rows:,}")
+    return 0
+
+
+def check_cube(backend, args):
+    """
+    Ячейки куба агрегатов набора группировки args.cube: без фильтров - последний раздел,
+    с --by-period - состояние на конец каждого периода
+    """
+    from retention.cube import cube_query
+
+    if not (args.date or args.date_from or args.date_to or args.department or args.top or args.by_period):
+        args.date = latest_date(backend, 'retention_cube')
+        if args.date is None:
+            print("Таблица 'retention_cube' пуста")
+            return 0
+
+    columns = CUBE_OUTPUT_COLUMNS[args.cube] + CUBE_MEASURE_COLUMNS
+    # Название курса может быть не указано в справочнике: в выводе пустая строка
+    select = ["COALESCE(course_name, '') AS course_name" if name == 'course_name' else name for name in columns]
+    query, params = cube_query(
+        select, args.cube, args.date_from or args.date, args.date_to or args.date, args.department or (),
+        by_period=args.by_period,
+    )
+    if args.top:
+        query += "LIMIT ?"
+        params.append(args.top)
+
+    if args.explain:
+        explain(backend, query, params)
+    if args.format == 'table':
+        print(f"Куб агрегатов, набор {args.cube}{', на конец периодов' if args.by_period else ''} "
+              f"({describe_filters(args)}):")
+    rows = stream(backend, query, params, WRITERS[args.format](sys.stdout, columns))
+    if args.format == 'table':
+        print(f"\nСтрок: {rows:,}")
+    return 0
 
-Примеры:
-    python3 check_results.py           # Проверить базу данных
-    python3 check_results.py --files   # Скопировать файлы результатов
-    python3 check_results.py --help    # Показать справку
 
-Файлы результатов:
-    - retention_analysis_report.txt    # Подробный текстовый отчет
-    - retention_analysis_data.csv      # Данные в формате CSV
-    - mobile_apps_retention.db         # База данных SQLite
+def describe_filters(args):
+    parts = []
+    if args.date:
+        parts.append(f"дата {args.date}")
+    if args.date_from or args.date_to:
+        parts.append(f"даты {args.date_from or '...'} - {args.date_to or '...'}")
+    if args.department:
+        parts.append(f"отделы: {', '.join(args.department)}")
+    if args.top:
+        parts.append(f"{'последние' if args.worst else 'первые'} {args.top} по среднему баллу")
+    return ', '.join(parts) or 'все разделы'
 
-Примечание:
-    Скрипт автоматически ищет контейнер scheduler и копирует файлы из него.
-    Требуются права sudo для работы с Docker.
-    """)
+
+def print_summary(rows, summary, args):
+    print(f"\nСтрок: {rows:,}")
+    if summary is None or not summary.rows:
+        return
+    best, worst = (summary.last, summary.first) if args.worst else (summary.first, summary.last)
+    print("\nОбщая статистика:")
+    print(f"  Общее количество сотрудников: {summary.total_employees:,}")
+    print(f"  Общее количество курсов: {summary.total_courses:,}")
+    print("\nЛучший средний балл:")
+    print(f"  {best[1]} ({best[0]}): {best[4]:.2f}")
+    print("\nТребует внимания:")
+    print(f"  {worst[1]} ({worst[0]}): {worst[4]:.2f}")
+
+
+def list_result_files(directory=RESULTS_DIR):
+    """
+    Файлы отчета в смонтированном каталоге results/ (REPORT_DIR в DAG):
+    читаются на месте, без копирования из контейнера
+    """
+    if not os.path.isdir(directory):
+        print(f"Каталог результатов {directory} не найден!")
+        print("Убедитесь, что DAG был выполнен успешно и каталог results/ смонтирован в контейнеры.")
+        return 1
+
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.endswith(REPORT_FILE_SUFFIXES) and os.path.isfile(os.path.join(directory, name))
+    )
+    if not names:
+        print(f"Файлы отчета в {directory} не найдены: DAG еще не сформировал отчет")
+        return 1
+
+    print(f"📄 Файлы результатов в {directory}:")
+    for name in names:
+        print(f"✅ {os.path.join(directory, name)} ({os.path.getsize(os.path.join(directory, name)):,} байт)")
+    return 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="🔍 Проверка результатов анализа среднего балла по отделам (только чтение)",
+        epilog="""
+Примеры:
+    python3 check_results.py                                  # последний раздел
+    python3 check_results.py --date 2024-10-02 --top 5        # 5 лучших отделов за дату
+    python3 check_results.py --department IT --from 2024-10-01 # история отдела
+    python3 check_results.py --top 3 --worst                  # 3 худших отдела за все время
+    python3 check_results.py --dates                          # список разделов
+    python3 check_results.py --quarantine --date 2024-10-02   # нарушения правил проверки
+    python3 check_results.py --sketches --from 2024-07-01     # сотрудники, медиана и p90 на конец периода
+    python3 check_results.py --cube department_course --top 10 # ячейки куба за последнюю дату
+    python3 check_results.py --cube department --by-period    # куб на конец каждого периода
+    python3 check_results.py --format csv > results.csv       # выгрузка потоком
+    python3 check_results.py --files                          # файлы отчета в results/
+""",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--url', default=WAREHOUSE_URL,
+                        help="URL хранилища (sqlite:///..., duckdb:///..., postgresql://...); "
+                             "по умолчанию RETENTION_WAREHOUSE_URL или results/mobile_apps_retention.db")
+    parser.add_argument('--date', help="дата раздела (YYYY-MM-DD)")
+    parser.add_argument('--from', dest='date_from', help="начало диапазона дат (включительно)")
+    parser.add_argument('--to', dest='date_to', help="конец диапазона дат (включительно)")
+    parser.add_argument('--department', action='append', help="отдел (можно указать несколько раз)")
+    parser.add_argument('--top', type=int, help="только первые N строк по среднему баллу")
+    parser.add_argument('--worst', action='store_true', help="сортировка по возрастанию среднего балла")
+    parser.add_argument('--format', choices=sorted(WRITERS), default='table')
+    parser.add_argument('--explain', action='store_true', help="показать план запроса")
+    parser.add_argument('--by-period', action='store_true',
+                        help="с --cube: ячейки последней даты каждого периода (params cube_period)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--dates', action='store_true', help="список разделов по датам")
+    mode.add_argument('--quarantine', action='store_true', help="счетчики правил проверки данных")
+    mode.add_argument('--sketches', action='store_true',
+                      help="уникальные сотрудники, медиана и p90 оценок на конец периода по скетчам")
+    mode.add_argument('--cube', choices=GROUPING_SET_CHOICES,
+                      help="ячейки куба агрегатов набора группировки")
+    mode.add_argument('--tables', action='store_true', help="список таблиц хранилища")
+    mode.add_argument('--files', action='store_true', help="файлы отчета в смонтированном каталоге results/")
+    args = parser.parse_args(argv)
+    if args.by_period and not args.cube:
+        parser.error("--by-period используется только с --cube")
+    return args
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        if sys.argv[1] == '--files':
-            copy_result_files()
-        elif sys.argv[1] == '--help':
-            show_help()
-        else:
-            print(f"Неизвестная опция: {sys.argv[1]}")
-            print("Используйте --help для справки")
+    args = parse_args()
+    if args.files:
+        sys.exit(list_result_files())
     else:
-        check_database()
+        try:
+            sys.exit(check_database(args))
+        except BrokenPipeError:
+            # Вывод закрыт раньше конца результата (например, | head)
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(0)